@@ -0,0 +1,83 @@
+import json
+import queue
+import threading
+
+
+class Subscription:
+    """One listener's bounded queue of pre-formatted SSE messages."""
+
+    def __init__(self, maxsize):
+        self.messages = queue.Queue(maxsize=maxsize)
+        self.dropped = 0  # messages discarded because the listener fell behind
+
+    def put(self, message):
+        """Queue a message, dropping the oldest one when the queue is full."""
+        while True:
+            try:
+                self.messages.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.messages.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next message, or None when nothing arrived within `timeout`."""
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broadcaster:
+    """
+    Fan-out of events from the reception thread to any number of
+    Server-Sent Events listeners.
+
+    Each event is serialized once, however many listeners there are, and
+    publishing never blocks: a listener that cannot keep up loses its
+    oldest messages instead of slowing the reception thread down.
+    """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.subscribers = set()
+        self.latest = {}  # event name -> last message, replayed to new listeners
+        self.lock = threading.Lock()
+
+    def subscribe(self, replay=("pulse",)):
+        subscription = Subscription(self.maxsize)
+        with self.lock:
+            for event in replay:
+                if event in self.latest:
+                    subscription.put(self.latest[event])
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, event, data):
+        """Send `data` (JSON serializable) as an `event` to every listener."""
+        message = format_event(event, json.dumps(data))
+        with self.lock:
+            self.latest[event] = message
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.put(message)
+
+    def listener_count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+
+def format_event(event, data):
+    """One SSE message; `data` must not contain newlines."""
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+# sent when a listener has been idle for a while, so proxies keep the connection open
+KEEPALIVE = ": keepalive\n\n"
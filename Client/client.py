@@ -1,223 +1,99 @@
-from flask import Flask, jsonify, render_template, request
-import bluetooth
-import threading
-import queue
-import time
+from flask import Flask, Response, abort, g, jsonify, render_template, request, stream_with_context
+import concurrent.futures
+import logging
 import random
-import json
+import os
+import sys
+import time
+import numpy as np
+
+# wire format, stream framing, transports and recording shared with the transmitter (used by sessions)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+import instrument
+import logs
+import profiler
+import recorder
+from broadcast import KEEPALIVE
+import sessions
+import discovery
+
+logs.setup()  # PULSE_LOG_LEVEL=DEBUG logs every packet
+log = logging.getLogger("client")
 
 app = Flask(__name__)
 
-class BluetoothClient:
-    def __init__(self, target_name, target_port, server_address):
-        self.target_name = target_name
-        self.server_address = server_address
-        self.server_port = target_port
-        self.client_socket = None
-        self.data_thread = None
-        self.data_thread_stop_event = threading.Event()
-        self.command_queue = queue.Queue()  # Thread-safe queue for commands
-        self.is_connected = False
-        self.is_receiving_data = False
-        self.pulse_data = None  # Store pulse data to send to the frontend
-
-    def command_handler(self):
-        """Process commands from the queue in a single thread."""
-        while True:
-            command = self.command_queue.get()  # Blocks until a command is available
-            if command == "exit":
-                print("Shutting down command handler.")
-                self._handle_exit()
-                break
-            print(f"Processing command: {command}")
-            if command == "connect":
-                self._handle_connect()
-            elif command == "start":
-                self._handle_start()
-            elif command == "stop":
-                self._handle_stop()
-            elif command == "disconnect":
-                self._handle_disconnect()
-            self.command_queue.task_done()  # Mark the task as done
-
-    def queue_command(self, command):
-        """Add a command to the queue."""
-        self.command_queue.put(command)
-
-    def _handle_connect(self):
-        """Handle the connect command."""
-        if not self.is_connected:
-            if self.discover_and_pair():
-                if self.connect_to_server():
-                    print("Connection established.")
-                else:
-                    print("Failed to connect to the server.")
-            else:
-                print("Failed to pair with the server.")
-        else:
-            print("Already connected to the server.")
-
-    def _handle_start(self):
-        """Handle the start command."""
-        if self.is_connected and not self.is_receiving_data:
-            print("Starting handshake for data synchronization...")
-            self.send_command("START_SYNC")
-            response = self.receive_response()
-            print(response)
-            if response and "ACK" in response:
-                self.send_command("ACK_ACK")
-                self.start_data_reception()
-            else:
-                print("Failed to start data reception.")
-        else:
-            print("Either not connected or data reception already in progress.")
-
-    def _handle_stop(self):
-        """Handle the stop command."""
-        if self.is_receiving_data:
-            print("Stopping data reception...")
-            self.send_command("STOP_SYNC")
-            response = self.receive_response()
-            if response and "ACK" in response:
-                self.send_command("ACK_ACK")
-                self.stop_data_reception()
-            else:
-                print("Failed to stop data reception.")
-        else:
-            print("Data reception is not active.")
-
-    def _handle_disconnect(self):
-        """Handle the disconnect command."""
-        if self.is_connected:
-            if self.is_receiving_data:
-                self.stop_data_reception()
-            self.close_connection()
-            print("Disconnected from the server.")
-        else:
-            print("Not connected to any server.")
-
-    def _handle_exit(self):
-        """Handle the exit command."""
-        print("Exiting client...")
-        if self.is_connected:
-            if self.is_receiving_data:
-                self.stop_data_reception()
-            self.close_connection()
-        print("Client shut down.")
-
-    def start(self):
-        """Start the command handling thread."""
-        self.command_thread = threading.Thread(target=self.command_handler, daemon=True)
-        self.command_thread.start()
-
-    # Bluetooth interaction methods
-    def discover_and_pair(self):
-        """Discover and pair with the target device."""
-        if not self.server_address:
-            print("Scanning for nearby Bluetooth devices...")
-            nearby_devices = bluetooth.discover_devices(lookup_names=True)
-            for addr, name in nearby_devices:
-                if self.target_name.lower() in name.lower():
-                    self.server_address = addr
-                    print(f"Found server {name} at {addr}")
-                    break
-            if not self.server_address:
-                print(f"Device named '{self.target_name}' not found.")
-                return False
-        print(f"Pairing is assumed successful. Proceeding to connect.")
-        return True
-
-    def connect_to_server(self):
-        """Connect to the server."""
-        if not self.server_address:
-            print("Server address is not set. Ensure pairing is complete.")
-            return False
-        try:
-            self.client_socket = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-            self.client_socket.connect((self.server_address, self.server_port))
-            self.is_connected = True
-            print("Connected to the server.")
+HTTP_REQUEST_SECONDS = instrument.timer("pulse_http_request_seconds", "Handling one dashboard request, event streams excepted")
+HTTP_ERRORS = instrument.counter("pulse_http_errors_total", "Dashboard requests answered with a 4xx or 5xx status")
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_time(response):
+    # an event stream is open for as long as the browser keeps it, not a request duration
+    if not response.is_streamed:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_started)
+    if response.status_code >= 400:
+        HTTP_ERRORS.inc()
+    return response
+
+class BluetoothClient(sessions.DeviceSession):
+    """
+    The dashboard's transmitter, found by name (through the device cache)
+    when no address is given.
+
+    Commands are the DeviceSession coroutines, run on the device_manager
+    event loop and awaited by the Flask handlers with a timeout.
+    """
+
+    def __init__(self, target_name, target_port, server_address, record_directory=None):
+        # a day of history, as other devices keep less
+        super().__init__("default", server_address or None, target_port,
+                         history_capacity=86400, record_directory=record_directory, target_name=target_name)
+
+    @property
+    def server_address(self):
+        return self.address or self.connected_address
+
+    def _set_pulse_data(self, pulse_data):
+        if super()._set_pulse_data(pulse_data):
+            log.debug("Pulse Data: %s", self.pulse_data)
             return True
-        except bluetooth.BluetoothError as e:
-            print(f"Failed to connect to the server: {e}")
-            return False
-
-    def send_command(self, command):
-        """Send a command to the server."""
-        if self.client_socket:
-            try:
-                self.client_socket.send(command)
-                print(f"Sent command: {command}")
-            except bluetooth.BluetoothError as e:
-                print(f"Failed to send command: {e}")
-
-    def receive_response(self, timeout=20):
-        """Receive response from the server."""
-        if self.client_socket:
-            self.client_socket.settimeout(timeout)
-            try:
-                data = self.client_socket.recv(1024).decode("utf-8")
-                print(f"Received: {data}")
-                return data
-            except bluetooth.BluetoothError:
-                print("No response received within timeout.")
-        return None
-
-    def close_connection(self):
-        """Close the Bluetooth connection."""
-        if self.client_socket:
-            self.client_socket.close()
-            self.client_socket = None
-            self.is_connected = False
-            print("Disconnected from the server.")
-
-    def start_data_reception(self):
-        """Start receiving data in a separate thread."""
-        print("Starting data reception...")
-        self.data_thread_stop_event.clear()
-        self.data_thread = threading.Thread(target=self.data_reception_loop, daemon=True)
-        self.data_thread.start()
-        self.is_receiving_data = True
-
-    def data_reception_loop(self):
-        """Threaded data reception loop."""
-        while not self.data_thread_stop_event.is_set():
-            data = self.receive_response(timeout=1000)
-            if data:
-                # data = {
-                #                 "pulse": round(random.uniform(60, 100), 2),  # Random pulse value between 60 and 100
-                #                 "impulses_per_minute": random.randint(50, 120),  # Random impulses per minute
-                #                 "beats_per_minute": random.randint(50, 120),  # Random beats per minute
-                #                 "root_mean_square": round(random.uniform(2.0, 5.0), 2),  # Random RMS value
-                #                 "hrstd": round(random.uniform(0, 1), 2)  # Random heart rate standard deviation
-                #              }
-
-                pulse_data_json = json.loads(data)
-                self.pulse_data = pulse_data_json
-                # self.pulse_data = data  # Save pulse data to send to frontend
-                print(f"Pulse Data: {self.pulse_data}")
-            else:
-                print("No data received or timeout occurred. Stopping reception.")
-                self.stop_data_reception()
-                break
-
-    def stop_data_reception(self):
-        """Stop receiving data."""
-        print("Stopping data reception...")
-        self.data_thread_stop_event.set()
-        if self.data_thread:
-            self.data_thread.join()
-        self.is_receiving_data = False
+        return False
 
     def get_pulse_data(self):
         """Return the latest pulse data."""
         return self.pulse_data
-    
+
 target_server_name = "IOT_Innovator_Server"
 target_server_port = 1
-target_server_address = "2C:CF:67:03:0E:1A"
-bluetooth_client = BluetoothClient(target_server_name, target_server_port, target_server_address)
-bluetooth_client.start()
+# PULSE_SERVER=tcp:127.0.0.1:5555 talks to a server started with PULSE_LISTEN=tcp:0.0.0.0:5555,
+# an empty PULSE_SERVER finds target_server_name by Bluetooth inquiry (cached in PULSE_DEVICE_CACHE)
+target_server_address = os.environ.get("PULSE_SERVER", "2C:CF:67:03:0E:1A")
+record_directory = os.environ.get("PULSE_RECORD_DIR")  # e.g. /home/pi/recordings/tonight
+bluetooth_client = BluetoothClient(target_server_name, target_server_port, target_server_address, record_directory)
+
+# the dashboard's transmitter is device "default"; more of them, e.g.
+# PULSE_DEVICES=bed1=tcp:10.0.0.5:5555,bed2=2C:CF:67:03:0E:1B, are served
+# under /devices/<id>/, all by one event loop thread
+device_discovery = discovery.Discovery(
+    discovery.DeviceCache(os.environ.get("PULSE_DEVICE_CACHE", discovery.DEFAULT_CACHE_PATH)))
+device_manager = sessions.SessionManager(discovery=device_discovery)
+device_manager.register(bluetooth_client)
+for device_id, device_address in sessions.parse_devices(os.environ.get("PULSE_DEVICES", "")):
+    device_manager.add(device_id, device_address, target_server_port)
+device_manager.start()
+
+def run_command(device_id, command, done_status):
+    """Run a device command and answer once it has completed (or failed)."""
+    try:
+        device_manager.call(device_id, command)
+    except sessions.CommandError as e:
+        return jsonify({"status": f"{command} failed: {e}"}), 409
+    except concurrent.futures.TimeoutError:
+        return jsonify({"status": f"{command} timed out"}), 504
+    return jsonify({"status": done_status}), 200
 
 # Route to serve the HTML page for the frontend
 @app.route('/')
@@ -226,23 +102,19 @@ def index():
 
 @app.route('/connect', methods=['POST'])
 def connect():
-    bluetooth_client.queue_command("connect")
-    return jsonify({"status": "Connected to server"}), 200
+    return run_command(bluetooth_client.device_id, "connect", "Connected to server")
 
 @app.route('/disconnect', methods=['POST'])
 def disconnect():
-    bluetooth_client.queue_command("disconnect")
-    return jsonify({"status": "Disconnected from server"}), 200
+    return run_command(bluetooth_client.device_id, "disconnect", "Disconnected from server")
 
 @app.route('/start', methods=['POST'])
 def start():
-    bluetooth_client.queue_command("start")
-    return jsonify({"status": "Data reception started"}), 200
+    return run_command(bluetooth_client.device_id, "start", "Data reception started")
 
 @app.route('/stop', methods=['POST'])
 def stop():
-    bluetooth_client.queue_command("stop")
-    return jsonify({"status": "Data reception stopped"}), 200
+    return run_command(bluetooth_client.device_id, "stop", "Data reception stopped")
 
 @app.route('/get_pulse_data', methods=['GET'])
 def get_pulse_data():
@@ -250,5 +122,138 @@ def get_pulse_data():
         return jsonify({"pulsedata": bluetooth_client.pulse_data}), 200
     return jsonify({"pulsedata": None}), 200
 
+def history_response(metric_history):
+    # ?since=&until= are unix timestamps, ?step= a bucket width in seconds
+    since = request.args.get('since', default=None, type=float)
+    until = request.args.get('until', default=None, type=float)
+    step = request.args.get('step', default=None, type=float)
+    if step is not None and step <= 0:
+        return jsonify({"error": "step must be positive"}), 400
+    return jsonify({"history": metric_history.query(since, until, step)}), 200
+
+@app.route('/history', methods=['GET'])
+def history():
+    return history_response(bluetooth_client.history)
+
+@app.route('/recording', methods=['GET'])
+def recording():
+    # pulse data recorded to disk between two unix timestamps
+    if not record_directory:
+        return jsonify({"error": "recording is off, set PULSE_RECORD_DIR"}), 404
+    since = request.args.get('since', default=None, type=float)
+    until = request.args.get('until', default=None, type=float)
+    records = recorder.RecordingReader(record_directory, "pulse").query(since, until)
+    columns = {name: records[name].tolist() for name in ("timestamp", "seq")}
+    for name in records.dtype.names[2:]:
+        column = records[name].astype(np.float64)
+        columns[name] = np.where(np.isnan(column), None, column).tolist()
+    return jsonify({"recording": columns}), 200
+
+def stream_response(broadcaster):
+    # Server-Sent Events: "pulse" events with the pulse data, "raw" events with waveform chunks
+    def events():
+        subscription = broadcaster.subscribe()
+        try:
+            while True:
+                message = subscription.get(timeout=15)
+                yield message if message is not None else KEEPALIVE
+        finally:
+            # runs when the browser goes away and the generator is closed
+            broadcaster.unsubscribe(subscription)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
+@app.route('/stream', methods=['GET'])
+def stream():
+    return stream_response(bluetooth_client.broadcaster)
+
+@app.route('/start_raw', methods=['POST'])
+def start_raw():
+    return run_command(bluetooth_client.device_id, "start_raw", "Raw waveform streaming started")
+
+@app.route('/stop_raw', methods=['POST'])
+def stop_raw():
+    return run_command(bluetooth_client.device_id, "stop_raw", "Raw waveform streaming stopped")
+
+@app.route('/get_raw_data', methods=['GET'])
+def get_raw_data():
+    # samples after the transmitter sample index `since`, at most `limit` of them
+    since = request.args.get('since', default=-1, type=int)
+    limit = request.args.get('limit', default=None, type=int)
+    return jsonify({"rawdata": bluetooth_client.waveform.since(since, limit)}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text format: counters and timers of the receive path, per-device gauges
+    return Response(instrument.render(), content_type=instrument.CONTENT_TYPE)
+
+@app.route('/profile', methods=['GET'])
+def profile_status():
+    # sampling profiler of this process (see Common/profiler.py), off until started
+    return jsonify(profiler.PROFILER.status()), 200
+
+@app.route('/profile/start', methods=['POST'])
+def profile_start():
+    # ?rate= samples per second, ?duration= seconds before it stops by itself
+    rate = request.args.get('rate', default=profiler.DEFAULT_RATE, type=float)
+    duration = request.args.get('duration', default=profiler.DEFAULT_DURATION, type=float)
+    try:
+        started = profiler.PROFILER.start(rate, duration, profiler.default_directory())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not started:
+        return jsonify({"error": "already profiling", **profiler.PROFILER.status()}), 409
+    log.info("Profiling at %g samples/s for at most %g s", rate, duration)
+    return jsonify(profiler.PROFILER.status()), 200
+
+@app.route('/profile/stop', methods=['POST'])
+def profile_stop():
+    if not profiler.PROFILER.stop():
+        return jsonify({"error": "not profiling", **profiler.PROFILER.status()}), 409
+    log.info("Profile written to %s", profiler.PROFILER.output)
+    return jsonify(profiler.PROFILER.status()), 200
+
+@app.route('/profile/stacks', methods=['GET'])
+def profile_stacks():
+    # collapsed stacks of the current or last run, for flamegraph.pl or speedscope
+    return Response(profiler.PROFILER.collapsed(), mimetype='text/plain')
+
+@app.route('/devices', methods=['GET'])
+def devices():
+    # every transmitter's state and latest pulse data in one response
+    return jsonify(device_manager.snapshot()), 200
+
+def find_device(device_id):
+    session = device_manager.get(device_id)
+    if session is None:
+        abort(404, description=f"no device {device_id!r}")
+    return session
+
+@app.route('/devices/<device_id>', methods=['GET'])
+def device(device_id):
+    return jsonify(find_device(device_id).snapshot()), 200
+
+@app.route('/devices/<device_id>/<command>', methods=['POST'])
+def device_command(device_id, command):
+    # connect, start, stop, start_raw, stop_raw or disconnect; answers once the command has completed
+    session = find_device(device_id)
+    if command not in sessions.COMMANDS:
+        abort(404, description=f"unknown command {command!r}")
+    response, status = run_command(device_id, command, "ok")
+    return jsonify({**response.get_json(), "device": session.snapshot()}), status
+
+@app.route('/devices/<device_id>/pulse_data', methods=['GET'])
+def device_pulse_data(device_id):
+    return jsonify({"pulsedata": find_device(device_id).pulse_data}), 200
+
+@app.route('/devices/<device_id>/history', methods=['GET'])
+def device_history(device_id):
+    return history_response(find_device(device_id).history)
+
+@app.route('/devices/<device_id>/stream', methods=['GET'])
+def device_stream(device_id):
+    return stream_response(find_device(device_id).broadcaster)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import bluetooth  # PyBluez, only needed to find transmitters by name
+except ImportError:
+    bluetooth = None
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHANNEL = 1
+# addresses rarely change, a failed connect invalidates an entry long before this
+CACHE_TTL = 7 * 86400
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "pulse-monitor", "devices.json")
+
+
+class DeviceCache:
+    """
+    Bluetooth name -> (address, RFCOMM channel), kept in a JSON file so a
+    rebooted receiver connects without a ten second inquiry.
+
+    Entries older than `ttl` seconds are ignored; invalidate() drops one
+    whose address stopped working.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # write then rename, a reboot mid-write must not leave half a file
+            temporary = f"{self.path}.tmp"
+            with open(temporary, "w") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            log.warning("Could not save the device cache to %s: %s", self.path, e)
+
+    def get(self, name):
+        """(address, channel) for `name`, or None when unknown or stale."""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None or time.time() - entry.get("updated", 0) > self.ttl:
+                return None
+            return entry["address"], entry["channel"]
+
+    def put(self, name, address, channel):
+        with self.lock:
+            self.entries[name] = {"address": address, "channel": channel, "updated": time.time()}
+            self._save()
+
+    def invalidate(self, name):
+        with self.lock:
+            if self.entries.pop(name, None) is not None:
+                self._save()
+
+
+class Discovery:
+    """
+    Finds transmitters by Bluetooth name: from the cache when it can, else
+    from an inquiry followed by an SDP lookup of the RFCOMM channel.
+
+    Lookups are coroutines on the session event loop and the blocking
+    PyBluez calls run on its executor. Lookups that overlap share one
+    inquiry (the radio can only run one, and it takes about ten seconds),
+    and the SDP lookups for the devices found run in parallel.
+    """
+
+    def __init__(self, cache, default_channel=DEFAULT_CHANNEL):
+        self.cache = cache
+        self.default_channel = default_channel
+        self.inquiry = None  # future of the inquiry in progress
+
+    async def lookup(self, name):
+        """
+        Returns:
+            tuple: (address, channel) of the device whose name contains `name`.
+
+        Raises:
+            LookupError: when PyBluez is missing or no such device answered.
+        """
+        cached = self.cache.get(name)
+        if cached is not None:
+            return cached
+        if bluetooth is None:
+            raise LookupError("PyBluez is not installed, cannot scan for the server. Set its address instead.")
+        loop = asyncio.get_running_loop()
+        for address, found_name in await self._inquire():
+            if name.lower() in (found_name or "").lower():
+                channel = await loop.run_in_executor(None, self._find_channel, address, name)
+                log.info("Found %s at %s, RFCOMM channel %s", found_name, address, channel)
+                self.cache.put(name, address, channel)
+                return address, channel
+        raise LookupError(f"Device named '{name}' not found.")
+
+    def invalidate(self, name):
+        self.cache.invalidate(name)
+
+    def prefetch(self, names):
+        """Look up every uncached name in the background; returns the task, or None if all are cached."""
+        missing = [name for name in names if self.cache.get(name) is None]
+        if not missing:
+            return None
+
+        async def lookup_all():
+            results = await asyncio.gather(*(self.lookup(name) for name in missing), return_exceptions=True)
+            for name, result in zip(missing, results):
+                if isinstance(result, Exception):
+                    log.warning("Background lookup of '%s' failed: %s", name, result)
+
+        return asyncio.get_running_loop().create_task(lookup_all())
+
+    async def _inquire(self):
+        if self.inquiry is None:
+            log.info("Scanning for nearby Bluetooth devices...")
+            self.inquiry = asyncio.get_running_loop().run_in_executor(
+                None, lambda: bluetooth.discover_devices(lookup_names=True))
+            self.inquiry.add_done_callback(self._inquiry_done)
+        # shielded: one lookup giving up must not cancel the inquiry the others wait for
+        return await asyncio.shield(self.inquiry)
+
+    def _inquiry_done(self, future):
+        self.inquiry = None
+
+    def _find_channel(self, address, name):
+        """
+        RFCOMM channel of the device's serial port (or `name`d) service over
+        SDP, the default channel when it advertises none. Other RFCOMM
+        services (OBEX, headsets, ...) are not ours.
+        """
+        try:
+            services = bluetooth.find_service(address=address)
+        except bluetooth.BluetoothError as e:
+            log.warning("SDP lookup on %s failed: %s", address, e)
+            return self.default_channel
+        for service in services:
+            service_name = (service.get("name") or "").lower()
+            if (service.get("protocol") == "RFCOMM" and service.get("port")
+                    and ("serial" in service_name or name.lower() in service_name)):
+                return service["port"]
+        return self.default_channel
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import numpy as np
+
+METRICS = ("beats_per_minute", "impulses_per_minute", "root_mean_square", "hrstd")
+
+
+class MetricHistory:
+    """
+    Every pulse data packet received, in preallocated columns that wrap
+    around after `capacity` packets (a day at one packet per second by
+    default), so memory stays fixed however long the receiver runs.
+
+    Missing metrics are stored as NaN and returned as None.
+    """
+
+    def __init__(self, capacity=86400):
+        self.capacity = capacity
+        self.timestamp = np.zeros(capacity, dtype=np.float64)
+        self.seq = np.full(capacity, -1, dtype=np.int64)  # -1 when the packet had none
+        self.values = np.full((len(METRICS), capacity), np.nan, dtype=np.float64)
+        self.count = 0  # packets ever appended
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, pulse_data):
+        timestamp = pulse_data.get("timestamp")
+        seq = pulse_data.get("seq")
+        row = [pulse_data.get(metric) for metric in METRICS]
+        with self.lock:
+            slot = self.count % self.capacity
+            self.timestamp[slot] = time.time() if timestamp is None else timestamp
+            self.seq[slot] = -1 if seq is None else seq
+            self.values[:, slot] = [np.nan if v is None else v for v in row]
+            self.count += 1
+
+    def _ordered(self):
+        """Indices of the stored packets, oldest first."""
+        n = len(self)
+        return (self.count - n + np.arange(n)) % self.capacity
+
+    def query(self, since=None, until=None, step=None):
+        """
+        Packets with since <= timestamp < until.
+
+        Without `step` every packet is returned. With `step` (seconds) the
+        range is cut into buckets of that width starting at `since` (or the
+        first packet), and each non-empty bucket is returned as the min,
+        max and mean of every metric and the packet count.
+
+        Returns:
+            dict: columns of equal length, as lists for JSON.
+        """
+        with self.lock:
+            order = self._ordered()
+            timestamp = self.timestamp[order]
+            # timestamps come from the transmitter and only go forwards, so the range is a slice
+            start = 0 if since is None else np.searchsorted(timestamp, since, side='left')
+            end = len(timestamp) if until is None else np.searchsorted(timestamp, until, side='left')
+            order = order[start:end]
+            timestamp = timestamp[start:end]
+            seq = self.seq[order]
+            values = self.values[:, order]
+
+        if not step:
+            result = {"timestamp": timestamp.tolist(), "seq": seq.tolist()}
+            for metric, column in zip(METRICS, values):
+                result[metric] = _nullable(column)
+            return result
+
+        if len(timestamp) == 0:
+            result = {"timestamp": [], "count": []}
+            for metric in METRICS:
+                result[metric] = {"min": [], "max": [], "mean": []}
+            return result
+        origin = timestamp[0] if since is None else since
+        bucket = np.floor((timestamp - origin) / step).astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+        result = {
+            "timestamp": (origin + bucket[starts] * step).tolist(),
+            "count": np.diff(np.append(starts, len(bucket))).tolist(),
+        }
+        present = ~np.isnan(values)
+        totals = np.add.reduceat(np.where(present, values, 0.0), starts, axis=1)
+        counts = np.add.reduceat(present.astype(np.int64), starts, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = totals / counts
+        # fmin/fmax skip NaN unless the whole bucket is NaN
+        minima = np.fmin.reduceat(values, starts, axis=1)
+        maxima = np.fmax.reduceat(values, starts, axis=1)
+        for i, metric in enumerate(METRICS):
+            result[metric] = {
+                "min": _nullable(minima[i]),
+                "max": _nullable(maxima[i]),
+                "mean": _nullable(means[i]),
+            }
+        return result
+
+
+def _nullable(column):
+    """Float column as a list with None in place of NaN."""
+    return np.where(np.isnan(column), None, column).tolist()
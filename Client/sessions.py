@@ -0,0 +1,561 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+# shared with the transmitter, client.py puts Common/ on the path
+import framing
+import instrument
+import recorder
+import transport
+import wire
+from broadcast import Broadcaster
+from history import MetricHistory
+from waveform import WaveformBuffer, chunk_samples
+
+# connection states of a DeviceSession
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+RECONNECTING = "reconnecting"
+CONNECTED = "connected"
+SYNC_PENDING = "sync_pending"
+STREAMING = "streaming"
+STOP_PENDING = "stop_pending"
+
+COMMANDS = ("connect", "start", "stop", "start_raw", "stop_raw", "disconnect")
+
+RECV_SIZE = 4096  # initial receive buffer, it grows for larger frames
+# a streaming transmitter sends a packet a second; this much silence means the link is gone
+SILENCE_TIMEOUT = 15
+# reconnect delays after a dropped link: random in [0, min(MAX, BASE * 2**attempt)] seconds
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+# an old transmitter ignores RESUME, give up on it quickly and START_SYNC instead
+RESUME_TIMEOUT = 5
+# six hours at one packet per second, per device; 1 MB each instead of the
+# single-device client's 4 MB day
+HISTORY_CAPACITY = 21600
+
+# an address of "name:<bluetooth name>" is looked up (see discovery.py) instead of dialled
+NAME_PREFIX = "name:"
+
+_DEVICE_ID = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+logger = logging.getLogger(__name__)
+
+BYTES_RECEIVED = instrument.counter("pulse_bytes_received_total", "Bytes received from all transmitters")
+PULSE_PACKETS = instrument.counter("pulse_packets_received_total", "Pulse packets received, duplicates included")
+DUPLICATE_PACKETS = instrument.counter("pulse_duplicate_packets_total", "Pulse packets received twice and dropped")
+RAW_FRAMES = instrument.counter("pulse_raw_frames_received_total", "Raw waveform frames received")
+UNDECODABLE = instrument.counter("pulse_undecodable_frames_total", "Received data dropped because it could not be decoded")
+DECODE_SECONDS = instrument.timer("pulse_decode_seconds", "Decoding one frame from the received bytes")
+HANDLE_SECONDS = instrument.timer("pulse_handle_seconds", "Storing and publishing one decoded frame")
+
+
+class CommandError(Exception):
+    """A device command that failed or does not apply in the session's state."""
+
+
+def parse_devices(spec):
+    """
+    Parse a device list such as "bed1=tcp:10.0.0.5:5555,bed2=2C:CF:67:03:0E:1A,bed3=name:Bed3_Server".
+
+    Returns:
+        list: (device id, address) pairs in the given order.
+
+    Raises:
+        ValueError: for a malformed entry, an id that is not URL-safe or a repeated id.
+    """
+    devices = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        device_id, sep, address = entry.partition("=")
+        device_id, address = device_id.strip(), address.strip()
+        if not sep or not address:
+            raise ValueError(f"device entry needs id=address: {entry!r}")
+        if not _DEVICE_ID.match(device_id):
+            raise ValueError(f"device id may only use letters, digits, '_', '.' and '-': {device_id!r}")
+        if device_id in (known for known, _ in devices):
+            raise ValueError(f"device id given twice: {device_id!r}")
+        if not address.startswith(NAME_PREFIX):
+            transport.parse_address(transport.resolve(address))
+        devices.append((device_id, address))
+    return devices
+
+
+class DeviceSession:
+    """
+    One transmitter: its connection, handshake state and received data.
+
+    The commands are coroutines run on the SessionManager's event loop and
+    serialized per device, each bounded by a timeout; reception is a task
+    on the same loop reading a non-blocking socket, so a session costs no
+    thread of its own and a command never waits on a blocked recv(). The
+    received data (pulse_data, history, waveform, broadcaster) may be read
+    from any thread.
+
+    When the link drops on its own the session reconnects with jittered
+    exponential backoff and, if it was streaming, RESUMEs after the last
+    packet it saw so the transmitter replays what was missed. Packets
+    that arrive twice are dropped, and gaps are counted in lost_packets.
+    """
+
+    def __init__(self, device_id, address, port=transport.DEFAULT_RFCOMM_CHANNEL,
+                 history_capacity=HISTORY_CAPACITY, record_directory=None, target_name=None):
+        self.device_id = device_id
+        self.address = address
+        self.port = port
+        self.target_name = target_name  # looked up when there is no address
+        if address and address.startswith(NAME_PREFIX):
+            self.address, self.target_name = None, address[len(NAME_PREFIX):]
+        self.discovery = None  # set by the SessionManager
+        self.connected_address = None
+        self.state = DISCONNECTED
+        self.sock = None
+        self.reader = framing.FrameReader(RECV_SIZE)
+        self.wire_format = wire.FORMAT_JSON  # negotiated in the START_SYNC handshake
+        self.responses = asyncio.Queue()  # text responses, None when the connection closes
+        self.receive_task = None
+        self.lock = asyncio.Lock()  # one command at a time per device
+        self.pulse_data = None
+        self.packets = 0
+        self.last_received = None  # unix time of the last frame
+        self.last_error = None
+        self.is_receiving_raw = False
+        self.auto_reconnect = True
+        self.want_streaming = False  # streaming was asked for and not stopped, resume it after a dropout
+        self.reconnect_task = None
+        self.reconnects = 0
+        self.last_seq = None  # sequence number of the last pulse packet
+        self.lost_packets = 0  # sequence numbers never received, even after RESUME
+        self.history = MetricHistory(history_capacity)
+        self.waveform = WaveformBuffer()  # raw samples, filled while raw streaming is on
+        self.broadcaster = Broadcaster()
+        # on-disk recording of the session, off unless a directory is given
+        self.recorder = recorder.Recorder(record_directory) if record_directory else None
+
+    @property
+    def is_connected(self):
+        return self.sock is not None
+
+    @property
+    def is_receiving_data(self):
+        return self.state in (STREAMING, STOP_PENDING)
+
+    def log(self, message, level=logging.INFO):
+        # a logger per device and the caller's line: the rate limit applies per device and call site
+        logger.getChild(self.device_id).log(level, "%s", message, stacklevel=2)
+
+    async def connect(self, timeout=10):
+        async with self.lock:
+            if self.sock is not None:
+                return
+            self.state = CONNECTING
+            loop = asyncio.get_running_loop()
+            try:
+                address, channel = await self.resolve_address()
+                # RFCOMM paging and name lookups block, so the connect itself runs on the executor
+                sock = await loop.run_in_executor(
+                    None, transport.connect, transport.resolve(address, channel), timeout)
+            except CommandError:
+                self.state = DISCONNECTED
+                raise
+            except OSError as e:
+                self.state = DISCONNECTED
+                self.last_error = str(e)
+                if not self.address and self.discovery:
+                    # the cached address may be stale, look it up afresh next time
+                    self.discovery.invalidate(self.target_name)
+                raise CommandError(f"connect failed: {e}") from e
+            sock.setblocking(False)
+            self.sock = sock
+            self.connected_address = address
+            self.reader.reset()
+            self.responses = asyncio.Queue()
+            self.state = CONNECTED
+            self.receive_task = loop.create_task(self._receive(sock))
+            self.log(f"connected to {address}")
+
+    async def resolve_address(self):
+        """(address, RFCOMM channel) to connect to: the configured one, else looked up by name."""
+        if self.address:
+            return self.address, self.port
+        if self.target_name and self.discovery:
+            try:
+                return await self.discovery.lookup(self.target_name)
+            except LookupError as e:
+                raise CommandError(str(e)) from e
+        raise CommandError("no server address")
+
+    async def start(self, timeout=20):
+        async with self.lock:
+            if self.state != CONNECTED:
+                raise CommandError(f"cannot start while {self.state}")
+            self.last_seq = None  # a fresh stream, the transmitter may have restarted
+            await self._sync("START_SYNC", timeout)
+            self.want_streaming = True
+
+    async def resume(self, timeout=20):
+        """Start streaming again after the last packet seen, replaying what was missed."""
+        async with self.lock:
+            if self.state != CONNECTED:
+                raise CommandError(f"cannot resume while {self.state}")
+            if self.last_seq is not None:
+                try:
+                    await self._sync(f"RESUME {self.last_seq}", min(timeout, RESUME_TIMEOUT))
+                    return
+                except CommandError as e:
+                    if self.sock is None:
+                        raise
+                    self.log(f"{e}, starting a new stream", logging.WARNING)
+            self.last_seq = None
+            await self._sync("START_SYNC", timeout)
+
+    async def _sync(self, command, timeout):
+        """START_SYNC or RESUME handshake, with the lock held."""
+        self.state = SYNC_PENDING
+        response = await self._request(command, timeout)
+        if not response or not response.startswith("ACK"):
+            self._settle(CONNECTED)
+            raise CommandError(f"{command.split()[0]} not acknowledged: {response}")
+        # servers that speak the binary format list it after their ACK
+        if wire.FORMAT_BINARY in wire.parse_formats(response):
+            self.wire_format = wire.FORMAT_BINARY
+            await self._send(f"ACK_ACK {wire.FORMAT_BINARY}")
+        else:
+            self.wire_format = wire.FORMAT_JSON
+            await self._send("ACK_ACK")
+        self._settle(STREAMING)
+        self.log(f"streaming after {command}, wire format {self.wire_format}")
+
+    async def stop(self, timeout=20):
+        async with self.lock:
+            if self.state != STREAMING:
+                raise CommandError(f"cannot stop while {self.state}")
+            self.state = STOP_PENDING
+            response = await self._request("STOP_SYNC", timeout)
+            if not response or not response.startswith("ACK"):
+                self._settle(STREAMING)
+                raise CommandError(f"STOP_SYNC not acknowledged: {response}")
+            await self._send("ACK_ACK")
+            self.want_streaming = False
+            self.is_receiving_raw = False  # the server turns raw streaming off with STOP_SYNC
+            self._settle(CONNECTED)
+            self.log("stopped")
+
+    async def start_raw(self, decimation=1, timeout=20):
+        """Ask the server to stream raw samples alongside the metrics."""
+        async with self.lock:
+            if self.state != STREAMING or self.wire_format != wire.FORMAT_BINARY:
+                raise CommandError("raw streaming needs an active binary data stream")
+            self.waveform.clear()
+            response = await self._request(f"RAW_SYNC on {decimation}", timeout)
+            if not response or not response.startswith("ACK"):
+                raise CommandError(f"RAW_SYNC not acknowledged: {response}")
+            self.is_receiving_raw = True
+            self.log(f"raw waveform streaming started: {response}")
+
+    async def stop_raw(self, timeout=20):
+        """Stop the raw sample stream, the metrics keep coming."""
+        async with self.lock:
+            if not self.is_receiving_raw:
+                raise CommandError("raw waveform streaming is not active")
+            response = await self._request("RAW_SYNC off", timeout)
+            if not response or not response.startswith("ACK"):
+                raise CommandError(f"RAW_SYNC off not acknowledged: {response}")
+            self.is_receiving_raw = False
+
+    async def disconnect(self):
+        # not under the lock: a disconnect must not wait out a pending handshake
+        self.want_streaming = False
+        reconnect, self.reconnect_task = self.reconnect_task, None
+        if reconnect is not None and reconnect is not asyncio.current_task():
+            reconnect.cancel()
+        task, self.receive_task = self.receive_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._close()
+        self.state = DISCONNECTED
+
+    async def _reconnect(self):
+        """Reconnect with jittered exponential backoff until it works or disconnect() cancels it."""
+        attempt = 0
+        while True:
+            self.state = RECONNECTING
+            delay = random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt))
+            attempt += 1
+            self.log(f"link lost, reconnect attempt {attempt} in {delay:.1f} s", logging.WARNING)
+            await asyncio.sleep(delay)
+            try:
+                if self.sock is None:
+                    await self.connect()
+                if self.want_streaming:
+                    await self.resume()
+            except CommandError as e:
+                self.log(f"reconnect attempt {attempt} failed: {e}", logging.WARNING)
+                continue
+            self.reconnects += 1
+            self.reconnect_task = None
+            return
+
+    async def shutdown(self):
+        """Disconnect and close the recording."""
+        await self.disconnect()
+        if self.recorder:
+            self.recorder.close()
+
+    def _settle(self, state):
+        """Enter `state` at the end of a handshake, unless the connection went away meanwhile."""
+        if self.sock is not None:
+            self.state = state
+
+    def _close(self):
+        if self.sock is None:
+            return
+        self.sock.close()
+        self.sock = None
+        self.state = DISCONNECTED
+        self.is_receiving_raw = False
+        self.responses.put_nowait(None)  # wakes a command waiting for a response
+        self.log("disconnected")
+
+    async def _send(self, command):
+        if self.sock is None:
+            raise CommandError("not connected")
+        try:
+            await asyncio.get_running_loop().sock_sendall(self.sock, framing.encode_text(command))
+        except OSError as e:
+            self.last_error = str(e)
+            raise CommandError(f"send failed: {e}") from e
+
+    async def _request(self, command, timeout):
+        """Send a command and wait for the next text response, None on timeout or disconnect."""
+        while not self.responses.empty():
+            self.responses.get_nowait()  # a late answer to an earlier command
+        await self._send(command)
+        try:
+            return await asyncio.wait_for(self.responses.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _receive(self, sock):
+        loop = asyncio.get_running_loop()
+        reader = self.reader
+        try:
+            while True:
+                silence = SILENCE_TIMEOUT if self.state == STREAMING else None
+                line_pending = reader.waiting_for_newline()
+                # received straight into the reader's buffer, no bytes object per recv
+                reader.make_room()
+                try:
+                    n = await asyncio.wait_for(loop.sock_recv_into(sock, reader.view[reader.end:]),
+                                               framing.LINE_TIMEOUT if line_pending else silence)
+                except asyncio.TimeoutError:
+                    if line_pending:
+                        # an old transmitter, it sends no newline after its messages
+                        self._handle_frames(time.perf_counter(), unterminated=True)
+                        continue
+                    self.log(f"no data for {silence} s, closing the connection", logging.WARNING)
+                    break
+                if not n:
+                    break
+                reader.end += n
+                BYTES_RECEIVED.inc(n)
+                # a recv may hold several packets, or only part of one
+                self._handle_frames(time.perf_counter())
+        except OSError as e:
+            self.last_error = str(e)
+        if self.sock is sock:
+            # the link dropped, disconnect() cancels this task before closing
+            self.receive_task = None
+            self._close()
+            if self.auto_reconnect and self.reconnect_task is None:
+                self.reconnect_task = loop.create_task(self._reconnect())
+
+    def _handle_frames(self, started, unterminated=False):
+        """Handle every complete frame in the reader, timing decoding and handling separately."""
+        frame = self._next_frame(unterminated)
+        while frame is not None:
+            decoded = time.perf_counter()
+            DECODE_SECONDS.observe(decoded - started)
+            self._handle_frame(*frame)
+            started = time.perf_counter()
+            HANDLE_SECONDS.observe(started - decoded)
+            frame = self._next_frame()
+
+    def _next_frame(self, unterminated=False):
+        """
+        The next decodable frame, skipping (and counting) the ones that are
+        not; with `unterminated`, the text left without a newline first.
+        """
+        while True:
+            try:
+                if unterminated:
+                    unterminated = False
+                    return self.reader.take_unterminated()
+                return self.reader.next_frame()
+            except wire.FrameError as e:
+                # the reader has moved past the bad frame, or dropped its buffer
+                UNDECODABLE.inc()
+                self.log(f"dropping undecodable data: {e}", logging.WARNING)
+
+    def _handle_frame(self, kind, data):
+        self.last_received = time.time()
+        if kind == framing.BINARY:
+            frame_type, decoded = data
+            if frame_type == wire.FRAME_PULSE:
+                self._set_pulse_data(decoded)
+            elif frame_type == wire.FRAME_RAW:
+                RAW_FRAMES.inc()
+                self.waveform.append(decoded)
+                if self.recorder:
+                    self.recorder.record_raw(decoded)
+                if self.broadcaster.listener_count():
+                    self.broadcaster.publish("raw", chunk_samples(decoded))
+        elif data.startswith("{"):
+            try:
+                pulse_data = json.loads(data)
+            except ValueError as e:
+                UNDECODABLE.inc()
+                self.log(f"dropping undecodable JSON packet: {e}", logging.WARNING)
+                return
+            self._set_pulse_data(pulse_data)
+        else:
+            self.responses.put_nowait(data)
+
+    def _set_pulse_data(self, pulse_data):
+        """Store a pulse packet; returns False for one already seen."""
+        PULSE_PACKETS.inc()
+        seq = pulse_data.get("seq")
+        if seq is not None and self.last_seq is not None:
+            if seq <= self.last_seq:
+                DUPLICATE_PACKETS.inc()
+                return False  # replayed after a RESUME
+            self.lost_packets += seq - self.last_seq - 1
+        if seq is not None:
+            self.last_seq = seq
+        self.pulse_data = pulse_data
+        self.packets += 1
+        self.history.append(pulse_data)
+        if self.recorder:
+            self.recorder.record_pulse(pulse_data)
+        self.broadcaster.publish("pulse", pulse_data)
+        return True
+
+    def snapshot(self):
+        """Connection state and latest pulse data, for JSON."""
+        return {
+            "id": self.device_id,
+            "address": self.address or self.connected_address,
+            "target_name": self.target_name,
+            "state": self.state,
+            "wire_format": self.wire_format,
+            "packets": self.packets,
+            "last_seq": self.last_seq,
+            "lost_packets": self.lost_packets,
+            "reconnects": self.reconnects,
+            "last_received": self.last_received,
+            "last_error": self.last_error,
+            "pulsedata": self.pulse_data,
+        }
+
+
+class SessionManager:
+    """
+    Any number of DeviceSessions on one asyncio event loop, run by one
+    thread, so adding transmitters adds sockets and buffers but no threads.
+    Flask handlers reach the sessions through call().
+
+    Sessions configured by name share `discovery`; their lookups start in
+    the background as soon as the loop runs.
+    """
+
+    def __init__(self, history_capacity=HISTORY_CAPACITY, discovery=None):
+        self.history_capacity = history_capacity
+        self.discovery = discovery
+        self.sessions = {}  # device id -> DeviceSession, in configuration order
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self.register_metrics()
+
+    def register_metrics(self):
+        """Per-device gauges, labelled with the device id, read when /metrics is scraped."""
+        def per_device(read):
+            return lambda: {(("device", device_id),): read(session) for device_id, session in list(self.sessions.items())}
+
+        instrument.gauge("pulse_device_streaming", "1 while the device streams pulse data",
+                         per_device(lambda session: session.state == STREAMING))
+        instrument.gauge("pulse_device_connected", "1 while the device is connected",
+                         per_device(lambda session: session.is_connected))
+        instrument.gauge("pulse_device_packets", "Pulse packets stored from the device",
+                         per_device(lambda session: session.packets))
+        instrument.gauge("pulse_device_lost_packets", "Pulse packets from the device never received",
+                         per_device(lambda session: session.lost_packets))
+        instrument.gauge("pulse_device_reconnects", "Reconnects after the device's link dropped",
+                         per_device(lambda session: session.reconnects))
+        instrument.gauge("pulse_device_last_received", "Unix time of the device's last frame",
+                         per_device(lambda session: session.last_received))
+        instrument.gauge("pulse_device_stream_listeners", "Server-Sent Events clients of the device",
+                         per_device(lambda session: session.broadcaster.listener_count()))
+
+    def add(self, device_id, address, port=transport.DEFAULT_RFCOMM_CHANNEL, record_directory=None):
+        return self.register(DeviceSession(device_id, address, port, self.history_capacity, record_directory))
+
+    def register(self, session):
+        """Manage an already constructed session (e.g. a DeviceSession subclass)."""
+        if session.device_id in self.sessions:
+            raise ValueError(f"device {session.device_id!r} already exists")
+        if session.discovery is None:
+            session.discovery = self.discovery
+        self.sessions[session.device_id] = session
+        return session
+
+    def get(self, device_id):
+        return self.sessions.get(device_id)
+
+    def start(self):
+        """Run the event loop on its own thread."""
+        self.thread = threading.Thread(target=self.loop.run_forever, name="device-sessions", daemon=True)
+        self.thread.start()
+        names = [session.target_name for session in self.sessions.values() if not session.address and session.target_name]
+        if self.discovery and names:
+            self.loop.call_soon_threadsafe(self.discovery.prefetch, names)
+
+    def call(self, device_id, command, timeout=30, **kwargs):
+        """
+        Run a session command on the event loop and wait for it.
+
+        Raises:
+            CommandError: when the command fails.
+            concurrent.futures.TimeoutError: when it takes longer than `timeout`.
+        """
+        coroutine = getattr(self.sessions[device_id], command)(**kwargs)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def snapshot(self):
+        """Every device's state and latest pulse data."""
+        devices = [session.snapshot() for session in self.sessions.values()]
+        return {
+            "time": time.time(),
+            "streaming": sum(device["state"] == STREAMING for device in devices),
+            "devices": devices,
+        }
+
+    def close(self, timeout=5):
+        """Disconnect every device, close the recordings and stop the event loop."""
+        if self.thread is None:
+            return
+
+        async def shutdown_all():
+            await asyncio.gather(*(session.shutdown() for session in self.sessions.values()))
+
+        asyncio.run_coroutine_threadsafe(shutdown_all(), self.loop).result(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.thread = None
@@ -0,0 +1,73 @@
+import threading
+
+import numpy as np
+
+
+def chunk_samples(chunk):
+    """A decoded raw chunk (see wire.decode_raw) in the shape WaveformBuffer.since returns."""
+    n = len(chunk["red"])
+    return {
+        "fs": chunk["fs"],
+        "index": (chunk["first_index"] + chunk["decimation"] * np.arange(n, dtype=np.int64)).tolist(),
+        "red": chunk["red"].tolist(),
+        "ir": chunk["ir"].tolist(),
+    }
+
+
+class WaveformBuffer:
+    """
+    The most recent raw red/ir samples received from the transmitter,
+    kept in a preallocated ring so the dashboard can poll for new ones.
+    """
+
+    def __init__(self, capacity=3000):
+        self.capacity = capacity
+        self.index = np.zeros(capacity, dtype=np.int64)  # transmitter sample index
+        self.red = np.zeros(capacity, dtype=np.int32)
+        self.ir = np.zeros(capacity, dtype=np.int32)
+        self.count = 0  # samples ever appended
+        self.fs = None
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+            self.fs = None
+
+    def append(self, chunk):
+        """Append a decoded raw chunk (see wire.decode_raw)."""
+        n = len(chunk["red"])
+        if n == 0:
+            return
+        indices = chunk["first_index"] + chunk["decimation"] * np.arange(n, dtype=np.int64)
+        red, ir = chunk["red"], chunk["ir"]
+        if n > self.capacity:
+            indices, red, ir = indices[-self.capacity:], red[-self.capacity:], ir[-self.capacity:]
+            n = self.capacity
+        with self.lock:
+            slots = (self.count + np.arange(n)) % self.capacity
+            self.index[slots] = indices
+            self.red[slots] = red
+            self.ir[slots] = ir
+            self.count += n
+            self.fs = chunk["fs"]
+
+    def since(self, last_index=-1, limit=None):
+        """
+        Samples with a transmitter index greater than `last_index`, oldest
+        first, as plain lists for JSON.
+        """
+        with self.lock:
+            n = min(self.count, self.capacity)
+            order = (self.count - n + np.arange(n)) % self.capacity
+            index = self.index[order]
+            start = np.searchsorted(index, last_index, side='right')
+            if limit is not None:
+                start = max(start, n - limit)
+            order = order[start:]
+            return {
+                "fs": self.fs,
+                "index": self.index[order].tolist(),
+                "red": self.red[order].tolist(),
+                "ir": self.ir[order].tolist(),
+            }
@@ -0,0 +1,100 @@
+# -*-coding:utf-8
+
+# Compression for blocks of integer PPG samples.
+#
+# The MAX30102 delivers 18-bit values and consecutive samples are close, so
+# a block is sent as the differences between samples (the first one relative
+# to 0), zigzag mapped so small negative steps stay small, and written as
+# LEB128 varints: 7 bits per byte, high bit set on every byte but the last.
+# A typical PPG step fits in one or two bytes instead of four.
+#
+# Everything is vectorized over the block; there is no per-sample Python.
+
+import numpy as np
+
+# an unsigned 64-bit value never needs more than 10 varint bytes
+MAX_VARINT_BYTES = 10
+
+_SHIFTS = np.arange(MAX_VARINT_BYTES, dtype=np.uint64) * np.uint64(7)
+# smallest value that needs k + 1 bytes, for k = 1 .. MAX_VARINT_BYTES - 1
+_THRESHOLDS = np.left_shift(np.uint64(1), _SHIFTS[1:])
+
+
+def zigzag_encode(values):
+    """Map signed integers to unsigned ones: 0, -1, 1, -2, ... -> 0, 1, 2, 3, ..."""
+    v = np.asarray(values, dtype=np.int64)
+    return ((v << 1) ^ (v >> 63)).view(np.uint64)
+
+
+def zigzag_decode(values):
+    """Inverse of zigzag_encode."""
+    u = np.asarray(values, dtype=np.uint64)
+    return ((u >> np.uint64(1)) ^ (np.uint64(0) - (u & np.uint64(1)))).view(np.int64)
+
+
+def encode_varints(values):
+    """Write unsigned integers as LEB128 varints."""
+    u = np.asarray(values, dtype=np.uint64)
+    if len(u) == 0:
+        return b""
+    nbytes = 1 + np.searchsorted(_THRESHOLDS, u, side='right')
+    ends = np.cumsum(nbytes)
+    starts = ends - nbytes
+    out = np.empty(int(ends[-1]), dtype=np.uint8)
+    for k in range(int(nbytes.max())):
+        # byte k of every value that has one
+        has = nbytes > k
+        byte = (u[has] >> _SHIFTS[k]) & np.uint64(0x7F)
+        more = (nbytes[has] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[has] + k] = byte | more
+    return out.tobytes()
+
+
+def decode_varints(buf, count, offset=0):
+    """
+    Read `count` LEB128 varints from `buf` starting at `offset`.
+
+    Returns:
+        tuple: (uint64 array, offset just past the last varint)
+
+    Raises:
+        ValueError: when `buf` ends before `count` varints.
+    """
+    if count == 0:
+        return np.empty(0, dtype=np.uint64), offset
+    data = np.frombuffer(buf, dtype=np.uint8, offset=offset)
+    # a varint ends at every byte without the continuation bit
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) < count:
+        raise ValueError(f"expected {count} varints, found {len(ends)}")
+    ends = ends[:count]
+    used = int(ends[-1]) + 1
+    data = data[:used]
+    starts = np.empty(count, dtype=np.intp)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+    if lengths.max() > MAX_VARINT_BYTES:
+        raise ValueError("varint longer than 64 bits")
+    # position of every byte inside its own varint
+    position = np.arange(used) - np.repeat(starts, lengths)
+    payload = (data & 0x7F).astype(np.uint64) << _SHIFTS[position]
+    # the 7-bit groups do not overlap, so adding them is the same as or-ing
+    return np.add.reduceat(payload, starts), offset + used
+
+
+def encode_block(samples):
+    """Delta + zigzag + varint encode one channel of integer samples."""
+    s = np.asarray(samples, dtype=np.int64)
+    return encode_varints(zigzag_encode(np.diff(s, prepend=0)))
+
+
+def decode_block(buf, count, offset=0):
+    """
+    Decode `count` samples written by encode_block.
+
+    Returns:
+        tuple: (int64 samples, offset just past the block)
+    """
+    values, end = decode_varints(buf, count, offset)
+    return np.cumsum(zigzag_decode(values)), end
@@ -0,0 +1,172 @@
+# -*-coding:utf-8
+
+# Stream framing shared by the transmitter and the receiver.
+#
+# An RFCOMM stream carries two kinds of frames:
+#   - text: commands ("START_SYNC", "ACK bin1 json", ...) and JSON packets,
+#     each terminated by a newline;
+#   - binary: wire frames, which start with wire.MAGIC and carry their
+#     own length in the header.
+# recv() may return several frames, or only part of one, so every reader
+# keeps what it received in a FrameReader until whole frames are available.
+
+import wire
+
+TEXT = "text"
+BINARY = "binary"
+
+NEWLINE = b"\n"
+# seconds a peer may leave a text message without its newline before it is
+# taken for an old peer that sends none
+LINE_TIMEOUT = 0.5
+
+
+def encode_text(message):
+    """Newline-terminate a text message for sending."""
+    return message.encode("utf-8") + NEWLINE
+
+
+class FrameReader:
+    """
+    Receive buffer that parses zero or more complete frames per recv.
+
+    Data is received straight into one preallocated bytearray through a
+    memoryview (recv_into), and frames are parsed in place; the buffer
+    only grows when a single frame does not fit.
+
+    Old peers send text without the trailing newline, one message per
+    send. Text without a newline is kept until its newline arrives, a
+    message may span several recvs; when the peer goes quiet mid-line for
+    LINE_TIMEOUT instead, the reader's owner calls take_unterminated(),
+    and from then on text left after a recv is taken to be a whole message.
+    """
+
+    def __init__(self, size=4096):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first unparsed byte
+        self.end = 0  # end of received data
+        self.newline_peer = None  # True once a newline arrives, False once a message came without one
+
+    def pending(self):
+        """Number of received bytes not yet parsed into frames."""
+        return self.end - self.start
+
+    def reset(self):
+        self.start = self.end = 0
+
+    def make_room(self, minimum=1024):
+        """Ensure at least `minimum` free bytes after `end`, without reallocating if possible."""
+        if len(self.buffer) - self.end >= minimum:
+            return
+        remaining = self.end - self.start
+        if remaining <= self.start and len(self.buffer) - remaining >= minimum:
+            # the unparsed tail fits before its old position, so the copy cannot overlap
+            self.buffer[:remaining] = self.view[self.start:self.end]
+        else:
+            grown = bytearray(max(2 * len(self.buffer), remaining + minimum))
+            grown[:remaining] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer = grown
+            self.view = memoryview(self.buffer)
+        self.start, self.end = 0, remaining
+
+    def recv_from(self, sock):
+        """
+        Receive once from `sock` into the buffer.
+
+        Returns:
+            int: number of bytes received, 0 when the peer closed the stream.
+        """
+        self.make_room()
+        recv_into = getattr(sock, "recv_into", None)
+        if recv_into is not None:
+            n = recv_into(self.view[self.end:])
+        else:
+            data = sock.recv(len(self.buffer) - self.end)
+            n = len(data)
+            self.buffer[self.end:self.end + n] = data
+        self.end += n
+        return n
+
+    def feed(self, data):
+        """Append bytes that were received some other way."""
+        self.make_room(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def next_frame(self):
+        """
+        Parse the next complete frame.
+
+        Returns:
+            tuple: (TEXT, str) or (BINARY, (frame_type, decoded)), or None
+            when no complete frame is buffered.
+        """
+        if self.start == self.end:
+            return None
+        if self.buffer[self.start] == wire.MAGIC:
+            view = self.view[:self.end]
+            try:
+                header = wire.decode_header(view, self.start)
+            except wire.FrameError:
+                # unparseable, nothing after it can be trusted either
+                self.reset()
+                raise
+            if header is None:
+                return None
+            frame_type, seq, timestamp, payload_start, frame_end = header
+            # the length is known, so a payload that fails to decode only loses this frame
+            self.start = frame_end
+            decoded = wire.decode_payload(frame_type, view, payload_start, frame_end, seq, timestamp)
+            return BINARY, (frame_type, decoded)
+
+        # blank lines are skipped here, a recv full of them must not recurse
+        while self.start < self.end:
+            if self.buffer[self.start] == wire.MAGIC:
+                return self.next_frame()
+            newline = self.buffer.find(NEWLINE, self.start, self.end)
+            if newline >= 0:
+                self.newline_peer = True
+                text = bytes(self.view[self.start:newline])
+                self.start = newline + 1
+            elif self.newline_peer is False:
+                text = bytes(self.view[self.start:self.end])
+                self.start = self.end
+            else:
+                return None
+            try:
+                text = text.decode("utf-8").strip()
+            except UnicodeDecodeError as e:
+                raise wire.FrameError(f"text frame is not UTF-8: {e}") from None
+            if text:
+                return TEXT, text
+        return None
+
+    def waiting_for_newline(self):
+        """Whether the buffer ends in text whose newline has not arrived, from a peer not yet known to send one."""
+        return (self.newline_peer is None and self.start < self.end
+                and self.buffer[self.start] != wire.MAGIC)
+
+    def take_unterminated(self):
+        """
+        Take the buffered text as a whole message, for a peer that went
+        quiet mid-line: an old peer that sends no newlines, whose later
+        messages are then taken whole too.
+
+        Returns:
+            tuple: (TEXT, str), or None when nothing but blank text is buffered.
+        """
+        if not self.waiting_for_newline():
+            return None
+        self.newline_peer = False
+        return self.next_frame()
+
+    def frames(self):
+        """Parse every complete frame in the buffer."""
+        frames = []
+        frame = self.next_frame()
+        while frame is not None:
+            frames.append(frame)
+            frame = self.next_frame()
+        return frames
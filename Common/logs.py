@@ -0,0 +1,64 @@
+# -*-coding:utf-8
+
+# Logging setup shared by the transmitter and the receiver.
+#
+# Modules log through logging.getLogger(__name__); the entry points call
+# setup() once. The level comes from PULSE_LOG_LEVEL (default INFO; DEBUG
+# shows every packet), and a rate limit per call site keeps a message
+# logged in a loop from flooding the Pi's console.
+
+import logging
+import os
+import threading
+import time
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let `burst` records from each call site of each logger through per
+    `interval` seconds and drop the rest; the next record let through says
+    how many were dropped. Sessions log through a child logger per device,
+    so one device's messages never hide another's.
+    """
+
+    def __init__(self, interval=10.0, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.sites = {}  # (logger name, pathname, lineno) -> [window start, passed, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None:
+                site = self.sites[key] = [now, 0, 0]
+            if now - site[0] >= self.interval:
+                site[0], site[1] = now, 0
+            if site[1] >= self.burst:
+                site[2] += 1
+                return False
+            site[1] += 1
+            suppressed, site[2] = site[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar message(s) suppressed]"
+        return True
+
+
+def setup(level=None, interval=10.0, burst=5):
+    """Log to stderr at `level` (default PULSE_LOG_LEVEL or INFO), rate limited per call site."""
+    level = level or os.environ.get("PULSE_LOG_LEVEL", "INFO")
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(RateLimitFilter(interval, burst))
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    # one line per HTTP request from Flask's development server is too chatty on the Pi
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
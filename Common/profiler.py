@@ -0,0 +1,192 @@
+# -*-coding:utf-8
+
+# Sampling profiler for the running transmitter and receiver, off until
+# started at run time.
+#
+# A daemon thread reads every thread's stack with sys._current_frames() at
+# a fixed rate and counts identical stacks. The result is in the collapsed
+# ("folded") format of flamegraph.pl and speedscope, one line per stack:
+#
+#   MainThread;server.py:stream_pulse_data;server.py:read_sensor 412
+#
+# The profiled threads are never interrupted, they only share the GIL with
+# the sampler for the few microseconds a sample takes. The sampler stretches
+# its interval to stay within MAX_OVERHEAD of one core, stops by itself
+# after `duration` seconds and keeps at most MAX_STACKS distinct stacks.
+
+import collections
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_RATE = 100  # samples per second
+DEFAULT_DURATION = 60  # seconds, then the profiler stops by itself
+MAX_RATE = 1000
+MAX_DURATION = 3600
+# sampling may use at most this fraction of one core
+MAX_OVERHEAD = 0.02
+# stacks seen after this many distinct ones are counted under one "[other]" stack
+MAX_STACKS = 20000
+MAX_DEPTH = 128
+
+log = logging.getLogger(__name__)
+
+# "Thread-12 (process_request_thread)" -> "Thread (process_request_thread)": one root for all Flask workers
+_THREAD_NUMBER = re.compile(r"-\d+")
+
+
+def _frame_name(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread but its own while started.
+
+    start() and stop() may be called from any thread (a Flask handler, a
+    command callback, a signal handler); the samples of the last run stay
+    available from collapsed() until the next start().
+    """
+
+    def __init__(self, max_overhead=MAX_OVERHEAD, max_stacks=MAX_STACKS):
+        self.max_overhead = max_overhead
+        self.max_stacks = max_stacks
+        self.lock = threading.Lock()  # start/stop
+        self.stacks_lock = threading.Lock()  # the sampler updates stacks while others read them
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.rate = DEFAULT_RATE
+        self.duration = DEFAULT_DURATION
+        self.stacks = collections.Counter()  # (thread name, frame names...) -> samples
+        self.samples = 0
+        self.sampling_time = 0.0  # seconds spent taking samples
+        self.started = None
+        self.stopped = None
+        self.directory = None
+        self.output = None  # .folded file of the last run, when it was written
+        self.names = {}  # frame name per code object, they repeat in nearly every sample
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, rate=DEFAULT_RATE, duration=DEFAULT_DURATION, directory=None):
+        """
+        Start sampling `rate` times a second for at most `duration` seconds,
+        discarding the previous run. Returns False when already running.
+        With a `directory` the stacks are written there when the run ends,
+        stopped or timed out, and `output` is the file's path.
+
+        Raises:
+            ValueError: for a rate or duration out of range.
+        """
+        if not 0 < rate <= MAX_RATE:
+            raise ValueError(f"rate must be between 0 and {MAX_RATE} samples per second")
+        if not 0 < duration <= MAX_DURATION:
+            raise ValueError(f"duration must be between 0 and {MAX_DURATION} seconds")
+        with self.lock:
+            if self.running:
+                return False
+            self.rate, self.duration = rate, duration
+            self.stacks = collections.Counter()
+            self.samples = 0
+            self.sampling_time = 0.0
+            self.started, self.stopped = time.time(), None
+            self.directory, self.output = directory, None
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self.thread.start()
+        return True
+
+    def stop(self, timeout=5):
+        """Stop sampling and wait for the sampler; returns False when it was not running."""
+        with self.lock:
+            thread = self.thread
+            if thread is None or not thread.is_alive():
+                return False
+            self.stop_event.set()
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+        return True
+
+    def _run(self):
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.duration
+        interval = 1.0 / self.rate
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            began = time.perf_counter()
+            self._sample(own)
+            cost = time.perf_counter() - began
+            self.sampling_time += cost
+            # never spend more than max_overhead of the time sampling, whatever the rate asked for
+            self.stop_event.wait(max(interval - cost, cost / self.max_overhead - cost))
+        self.stopped = time.time()
+        if self.directory:
+            try:
+                self.output = self.write(self.directory)
+            except OSError as e:
+                log.error("Could not write the profile to %s: %s", self.directory, e)
+
+    def _sample(self, own):
+        names = {thread.ident: _THREAD_NUMBER.sub("", thread.name) for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                code = frame.f_code
+                name = self.names.get(code)
+                if name is None:
+                    name = self.names[code] = _frame_name(code)
+                stack.append(name)
+                frame = frame.f_back
+            stack.append(names.get(ident, "[unknown thread]"))
+            key = tuple(reversed(stack))
+            with self.stacks_lock:
+                if key not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    key = (key[0], "[other]")
+                self.stacks[key] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """The samples so far as collapsed stacks, most frequent first."""
+        with self.stacks_lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks)
+
+    def write(self, directory=None):
+        """Write collapsed() to a new .folded file in `directory` (default the temp directory); returns its path."""
+        directory = directory or tempfile.gettempdir()
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started or time.time()))
+        path = os.path.join(directory, f"profile-{os.getpid()}-{stamp}.folded")
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+        return path
+
+    def status(self):
+        """Whether it runs, with what settings, and what sampling has cost, for JSON."""
+        end = self.stopped or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        return {
+            "running": self.running,
+            "rate": self.rate,
+            "duration": self.duration,
+            "started": self.started,
+            "samples": self.samples,
+            "stacks": len(self.stacks),
+            "overhead": self.sampling_time / elapsed if elapsed else 0.0,
+            "output": self.output,
+        }
+
+
+PROFILER = SamplingProfiler()
+
+
+def default_directory():
+    """Where profiles are written: PULSE_PROFILE_DIR, else the temp directory."""
+    return os.environ.get("PULSE_PROFILE_DIR") or tempfile.gettempdir()
@@ -0,0 +1,255 @@
+# -*-coding:utf-8
+
+# Append-only on-disk recording of pulse data packets and raw samples.
+#
+# A recording is a directory. Each stream in it ("pulse", "raw") is a series
+# of segment files, <stream>-<number>.seg, each made of a 64 byte header
+# followed by fixed-size records of the stream's dtype, oldest first, with
+# the record timestamp as the first field. Once a segment holds
+# `segment_records` records the next one is started, and a line
+# "<number> <first timestamp> <last timestamp> <count>" is appended to
+# <stream>.idx.
+#
+# Nothing is kept in memory but the open file, and the reader memory-maps
+# segments, so a time range costs two binary searches per segment it
+# touches no matter how long the recording is. A segment cut short by a
+# crash is still readable; a partial last record is ignored.
+
+import glob
+import os
+import re
+import struct
+import threading
+import time
+
+import numpy as np
+
+SEGMENT_MAGIC = b"PPGSEG01"
+# magic, stream name, record size, then zero padding up to SEGMENT_HEADER_SIZE
+SEGMENT_HEADER = struct.Struct("<8s16sI")
+SEGMENT_HEADER_SIZE = 64
+
+PULSE_RECORD = np.dtype([
+    ("timestamp", "<f8"),
+    ("seq", "<i8"),  # -1 when the packet had none
+    ("beats_per_minute", "<f4"),  # NaN for None, as in the other metrics
+    ("impulses_per_minute", "<f4"),
+    ("root_mean_square", "<f4"),
+    ("hrstd", "<f4"),
+])
+
+RAW_RECORD = np.dtype([
+    ("timestamp", "<f8"),
+    ("index", "<i8"),  # sample index on the transmitter
+    ("red", "<i4"),
+    ("ir", "<i4"),
+])
+
+STREAMS = {"pulse": PULSE_RECORD, "raw": RAW_RECORD}
+
+_SEGMENT_NAME = re.compile(r"^(?P<stream>\w+)-(?P<number>\d+)\.seg$")
+
+
+def pulse_record(pulse_data):
+    """One PULSE_RECORD from a pulse data dict."""
+    record = np.zeros(1, dtype=PULSE_RECORD)
+    timestamp = pulse_data.get("timestamp")
+    record["timestamp"] = time.time() if timestamp is None else timestamp
+    seq = pulse_data.get("seq")
+    record["seq"] = -1 if seq is None else seq
+    for field in PULSE_RECORD.names[2:]:
+        value = pulse_data.get(field)
+        record[field] = np.nan if value is None else value
+    return record
+
+
+def raw_records(chunk):
+    """
+    RAW_RECORDs from a decoded raw chunk (see wire.decode_raw). The chunk
+    timestamp is that of its last sample; earlier ones are spaced 1/fs back.
+    """
+    n = len(chunk["red"])
+    records = np.zeros(n, dtype=RAW_RECORD)
+    steps = np.arange(n, dtype=np.int64)
+    records["timestamp"] = chunk["timestamp"] - (n - 1 - steps) / chunk["fs"]
+    records["index"] = chunk["first_index"] + chunk["decimation"] * steps
+    records["red"] = chunk["red"]
+    records["ir"] = chunk["ir"]
+    return records
+
+
+def _segment_path(directory, stream, number):
+    return os.path.join(directory, f"{stream}-{number:06d}.seg")
+
+
+def _index_path(directory, stream):
+    return os.path.join(directory, f"{stream}.idx")
+
+
+class SegmentWriter:
+    """Appends records of one stream, starting a new segment every `segment_records`."""
+
+    def __init__(self, directory, stream, segment_records=65536):
+        self.directory = directory
+        self.stream = stream
+        self.dtype = STREAMS[stream]
+        self.segment_records = segment_records
+        self.file = None
+        self.number = -1
+        self.count = 0  # records in the open segment
+        self.first_timestamp = None
+        self.last_timestamp = None
+        existing = _list_segments(directory, stream)
+        # never append to a segment of an earlier session, it may end in a partial record
+        self.next_number = existing[-1][0] + 1 if existing else 0
+
+    def _open_segment(self):
+        self.number = self.next_number
+        self.next_number += 1
+        self.file = open(_segment_path(self.directory, self.stream, self.number), "wb")
+        header = SEGMENT_HEADER.pack(SEGMENT_MAGIC, self.stream.encode("ascii"), self.dtype.itemsize)
+        self.file.write(header.ljust(SEGMENT_HEADER_SIZE, b"\0"))
+        self.count = 0
+        self.first_timestamp = self.last_timestamp = None
+
+    def _close_segment(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if self.count:
+            with open(_index_path(self.directory, self.stream), "a") as index:
+                index.write(f"{self.number} {self.first_timestamp!r} {self.last_timestamp!r} {self.count}\n")
+
+    def append(self, records):
+        records = np.asarray(records, dtype=self.dtype)
+        while len(records):
+            if self.file is None or self.count >= self.segment_records:
+                self._close_segment()
+                self._open_segment()
+            part = records[:self.segment_records - self.count]
+            records = records[len(part):]
+            self.file.write(part.tobytes())
+            if self.first_timestamp is None:
+                self.first_timestamp = float(part["timestamp"][0])
+            self.last_timestamp = float(part["timestamp"][-1])
+            self.count += len(part)
+        if self.file is not None:
+            # readers map the file, so hand the records to the OS right away
+            self.file.flush()
+
+    def close(self):
+        self._close_segment()
+
+
+class Recorder:
+    """Records every stream of a session into `directory`."""
+
+    def __init__(self, directory, segment_records=65536):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.writers = {stream: SegmentWriter(directory, stream, segment_records) for stream in STREAMS}
+        self.lock = threading.Lock()
+
+    def record_pulse(self, pulse_data):
+        with self.lock:
+            self.writers["pulse"].append(pulse_record(pulse_data))
+
+    def record_raw(self, chunk):
+        with self.lock:
+            self.writers["raw"].append(raw_records(chunk))
+
+    def close(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.close()
+
+
+def _list_segments(directory, stream):
+    """[(number, path)] of a stream's segments, oldest first."""
+    segments = []
+    for path in glob.glob(os.path.join(directory, f"{stream}-*.seg")):
+        match = _SEGMENT_NAME.match(os.path.basename(path))
+        if match and match.group("stream") == stream:
+            segments.append((int(match.group("number")), path))
+    return sorted(segments)
+
+
+def _read_index(directory, stream):
+    """{number: (first timestamp, last timestamp)} for closed segments."""
+    index = {}
+    try:
+        with open(_index_path(directory, stream)) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 4:
+                    index[int(parts[0])] = (float(parts[1]), float(parts[2]))
+    except FileNotFoundError:
+        pass
+    return index
+
+
+def map_segment(path):
+    """Memory-map the complete records of a segment, or None for an empty one."""
+    with open(path, "rb") as f:
+        magic, stream, record_size = SEGMENT_HEADER.unpack(f.read(SEGMENT_HEADER.size))
+    if magic != SEGMENT_MAGIC:
+        raise ValueError(f"{path} is not a recording segment")
+    dtype = STREAMS[stream.rstrip(b"\0").decode("ascii")]
+    if record_size != dtype.itemsize:
+        raise ValueError(f"{path} has {record_size} byte records, expected {dtype.itemsize}")
+    count = (os.path.getsize(path) - SEGMENT_HEADER_SIZE) // record_size
+    if count <= 0:
+        return None
+    return np.memmap(path, dtype=dtype, mode="r", offset=SEGMENT_HEADER_SIZE, shape=(count,))
+
+
+class RecordingReader:
+    """Time range queries over a recording, as views of memory-mapped segments."""
+
+    def __init__(self, directory, stream="pulse"):
+        self.directory = directory
+        self.stream = stream
+        self.dtype = STREAMS[stream]
+        self.maps = {}  # segment number -> memmap, closed segments only
+
+    def _segments(self):
+        """[(number, path, first timestamp, last timestamp or None)] oldest first."""
+        index = _read_index(self.directory, self.stream)
+        return [(number, path) + index.get(number, (None, None))
+                for number, path in _list_segments(self.directory, self.stream)]
+
+    def _map(self, number, path, closed):
+        records = self.maps.get(number)
+        if records is None:
+            records = map_segment(path)
+            if closed and records is not None:
+                # closed segments never change, an open one is remapped to see new records
+                self.maps[number] = records
+        return records
+
+    def views(self, since=None, until=None):
+        """Read-only views of the records with since <= timestamp < until, one per segment."""
+        views = []
+        for number, path, first, last in self._segments():
+            closed = first is not None
+            if closed and ((since is not None and last < since) or (until is not None and first >= until)):
+                continue
+            records = self._map(number, path, closed)
+            if records is None:
+                continue
+            timestamp = records["timestamp"]
+            start = 0 if since is None else np.searchsorted(timestamp, since, side="left")
+            end = len(records) if until is None else np.searchsorted(timestamp, until, side="left")
+            if start < end:
+                views.append(records[start:end])
+        return views
+
+    def query(self, since=None, until=None):
+        """Records in the range as one array: a view when they lie in one segment, else a copy."""
+        views = self.views(since, until)
+        if len(views) == 1:
+            return views[0]
+        if not views:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(views)
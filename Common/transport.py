@@ -0,0 +1,164 @@
+# -*-coding:utf-8
+
+# Byte-stream transports between the transmitter and the receiver.
+#
+# Every transport hands out ordinary socket objects (send, recv, recv_into,
+# settimeout, close), and a listener with accept() and close(), so the
+# handshake, framing and streaming code runs the same over all of them.
+# Addresses are strings:
+#
+#   rfcomm:<bdaddr>:<channel>   Bluetooth RFCOMM, the default; bdaddr may be
+#                               empty when listening ("rfcomm::1")
+#   tcp:<host>:<port>           TCP, e.g. tcp:127.0.0.1:5555
+#   unix:<path>                 Unix domain socket
+#   inproc:<name>               socketpair within one process (tests, benchmarks)
+#
+# A bare Bluetooth address ("2C:CF:67:03:0E:1A") is taken as RFCOMM.
+# All failures surface as OSError (socket.timeout included).
+
+import os
+import queue
+import re
+import socket
+import threading
+
+RFCOMM = "rfcomm"
+TCP = "tcp"
+UNIX = "unix"
+INPROC = "inproc"
+KINDS = (RFCOMM, TCP, UNIX, INPROC)
+
+DEFAULT_RFCOMM_CHANNEL = 1
+DEFAULT_LISTEN_ADDRESS = f"{RFCOMM}::{DEFAULT_RFCOMM_CHANNEL}"
+
+_BDADDR = re.compile(r"^[0-9A-Fa-f]{2}(:[0-9A-Fa-f]{2}){5}$")
+
+
+def rfcomm_address(bdaddr, channel=DEFAULT_RFCOMM_CHANNEL):
+    return f"{RFCOMM}:{bdaddr}:{channel}"
+
+
+def resolve(address, channel=DEFAULT_RFCOMM_CHANNEL):
+    """A bare Bluetooth address with its RFCOMM channel, anything else unchanged."""
+    return rfcomm_address(address, channel) if _BDADDR.match(address) else address
+
+
+def parse_address(address):
+    """
+    Split an address string into (kind, socket address).
+
+    Raises:
+        ValueError: for an address no transport understands.
+    """
+    if _BDADDR.match(address):
+        return RFCOMM, (address, DEFAULT_RFCOMM_CHANNEL)
+    kind, sep, rest = address.partition(":")
+    if not sep or kind not in KINDS:
+        raise ValueError(f"unknown transport address {address!r}")
+    if kind in (UNIX, INPROC):
+        if not rest:
+            raise ValueError(f"{kind} address needs a path or name: {address!r}")
+        return kind, rest
+    # host or bdaddr, then the port or channel after the last colon
+    host, sep, port = rest.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError(f"{kind} address needs a port: {address!r}")
+    return kind, (host, int(port))
+
+
+def is_bluetooth(address):
+    return parse_address(address)[0] == RFCOMM
+
+
+def _rfcomm_socket():
+    if not hasattr(socket, "AF_BLUETOOTH"):
+        raise OSError("this Python has no AF_BLUETOOTH support, use a tcp: or unix: address")
+    return socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+
+
+def listen(address=DEFAULT_LISTEN_ADDRESS, backlog=1):
+    """Open a listener on `address`; call accept() on it for each peer."""
+    kind, sockaddr = parse_address(address)
+    if kind == INPROC:
+        return _InprocListener(sockaddr)
+    if kind == RFCOMM:
+        sock = _rfcomm_socket()
+        # "" is any local adapter
+        sockaddr = (sockaddr[0] or "00:00:00:00:00:00", sockaddr[1])
+    elif kind == TCP:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(sockaddr):
+            os.unlink(sockaddr)  # left behind by a previous run
+    try:
+        sock.bind(sockaddr)
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def connect(address, timeout=None):
+    """Connect to a listener at `address` and return the connected socket."""
+    kind, sockaddr = parse_address(address)
+    if kind == INPROC:
+        return _inproc_connect(sockaddr)
+    if kind == RFCOMM:
+        sock = _rfcomm_socket()
+    elif kind == TCP:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(sockaddr)
+        sock.settimeout(None)
+    except OSError:
+        sock.close()
+        raise
+    if kind == TCP:
+        # frames are small and latency matters more than packet count
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+# inproc: listeners registered by name, connections are socketpairs
+_inproc_listeners = {}
+_inproc_lock = threading.Lock()
+
+
+class _InprocListener:
+    def __init__(self, name):
+        self.name = name
+        self.pending = queue.Queue()
+        self.closed = False
+        with _inproc_lock:
+            if name in _inproc_listeners:
+                raise OSError(f"inproc:{name} is already listening")
+            _inproc_listeners[name] = self
+
+    def accept(self):
+        sock = self.pending.get()
+        if sock is None:
+            raise OSError(f"inproc:{self.name} listener closed")
+        return sock, f"{INPROC}:{self.name}"
+
+    def close(self):
+        with _inproc_lock:
+            if _inproc_listeners.get(self.name) is self:
+                del _inproc_listeners[self.name]
+        self.closed = True
+        self.pending.put(None)  # wake a blocked accept()
+
+
+def _inproc_connect(name):
+    with _inproc_lock:
+        listener = _inproc_listeners.get(name)
+    if listener is None:
+        raise ConnectionRefusedError(f"nothing is listening on inproc:{name}")
+    ours, theirs = socket.socketpair()
+    listener.pending.put(theirs)
+    return ours
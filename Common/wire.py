@@ -0,0 +1,181 @@
+# -*-coding:utf-8
+
+# Binary wire format shared by the transmitter (Server/) and receiver (Client/).
+#
+# Every frame is a fixed little-endian header followed by `length` payload bytes:
+#
+#   magic    u8   0xA5, never the first byte of a text command or JSON packet
+#   version  u8   WIRE_VERSION, frames with another version are rejected
+#   type     u8   FRAME_* constant
+#   flags    u8   reserved, 0
+#   length   u16  payload length in bytes
+#   seq      u32  packet number, counted per frame type and kept across
+#                 reconnects so the receiver can spot and RESUME gaps
+#   time     f64  unix timestamp of the data in the frame
+#
+# The format is negotiated during the START_SYNC handshake: the server lists
+# the formats it speaks after its ACK ("ACK bin1") and the client picks one
+# in its ACK_ACK ("ACK_ACK bin1"). Peers that send a bare ACK or ACK_ACK get
+# the old JSON strings.
+
+import math
+import struct
+
+import numpy as np
+
+import codec
+
+MAGIC = 0xA5
+WIRE_VERSION = 1
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "bin1"
+SUPPORTED_FORMATS = (FORMAT_BINARY, FORMAT_JSON)
+
+FRAME_PULSE = 1
+FRAME_RAW = 2
+
+HEADER = struct.Struct("<BBBBHId")
+# beats_per_minute, impulses_per_minute, root_mean_square, hrstd; NaN for None
+PULSE = struct.Struct("<ffff")
+PULSE_FIELDS = ("beats_per_minute", "impulses_per_minute", "root_mean_square", "hrstd")
+# raw PPG chunk: first sample index, sample count, decimation, encoding, sample rate
+# after decimation, followed by the red then the ir channel
+RAW_HEADER = struct.Struct("<IHBBf")
+# RAW_DELTA16/32: each channel is its first sample as int32 followed by
+# sample-to-sample deltas; RAW_VARINT: each channel is a codec block
+RAW_DELTA16 = 1
+RAW_DELTA32 = 2
+RAW_VARINT = 3
+
+
+class FrameError(ValueError):
+    """Raised for bytes that are not a frame this version understands."""
+
+
+def encode_frame(frame_type, payload, seq, timestamp):
+    """Prefix `payload` with a frame header."""
+    return HEADER.pack(MAGIC, WIRE_VERSION, frame_type, 0, len(payload), seq & 0xFFFFFFFF, timestamp) + payload
+
+
+def decode_header(buf, offset=0):
+    """
+    Parse the header at `offset`.
+
+    Returns:
+        tuple: (frame_type, seq, timestamp, payload_start, frame_end), or
+        None when `buf` does not hold the whole frame yet.
+    """
+    if len(buf) - offset < HEADER.size:
+        return None
+    magic, version, frame_type, _, length, seq, timestamp = HEADER.unpack_from(buf, offset)
+    if magic != MAGIC:
+        raise FrameError(f"bad frame magic 0x{magic:02x}")
+    if version != WIRE_VERSION:
+        raise FrameError(f"unsupported wire version {version}")
+    payload_start = offset + HEADER.size
+    frame_end = payload_start + length
+    if len(buf) < frame_end:
+        return None
+    return frame_type, seq, timestamp, payload_start, frame_end
+
+
+def encode_pulse(pulse_data, seq, timestamp):
+    """Pack a pulse data dict (as built by read_sensor) into a frame."""
+    values = [pulse_data.get(field) for field in PULSE_FIELDS]
+    payload = PULSE.pack(*(math.nan if v is None else float(v) for v in values))
+    return encode_frame(FRAME_PULSE, payload, seq, timestamp)
+
+
+def decode_pulse(buf, payload_start, frame_end, seq, timestamp):
+    """Unpack a pulse payload back into the dict the JSON format carries."""
+    if payload_start + PULSE.size > frame_end:
+        raise FrameError(f"pulse payload of {frame_end - payload_start} bytes, expected {PULSE.size}")
+    values = PULSE.unpack_from(buf, payload_start)
+    pulse_data = {field: (None if math.isnan(v) else v) for field, v in zip(PULSE_FIELDS, values)}
+    pulse_data["seq"] = seq
+    pulse_data["timestamp"] = timestamp
+    return pulse_data
+
+
+def encode_raw(red, ir, first_index, decimation, fs, seq, timestamp):
+    """
+    Pack a chunk of raw red/ir samples into a frame, each channel delta +
+    zigzag varint encoded (see codec.py).
+    """
+    red_block = codec.encode_block(red)
+    ir_block = codec.encode_block(ir)
+    header = RAW_HEADER.pack(first_index & 0xFFFFFFFF, len(red), decimation, RAW_VARINT, fs)
+    return encode_frame(FRAME_RAW, header + red_block + ir_block, seq, timestamp)
+
+
+def _decode_fixed_deltas(buf, offset, count, delta_type):
+    """One RAW_DELTA16/32 channel; returns (samples, offset past it)."""
+    end = offset + 4 + (count - 1) * delta_type.itemsize
+    if end > len(buf):
+        raise FrameError(f"raw chunk too short for {count} samples")
+    first = np.frombuffer(buf, dtype="<i4", count=1, offset=offset)
+    deltas = np.frombuffer(buf, dtype=delta_type, count=count - 1, offset=offset + 4)
+    samples = np.cumsum(np.concatenate((first, deltas)), dtype=np.int32)
+    return samples, end
+
+
+def decode_raw(buf, payload_start, frame_end, seq, timestamp):
+    """Unpack a raw chunk into int32 red and ir arrays."""
+    if payload_start + RAW_HEADER.size > frame_end:
+        raise FrameError(f"raw payload of {frame_end - payload_start} bytes is shorter than its header")
+    first_index, count, decimation, encoding, fs = RAW_HEADER.unpack_from(buf, payload_start)
+    # never read past this frame into the next one
+    payload = buf[:frame_end]
+    offset = payload_start + RAW_HEADER.size
+    channels = []
+    for _ in range(2):
+        if count == 0:
+            channels.append(np.empty(0, dtype=np.int32))
+        elif encoding == RAW_VARINT:
+            try:
+                samples, offset = codec.decode_block(payload, count, offset)
+            except ValueError as e:
+                raise FrameError(f"bad raw chunk: {e}") from None
+            channels.append(samples.astype(np.int32))
+        elif encoding in (RAW_DELTA16, RAW_DELTA32):
+            delta_type = np.dtype("<i2" if encoding == RAW_DELTA16 else "<i4")
+            samples, offset = _decode_fixed_deltas(payload, offset, count, delta_type)
+            channels.append(samples)
+        else:
+            raise FrameError(f"unknown raw encoding {encoding}")
+    return {
+        "first_index": first_index,
+        "decimation": decimation,
+        "fs": fs,
+        "red": channels[0],
+        "ir": channels[1],
+        "seq": seq,
+        "timestamp": timestamp,
+    }
+
+
+def decode_payload(frame_type, buf, payload_start, frame_end, seq, timestamp):
+    """
+    Decode the payload of a frame, or return None for an unknown frame type.
+
+    Raises:
+        FrameError: for a payload that does not decode, e.g. a truncated one.
+    """
+    try:
+        if frame_type == FRAME_PULSE:
+            return decode_pulse(buf, payload_start, frame_end, seq, timestamp)
+        if frame_type == FRAME_RAW:
+            return decode_raw(buf, payload_start, frame_end, seq, timestamp)
+    except FrameError:
+        raise
+    except (struct.error, ValueError) as e:
+        # whatever slipped past the length checks, one bad frame must not end the stream
+        raise FrameError(f"bad frame payload: {e}") from None
+    return None
+
+
+def parse_formats(response):
+    """Formats listed after an ACK, e.g. "ACK bin1 json" -> ["bin1", "json"]."""
+    parts = response.split()
+    return parts[1:] if parts and parts[0] == "ACK" else []
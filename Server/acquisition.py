@@ -0,0 +1,120 @@
+# -*-coding:utf-8
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+import instrument
+import max30102
+
+log = logging.getLogger(__name__)
+
+READ_SECONDS = instrument.timer("pulse_sensor_read_seconds", "Reading one burst from the sensor FIFO")
+SAMPLES_READ = instrument.counter("pulse_sensor_samples_total", "Samples read from the sensor")
+READ_ERRORS = instrument.counter("pulse_sensor_read_errors_total", "Sensor reads that failed")
+
+
+class SampleRingBuffer:
+    """
+    Preallocated ring buffer of raw red/ir samples and their timestamps.
+
+    There is a single writer (the acquisition thread) and any number of
+    readers. The data path takes no locks: the writer fills the slots first
+    and only then publishes the new `write_count`, so readers never see a
+    half-written sample. Every sample is stored twice, at `i` and at
+    `i + capacity`, which makes any window of up to `capacity` samples one
+    contiguous slice that can be handed out as a view without copying.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.red = np.zeros(2 * capacity, dtype=np.int32)
+        self.ir = np.zeros(2 * capacity, dtype=np.int32)
+        self.timestamps = np.zeros(2 * capacity, dtype=np.float64)
+        self.write_count = 0  # total samples ever written
+        self.overflow_count = 0  # samples the sensor dropped (REG_OVF_COUNTER)
+        self.new_data = threading.Event()
+
+    def write(self, red, ir, timestamps):
+        """Append a block of samples. Only the acquisition thread calls this."""
+        n = len(red)
+        if n == 0:
+            return
+        if n > self.capacity:
+            red, ir, timestamps = red[-self.capacity:], ir[-self.capacity:], timestamps[-self.capacity:]
+            n = self.capacity
+        slots = (self.write_count + np.arange(n)) % self.capacity
+        for column, values in ((self.red, red), (self.ir, ir), (self.timestamps, timestamps)):
+            column[slots] = values
+            column[slots + self.capacity] = values
+        # publish only once the data is in place
+        self.write_count += n
+        self.new_data.set()
+
+    def window(self, end, n):
+        """
+        Return views of red, ir and timestamps for samples [end - n, end).
+        The views alias the buffer: check `is_valid(end - n)` after using
+        them if the reader may have fallen more than `capacity` behind.
+        """
+        if n > self.capacity:
+            raise ValueError("window of {0} samples exceeds capacity {1}".format(n, self.capacity))
+        stop = (end - 1) % self.capacity + self.capacity + 1
+        start = stop - n
+        return self.red[start:stop], self.ir[start:stop], self.timestamps[start:stop]
+
+    def latest(self, n):
+        """Return views of the newest `n` samples."""
+        end = self.write_count
+        return self.window(end, min(n, end, self.capacity))
+
+    def is_valid(self, start):
+        """True while sample `start` has not been overwritten."""
+        return self.write_count - start <= self.capacity
+
+    def wait(self, count, timeout=None):
+        """Block until at least `count` samples have been written."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.write_count < count:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            self.new_data.wait(remaining)
+            self.new_data.clear()
+        return True
+
+
+class AcquisitionThread(threading.Thread):
+    """Drain the sensor FIFO into a SampleRingBuffer, independent of the DSP."""
+
+    def __init__(self, sensor, buffer):
+        super().__init__(name="acquisition", daemon=True)
+        self.sensor = sensor
+        self.buffer = buffer
+        self.stop_event = threading.Event()
+
+    def run(self):
+        # wall-clock time between samples
+        period = 1.0 / (self.sensor.sample_rate * self.sensor.speed)
+        while not self.stop_event.is_set():
+            started = time.perf_counter()
+            try:
+                red, ir = self.sensor.read_fifo_burst()
+            except OSError as e:
+                READ_ERRORS.inc()
+                log.warning("Sensor read failed: %s", e)
+                time.sleep(period)
+                continue
+            READ_SECONDS.observe(time.perf_counter() - started)
+            SAMPLES_READ.inc(len(red))
+            if len(red):
+                # the newest sample was taken just now, the rest one period apart
+                timestamps = time.time() - period * np.arange(len(red) - 1, -1, -1)
+                self.buffer.write(red, ir, timestamps)
+                self.buffer.overflow_count = self.sensor.dropped_samples
+            self.sensor.wait_for_samples(max30102.FIFO_A_FULL_SAMPLES)
+
+    def stop(self):
+        self.stop_event.set()
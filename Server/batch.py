@@ -0,0 +1,299 @@
+# -*-coding:utf-8
+
+# Batched versions of the transmitter DSP, for reprocessing recordings
+# offline or for a gateway aggregating several sensors.
+# Every function takes a 2-D array of shape (n_windows, n_samples) and
+# works on all windows at once, without a Python loop over the windows.
+
+import numpy as np
+from scipy.signal import sosfiltfilt
+
+import hrcalc
+from filters import filter_bank
+
+# same parameters as BluetoothPulseServer.preprocess_signal
+HIGH_CUTOFF = 0.5
+LOW_CUTOFF = 3.0
+SMOOTHING = 5
+
+
+def preprocess_batch(ir_data, fs=100):
+    """
+    preprocess_signal for every row of `ir_data`: zero-phase high-pass and
+    low-pass filtering along axis=1, then a centred moving average.
+    """
+    x = np.atleast_2d(np.asarray(ir_data, dtype=np.float64))
+    x = sosfiltfilt(filter_bank.sos('high', HIGH_CUTOFF, fs), x, axis=1)
+    x = sosfiltfilt(filter_bank.sos('low', LOW_CUTOFF, fs), x, axis=1)
+    return moving_average_batch(x, SMOOTHING)
+
+
+def moving_average_batch(data, window_size=5):
+    """np.convolve(row, ones/window_size, mode='same') for every row."""
+    offset = (window_size - 1) // 2
+    padded = np.pad(data, ((0, 0), (window_size - 1 - offset, offset)))
+    n = data.shape[1]
+    total = padded[:, :n].copy()
+    for k in range(1, window_size):
+        total += padded[:, k:k + n]
+    return total / window_size
+
+
+def local_maxima_batch(x):
+    """
+    Left edge, and midpoint, of every local maximum in every row, with the
+    flat-peak handling of scipy.signal.find_peaks.
+
+    Returns:
+        tuple: boolean mask of left edges, and the midpoint of each peak
+        at the position of its left edge.
+    """
+    rows, n = x.shape
+    cols = np.arange(n)
+    if n < 3:
+        return np.zeros(x.shape, dtype=bool), np.zeros(x.shape, dtype=np.int64)
+    # index of the first sample after i that differs from x[i], capped at n - 1
+    changes = np.where(x[:, 1:] != x[:, :-1], cols[1:], n - 1)
+    nxt = np.full(x.shape, n - 1)
+    nxt[:, :-1] = np.minimum.accumulate(changes[:, ::-1], axis=1)[:, ::-1]
+
+    is_peak = np.zeros(x.shape, dtype=bool)
+    is_peak[:, 1:-1] = x[:, 1:-1] > x[:, :-2]
+    is_peak &= x > np.take_along_axis(x, nxt, axis=1)
+    midpoints = (cols + nxt - 1) // 2
+    return is_peak, midpoints
+
+
+def select_by_distance(rows, positions, priority, distance, ties='find_peaks'):
+    """
+    Keep the highest-priority peaks so that no two kept peaks of the same
+    row are closer than `distance` samples, like the greedy highest-first
+    rule of scipy.signal.find_peaks, for all rows at once.
+
+    `rows`/`positions` must be sorted by (row, position) and candidates
+    at least 2 samples apart. Returns a boolean mask of the kept candidates.
+
+    `ties` picks the winner between equal priorities:
+    'find_peaks' ranks them by the default np.argsort of each row's
+    priorities, like find_peaks (that sort is not stable, so it takes a
+    loop over the rows); 'later' favours the later peak, like
+    hrcalc.remove_close_peaks.
+    """
+    count = len(positions)
+    keep = np.zeros(count, dtype=bool)
+    if count == 0:
+        return keep
+    rank = np.empty(count, dtype=np.int64)
+    if ties == 'later':
+        rank[np.lexsort((positions, priority))] = np.arange(count)
+    elif ties == 'find_peaks':
+        # only peaks of the same row are compared, so a rank within the row will do
+        bounds = np.flatnonzero(np.diff(rows)) + 1
+        for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [count]))):
+            rank[start + np.argsort(priority[start:end])] = np.arange(end - start)
+    else:
+        raise ValueError(f"unknown tie-break {ties!r}")
+    # candidates are at least 2 apart, so only this many neighbours can conflict
+    reach = min(count - 1, (distance - 1) // 2 + 1)
+    conflicts = [
+        (rows[k:] == rows[:-k]) & (positions[k:] - positions[:-k] < distance)
+        for k in range(1, reach + 1)
+    ]
+
+    alive = np.ones(count, dtype=bool)
+    while alive.any():
+        # a live peak wins when no live conflicting neighbour outranks it
+        wins = alive.copy()
+        for k, conflict in enumerate(conflicts, start=1):
+            wins[:-k] &= ~(conflict & alive[k:] & (rank[k:] > rank[:-k]))
+            wins[k:] &= ~(conflict & alive[:-k] & (rank[:-k] > rank[k:]))
+        keep |= wins
+        # winners suppress their neighbours
+        dead = wins.copy()
+        for k, conflict in enumerate(conflicts, start=1):
+            dead[:-k] |= conflict & wins[k:]
+            dead[k:] |= conflict & wins[:-k]
+        alive &= ~dead
+    return keep
+
+
+def ragged_to_padded(rows, values, n_rows):
+    """Scatter values grouped by (sorted) row into an (n_rows, max_count) NaN-padded array."""
+    counts = np.bincount(rows, minlength=n_rows)
+    padded = np.full((n_rows, counts.max() if len(rows) else 0), np.nan)
+    starts = np.cumsum(counts) - counts
+    padded[rows, np.arange(len(rows)) - starts[rows]] = values
+    return padded, counts
+
+
+def calculate_rmssd_batch(rr_intervals):
+    """
+    RMSSD of every row of a NaN-padded (n_windows, n_intervals) array.
+    Rows with fewer than 2 intervals give NaN.
+    """
+    diffs = np.diff(rr_intervals, axis=1)
+    valid = ~np.isnan(diffs)
+    count = valid.sum(axis=1)
+    total = np.where(valid, diffs, 0.0) ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, np.sqrt(total.sum(axis=1) / count), np.nan)
+
+
+def detect_peaks_batch(signals, fs):
+    """
+    detect_peaks for every row of `signals`.
+
+    Returns:
+        tuple: boolean peak mask, and bpm, ipm and rmssd arrays. Rows with
+        fewer than 2 peaks give 0 for all three, rows with exactly 2 give
+        NaN for rmssd (None in the single-window version).
+    """
+    signals = np.atleast_2d(np.asarray(signals, dtype=np.float64))
+    n_rows, n = signals.shape
+    is_peak, midpoints = local_maxima_batch(signals)
+    rows, left = np.nonzero(is_peak)
+    positions = midpoints[rows, left]
+    keep = select_by_distance(rows, positions, signals[rows, positions], fs // 2)
+    rows, positions = rows[keep], positions[keep]
+
+    peak_mask = np.zeros(signals.shape, dtype=bool)
+    peak_mask[rows, positions] = True
+    peak_positions, counts = ragged_to_padded(rows, positions, n_rows)
+    rr_intervals = np.diff(peak_positions, axis=1) * (1000 / fs)  # RR intervals in ms
+
+    enough = counts > 1
+    span = np.nansum(rr_intervals, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bpm = np.where(enough, 60000 / (span / np.maximum(counts - 1, 1)), 0.0)
+    ipm = np.where(enough, counts / (n / fs) * 60, 0.0)
+    rmssd = np.where(enough, calculate_rmssd_batch(rr_intervals), 0.0)
+    return peak_mask, bpm, ipm, rmssd
+
+
+def segment_max_batch(data, starts, ends):
+    """
+    Maximum and first index of the maximum of the flat array `data` over
+    each [starts[k], ends[k]). Segments must be non-empty, ordered and
+    not overlapping.
+    """
+    bounds = np.empty(2 * len(starts), dtype=np.int64)
+    bounds[0::2] = starts
+    bounds[1::2] = ends
+    base = bounds[0]
+    d = data[base:]
+    rel = bounds - base
+    maxima = np.maximum.reduceat(d, rel)
+    lengths = np.diff(np.append(rel, len(d)))
+    positions = np.where(d == np.repeat(maxima, lengths), np.arange(len(d)), len(d))
+    first = np.minimum.reduceat(positions, rel)
+    # odd entries are the gaps between segments
+    return maxima[0::2], first[0::2] + base
+
+
+def calc_hr_and_spo2_batch(ir_data, red_data):
+    """
+    hrcalc.calc_hr_and_spo2 for every row of `ir_data` and `red_data`,
+    with the same integer arithmetic.
+
+    Returns:
+        tuple: hr (int64), hr_valid (bool), spo2 (float64), spo2_valid (bool)
+        arrays. Invalid entries hold -999 like the single-window version.
+    """
+    ir_data = np.atleast_2d(np.asarray(ir_data)).astype(np.int64)
+    red_data = np.atleast_2d(np.asarray(red_data)).astype(np.int64)
+    n_rows, n = red_data.shape
+    ma = hrcalc.MA_SIZE
+
+    # remove DC mean and invert, so the peak detector finds valleys
+    red_mean = np.trunc(np.mean(red_data, axis=1)).astype(np.int64)
+    x = -1 * (red_data - red_mean[:, None])
+
+    # 4 point moving average, truncated like the int assignment in hrcalc
+    if n > ma:
+        csum = np.zeros((n_rows, n + 1), dtype=np.int64)
+        np.cumsum(x, axis=1, out=csum[:, 1:])
+        x[:, :n - ma] = (csum[:, ma:n] - csum[:, :n - ma]) / ma
+
+    n_th = np.clip(np.trunc(np.mean(x, axis=1)).astype(np.int64), 30, 60)
+
+    # find_peaks_above_min_height on the first BUFFER_SIZE samples of every row
+    size = min(hrcalc.BUFFER_SIZE, n)
+    xs = x[:, :size]
+    prev = np.concatenate((x[:, -1:], xs[:, :-1]), axis=1)
+    cols = np.arange(size)
+    changes = np.where(xs[:, 1:] != xs[:, :-1], cols[1:], size - 1)
+    nxt = np.full(xs.shape, size - 1)
+    nxt[:, :-1] = np.minimum.accumulate(changes[:, ::-1], axis=1)[:, ::-1]
+    is_peak = (xs > n_th[:, None]) & (xs > prev) & (xs > np.take_along_axis(xs, nxt, axis=1))
+    is_peak[:, size - 1] = False
+    is_peak &= np.cumsum(is_peak, axis=1) <= 15  # max_num
+
+    # remove_close_peaks: min_dist 4, and valleys closer than that to the start are dropped
+    rows, valleys = np.nonzero(is_peak)
+    near_start = valleys + 1 > 4
+    rows, valleys = rows[near_start], valleys[near_start]
+    keep = select_by_distance(rows, valleys, xs[rows, valleys], 5, ties='later')
+    rows, valleys = rows[keep], valleys[keep]
+    n_peaks = np.bincount(rows, minlength=n_rows)
+
+    # heart rate from the mean valley interval
+    hr = np.full(n_rows, -999, dtype=np.int64)
+    hr_valid = n_peaks >= 2
+    starts = np.cumsum(n_peaks) - n_peaks
+    if hr_valid.any():
+        first = valleys[starts[hr_valid]]
+        last = valleys[starts[hr_valid] + n_peaks[hr_valid] - 1]
+        interval = np.trunc((last - first) / (n_peaks[hr_valid] - 1)).astype(np.int64)
+        hr[hr_valid] = np.trunc(hrcalc.SAMPLE_FREQ * 60 / interval).astype(np.int64)
+
+    # valleys are always below BUFFER_SIZE here, so hrcalc's range check never triggers
+    spo2 = np.full(n_rows, -999.0)
+    spo2_valid = np.zeros(n_rows, dtype=bool)
+
+    same_row = rows[1:] == rows[:-1]
+    seg_rows = rows[1:][same_row]
+    v0 = valleys[:-1][same_row]
+    v1 = valleys[1:][same_row]
+    wide = (v1 - v0) > 3
+    seg_rows, v0, v1 = seg_rows[wide], v0[wide], v1[wide]
+    if len(v0) == 0:
+        return hr, hr_valid, spo2, spo2_valid
+
+    flat_start = seg_rows * n + v0
+    flat_end = seg_rows * n + v1
+    ir_flat = ir_data.ravel()
+    red_flat = red_data.ravel()
+    ir_dc_max, ir_dc_max_index = segment_max_batch(ir_flat, flat_start, flat_end)
+    red_dc_max, red_dc_max_index = segment_max_batch(red_flat, flat_start, flat_end)
+
+    red_ac = (red_flat[flat_end] - red_flat[flat_start]) * (red_dc_max_index - flat_start)
+    red_ac = red_flat[flat_start] + np.trunc(red_ac / (v1 - v0)).astype(np.int64)
+    red_ac = red_flat[red_dc_max_index] - red_ac
+
+    ir_ac = (ir_flat[flat_end] - ir_flat[flat_start]) * (ir_dc_max_index - flat_start)
+    ir_ac = ir_flat[flat_start] + np.trunc(ir_ac / (v1 - v0)).astype(np.int64)
+    ir_ac = ir_flat[ir_dc_max_index] - ir_ac
+
+    nume = red_ac * ir_dc_max
+    denom = ir_ac * red_dc_max
+    usable = (denom > 0) & (nume != 0)
+    # at most the first 5 usable segments of every row
+    usable_per_row = np.bincount(seg_rows[usable], minlength=n_rows)
+    rank = np.cumsum(usable) - 1 - (np.cumsum(usable_per_row) - usable_per_row)[seg_rows]
+    usable &= rank < 5
+    ratio = np.trunc(((nume[usable] * 100) & 0xffffffff) / denom[usable]).astype(np.int64)
+
+    # median-like average of the sorted ratios, as in hrcalc
+    table = np.full((n_rows, 5), 1 << 40)  # sorts after any real ratio
+    table[seg_rows[usable], rank[usable]] = ratio
+    table.sort(axis=1)
+    count = np.minimum(usable_per_row, 5)
+    mid = count // 2
+    lower = np.take_along_axis(table, np.maximum(mid - 1, 0)[:, None], axis=1)[:, 0]
+    upper = np.take_along_axis(table, np.minimum(mid, 4)[:, None], axis=1)[:, 0]
+    ratio_ave = np.where(mid > 1, np.trunc((lower + upper) / 2), np.where(count > 0, upper, 0)).astype(np.int64)
+
+    spo2_valid = (ratio_ave > 2) & (ratio_ave < 184)
+    r = ratio_ave[spo2_valid]
+    spo2[spo2_valid] = -45.060 * (r ** 2) / 10000.0 + 30.054 * r / 100.0 + 94.845
+    return hr, hr_valid, spo2, spo2_valid
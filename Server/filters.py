@@ -0,0 +1,74 @@
+# -*-coding:utf-8
+
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfilt_zi, sosfiltfilt
+
+
+class FilterBank:
+    """
+    Butterworth filters designed once per (btype, cutoff, fs, order) and
+    kept as second-order sections.
+    """
+
+    def __init__(self):
+        self.designs = {}
+
+    def sos(self, btype, cutoff, fs, order=5):
+        """Return the cached SOS coefficients, designing them on first use."""
+        key = (btype, float(cutoff), float(fs), order)
+        sos = self.designs.get(key)
+        if sos is None:
+            nyquist = 0.5 * fs
+            sos = butter(order, cutoff / nyquist, btype=btype, output='sos')
+            self.designs[key] = sos
+        return sos
+
+    def bandpass_sos(self, high_cutoff, low_cutoff, fs, order=5):
+        """High-pass followed by low-pass, as one cascade."""
+        return np.vstack([
+            self.sos('high', high_cutoff, fs, order),
+            self.sos('low', low_cutoff, fs, order),
+        ])
+
+    def apply(self, data, btype, cutoff, fs, order=5):
+        """
+        Offline zero-phase filtering of a whole window (the filtfilt path).
+
+        The edges are padded like the b/a filtfilt this replaced, by
+        3 * (order + 1) samples. On raw sensor windows the results differ
+        from it by a few 1e-9 of the largest input sample: about 2.5e-4
+        counts on a 1e5 DC level, or 1e-7 of the high-passed output (see
+        tests/test_filters.py). That difference is the b/a form's rounding
+        error on the 0.5 Hz high-pass, which SOS avoids.
+        """
+        return sosfiltfilt(self.sos(btype, cutoff, fs, order), data, padlen=3 * (order + 1))
+
+    def stream(self, sos):
+        """Return a causal filter that carries its state across chunks."""
+        return StreamingFilter(sos)
+
+
+class StreamingFilter:
+    """sosfilt with the `zi` state kept between calls."""
+
+    def __init__(self, sos):
+        self.sos = sos
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def process(self, chunk):
+        x = np.asarray(chunk, dtype=np.float64)
+        if len(x) == 0:
+            return x
+        if self.zi is None:
+            # start as if the signal had been at its first value forever,
+            # which avoids the step transient at the start of the stream
+            self.zi = sosfilt_zi(self.sos) * x[0]
+        y, self.zi = sosfilt(self.sos, x, zi=self.zi)
+        return y
+
+
+# shared by everything on the transmitter so each design happens once
+filter_bank = FilterBank()
@@ -0,0 +1,154 @@
+# -*-coding:utf-8
+
+# START_SYNC / STOP_SYNC handshake state of the transmitter.
+#
+#   IDLE --START_SYNC or RESUME--> SYNC_PENDING --ACK_ACK--> STREAMING
+#   STREAMING --STOP_SYNC--> STOP_PENDING --ACK_ACK--> IDLE
+#
+# A pending state that sees no ACK_ACK within the timeout falls back to
+# where it came from (SYNC_PENDING -> IDLE, STOP_PENDING -> STREAMING), and
+# a disconnect resets to IDLE from anywhere.
+
+import threading
+import time
+
+IDLE = "IDLE"
+SYNC_PENDING = "SYNC_PENDING"
+STREAMING = "STREAMING"
+STOP_PENDING = "STOP_PENDING"
+
+# pending state -> (state after ACK_ACK, state after a timeout)
+_PENDING = {
+    SYNC_PENDING: (STREAMING, IDLE),
+    STOP_PENDING: (IDLE, STREAMING),
+}
+
+
+class TransitionStats:
+    """Count and time spent in the source state, per transition."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1e3 if self.count else 0.0,
+            "max_ms": self.max * 1e3,
+            "last_ms": self.last * 1e3,
+        }
+
+
+class HandshakeStateMachine:
+    """
+    The handshake state of one connection, with ACK_ACK deadlines.
+
+    Commands and ACK_ACKs move the state under one Condition; a single
+    watcher thread, started on first use, sleeps on that Condition until
+    the pending deadline (or a notify) and applies timeouts. An ACK_ACK
+    completes the handshake in the receiving thread with no polling delay,
+    and repeated commands only move the deadline, they start no threads.
+
+    `on_transition(old, new, reason)` is called outside the lock after every
+    change; reason is "command", "ack", "timeout" or "reset".
+    """
+
+    def __init__(self, ack_timeout=20, on_transition=None):
+        self.ack_timeout = ack_timeout
+        self.on_transition = on_transition
+        self.state = IDLE
+        self.entered = time.monotonic()  # when the current state was entered
+        self.deadline = None  # monotonic time a pending state times out
+        self.condition = threading.Condition()
+        self.watcher = None
+        self.stats = {}  # (old, new) -> TransitionStats
+
+    @property
+    def streaming(self):
+        return self.state == STREAMING
+
+    def request_start(self):
+        """
+        START_SYNC or RESUME received. Returns True when it should be acknowledged:
+        from IDLE, or again while waiting for its ACK_ACK. While streaming
+        it is refused, an ACK_ACK for it would be taken for a stop.
+        """
+        return self._request(IDLE, SYNC_PENDING)
+
+    def request_stop(self):
+        """STOP_SYNC received. Returns True when it should be acknowledged."""
+        return self._request(STREAMING, STOP_PENDING)
+
+    def acknowledge(self):
+        """
+        ACK_ACK received. Returns the new state (STREAMING or IDLE), or None
+        when no handshake was waiting for it.
+        """
+        with self.condition:
+            if self.state not in _PENDING:
+                return None
+            new = _PENDING[self.state][0]
+            change = self._move(new)
+        self._notify(change, "ack")
+        return new
+
+    def reset(self):
+        """The connection is gone: back to IDLE whatever the state."""
+        with self.condition:
+            change = self._move(IDLE) if self.state != IDLE else None
+        self._notify(change, "reset")
+
+    def _request(self, source, pending):
+        with self.condition:
+            if self.state not in (source, pending):
+                return False
+            change = self._move(pending) if self.state == source else None
+            self.deadline = time.monotonic() + self.ack_timeout
+            self._ensure_watcher()
+            self.condition.notify()
+        self._notify(change, "command")
+        return True
+
+    def _move(self, new):
+        """Change state with the condition held; returns (old, new) for _notify."""
+        now = time.monotonic()
+        old = self.state
+        self.stats.setdefault((old, new), TransitionStats()).add(now - self.entered)
+        self.state = new
+        self.entered = now
+        if new not in _PENDING:
+            self.deadline = None
+        self.condition.notify()
+        return old, new
+
+    def _notify(self, change, reason):
+        if change is not None and self.on_transition:
+            self.on_transition(change[0], change[1], reason)
+
+    def _ensure_watcher(self):
+        if self.watcher is None:
+            self.watcher = threading.Thread(target=self._watch, name="handshake-deadlines", daemon=True)
+            self.watcher.start()
+
+    def _watch(self):
+        while True:
+            with self.condition:
+                while self.deadline is None or time.monotonic() < self.deadline:
+                    timeout = None if self.deadline is None else self.deadline - time.monotonic()
+                    self.condition.wait(timeout)
+                change = self._move(_PENDING[self.state][1])
+            self._notify(change, "timeout")
+
+    def transition_stats(self):
+        """{"OLD->NEW": {count, mean_ms, max_ms, last_ms}} for every transition seen."""
+        with self.condition:
+            return {f"{old}->{new}": stats.as_dict() for (old, new), stats in self.stats.items()}
@@ -17,111 +17,97 @@ def calc_hr_and_spo2(ir_data, red_data):
     By detecting  peaks of PPG cycle and corresponding AC/DC
     of red/infra-red signal, the an_ratio for the SPO2 is computed.
     """
+    # all arithmetic is done in int64, like the python ints of the original port
+    ir_data = np.asarray(ir_data)
+    red_data = np.asarray(red_data)
+    if np.issubdtype(ir_data.dtype, np.integer):
+        ir_data = ir_data.astype(np.int64)
+    if np.issubdtype(red_data.dtype, np.integer):
+        red_data = red_data.astype(np.int64)
 
-    # print("ir_data:  " + str(ir_data))
     # get dc mean
-    # ir_mean = int(np.mean(ir_data))
     red_mean = int(np.mean(red_data))  #Aneri
 
-    # print("ir_mean: " + str(ir_mean))
-
     # remove DC mean and inver signal
     # this lets peak detecter detect valley
-    # x = -1 * (np.array(ir_data) - ir_mean)
-    x = -1 * (np.array(red_data) - red_mean) #Aneri
-
-    # print("x after dc mean remove: " + str(x))
+    x = -1 * (red_data - red_mean) #Aneri
 
-    # 4 point moving average
+    # 4 point moving average, the last MA_SIZE samples are left as they are
     # x is np.array with int values, so automatically casted to int
-    for i in range(x.shape[0] - MA_SIZE):
-        x[i] = np.sum(x[i:i+MA_SIZE]) / MA_SIZE
-    
-    # print("x after 4 point moving avg: " + str(x))
+    n = x.shape[0]
+    if n > MA_SIZE:
+        if np.issubdtype(x.dtype, np.integer):
+            csum = np.concatenate(([0], np.cumsum(x)))
+            x[:n - MA_SIZE] = (csum[MA_SIZE:n] - csum[:n - MA_SIZE]) / MA_SIZE
+        else:
+            # keep the summation order of np.sum over each 4-sample slice
+            acc = x[:n - MA_SIZE].copy()
+            for k in range(1, MA_SIZE):
+                acc += x[k:n - MA_SIZE + k]
+            x[:n - MA_SIZE] = acc / MA_SIZE
 
     # calculate threshold
     n_th = int(np.mean(x))
     n_th = 30 if n_th < 30 else n_th  # min allowed
     n_th = 60 if n_th > 60 else n_th  # max allowed
 
-    # print("nth " + str(n_th))
-    # print("x" + str(x))
     ir_valley_locs, n_peaks = find_peaks(x, BUFFER_SIZE, n_th, 4, 15)
-    # print("ir_vally_location")
-    # print(ir_valley_locs)
-    # print(ir_valley_locs[:n_peaks], ",", end="")
-    peak_interval_sum = 0
+    ir_valley_locs = ir_valley_locs[:n_peaks]
+
     if n_peaks >= 2:
-        for i in range(1, n_peaks):
-            peak_interval_sum += (ir_valley_locs[i] - ir_valley_locs[i-1])
-        peak_interval_sum = int(peak_interval_sum / (n_peaks - 1))
+        # the intervals telescope to last - first
+        peak_interval_sum = int((ir_valley_locs[-1] - ir_valley_locs[0]) / (n_peaks - 1))
         hr = int(SAMPLE_FREQ * 60 / peak_interval_sum)
         hr_valid = True
-        
     else:
         hr = -999  # unable to calculate because # of peaks are too small
         hr_valid = False
-    
-    # ----------------- RMSSD -----------------------------
-    # if hr_valid:
-    #     if n_peaks >= 2:
-    #         rr_intervals = np.diff(ir_valley_locs) / SAMPLE_FREQ
-    #         rmssd = calculate_rmssd(rr_intervals)
-    #     else:
-    #         rmssd = None
-    # else:
-    #     rmssd = None
 
     # ---------spo2---------
 
-    # find precise min near ir_valley_locs (???)
-    exact_ir_valley_locs_count = n_peaks
-
     # find ir-red DC and ir-red AC for SPO2 calibration ratio
     # find AC/DC maximum of raw
 
     # FIXME: needed??
-    for i in range(exact_ir_valley_locs_count):
-        if ir_valley_locs[i] > BUFFER_SIZE:
-            spo2 = -999  # do not use SPO2 since valley loc is out of range
-            spo2_valid = False
-            return hr, hr_valid, spo2, spo2_valid
-
-    i_ratio_count = 0
-    ratio = []
+    if np.any(ir_valley_locs > BUFFER_SIZE):
+        spo2 = -999  # do not use SPO2 since valley loc is out of range
+        spo2_valid = False
+        return hr, hr_valid, spo2, spo2_valid
 
     # find max between two valley locations
     # and use ratio between AC component of Ir and Red DC component of Ir and Red for SpO2
-    red_dc_max_index = -1
-    ir_dc_max_index = -1
-    for k in range(exact_ir_valley_locs_count-1):
-        red_dc_max = -16777216
-        ir_dc_max = -16777216
-        if ir_valley_locs[k+1] - ir_valley_locs[k] > 3:
-            for i in range(ir_valley_locs[k], ir_valley_locs[k+1]):
-                if ir_data[i] > ir_dc_max:
-                    ir_dc_max = ir_data[i]
-                    ir_dc_max_index = i
-                if red_data[i] > red_dc_max:
-                    red_dc_max = red_data[i]
-                    red_dc_max_index = i
-
-            red_ac = int((red_data[ir_valley_locs[k+1]] - red_data[ir_valley_locs[k]]) * (red_dc_max_index - ir_valley_locs[k]))
-            red_ac = red_data[ir_valley_locs[k]] + int(red_ac / (ir_valley_locs[k+1] - ir_valley_locs[k]))
-            red_ac = red_data[red_dc_max_index] - red_ac  # subtract linear DC components from raw
-
-            ir_ac = int((ir_data[ir_valley_locs[k+1]] - ir_data[ir_valley_locs[k]]) * (ir_dc_max_index - ir_valley_locs[k]))
-            ir_ac = ir_data[ir_valley_locs[k]] + int(ir_ac / (ir_valley_locs[k+1] - ir_valley_locs[k]))
-            ir_ac = ir_data[ir_dc_max_index] - ir_ac  # subtract linear DC components from raw
-
-            nume = red_ac * ir_dc_max
-            denom = ir_ac * red_dc_max
-            if (denom > 0 and i_ratio_count < 5) and nume != 0:
-                # original cpp implementation uses overflow intentionally.
-                # but at 64-bit OS, Pyhthon 3.X uses 64-bit int and nume*100/denom does not trigger overflow
-                # so using bit operation ( &0xffffffff ) is needed
-                ratio.append(int(((nume * 100) & 0xffffffff) / denom))
-                i_ratio_count += 1
+    ratio = []
+    if n_peaks >= 2:
+        # segment k spans [valley k, valley k+1)
+        v0 = ir_valley_locs[:-1]
+        v1 = ir_valley_locs[1:]
+        ir_dc_max, ir_dc_max_index = segment_max(ir_data, ir_valley_locs)
+        red_dc_max, red_dc_max_index = segment_max(red_data, ir_valley_locs)
+
+        # only valleys more than 3 samples apart are used
+        wide = (v1 - v0) > 3
+        v0, v1 = v0[wide], v1[wide]
+        ir_dc_max, ir_dc_max_index = ir_dc_max[wide], ir_dc_max_index[wide]
+        red_dc_max, red_dc_max_index = red_dc_max[wide], red_dc_max_index[wide]
+
+        red_ac = (red_data[v1] - red_data[v0]) * (red_dc_max_index - v0)
+        red_ac = red_data[v0] + np.trunc(red_ac / (v1 - v0)).astype(np.int64)
+        red_ac = red_data[red_dc_max_index] - red_ac  # subtract linear DC components from raw
+
+        ir_ac = (ir_data[v1] - ir_data[v0]) * (ir_dc_max_index - v0)
+        ir_ac = ir_data[v0] + np.trunc(ir_ac / (v1 - v0)).astype(np.int64)
+        ir_ac = ir_data[ir_dc_max_index] - ir_ac  # subtract linear DC components from raw
+
+        nume = red_ac * ir_dc_max
+        denom = ir_ac * red_dc_max
+        # at most 5 ratios, taken from the first usable segments
+        usable = np.flatnonzero((denom > 0) & (nume != 0))[:5]
+        for k in usable:
+            # original cpp implementation uses overflow intentionally.
+            # but at 64-bit OS, Pyhthon 3.X uses 64-bit int and nume*100/denom does not trigger overflow
+            # so using bit operation ( &0xffffffff ) is needed
+            ratio.append(int(((int(nume[k]) * 100) & 0xffffffff) / int(denom[k])))
+    i_ratio_count = len(ratio)
 
     # choose median value since PPG signal may vary from beat to beat
     ratio = sorted(ratio)  # sort to ascending order
@@ -147,6 +133,21 @@ def calc_hr_and_spo2(ir_data, red_data):
     return hr, hr_valid, spo2, spo2_valid #,rmssd
 
 
+def segment_max(data, bounds):
+    """
+    Maximum of `data` and the index of its first occurrence in each segment
+    [bounds[k], bounds[k+1]). `bounds` must be strictly increasing.
+    """
+    start = bounds[0]
+    d = data[start:bounds[-1]]
+    rel = bounds[:-1] - start
+    maxima = np.maximum.reduceat(d, rel)
+    segment = np.repeat(np.arange(len(rel)), np.diff(np.append(rel, len(d))))
+    positions = np.where(d == maxima[segment], np.arange(len(d)), len(d))
+    first = np.minimum.reduceat(positions, rel) + start
+    return maxima, first
+
+
 def find_peaks(x, size, min_height, min_dist, max_num):
     """
     Find at most MAX_NUM peaks above MIN_HEIGHT separated by at least MIN_DISTANCE
@@ -162,29 +163,25 @@ def find_peaks(x, size, min_height, min_dist, max_num):
 def find_peaks_above_min_height(x, size, min_height, max_num):
     """
     Find all peaks above MIN_HEIGHT
+
+    A peak is the left edge of a (possibly flat) local maximum among the
+    first `size` samples: higher than the sample before it and than the
+    first different sample after it.
     """
+    size = min(size, len(x))
+    if size < 2:
+        return np.empty(0, dtype=np.int64), 0
+    xs = x[:size]
+    # the C code reads x[-1] for i = 0, which python resolves to the last sample
+    prev = np.concatenate((x[-1:], xs[:-1]))
+    # index of the first sample that differs from x[i], capped at size - 1 (flat peaks)
+    change = np.flatnonzero(xs[1:] != xs[:-1]) + 1
+    nxt = np.append(change, size - 1)[np.searchsorted(change, np.arange(size), side='right')]
 
-    i = 0
-    n_peaks = 0
-    ir_valley_locs = []  # [0 for i in range(max_num)]
-    while i < size - 1:
-        if x[i] > min_height and x[i] > x[i-1]:  # find the left edge of potential peaks
-            n_width = 1
-            # original condition i+n_width < size may cause IndexError
-            # so I changed the condition to i+n_width < size - 1
-            while i + n_width < size - 1 and x[i] == x[i+n_width]:  # find flat peaks
-                n_width += 1
-            if x[i] > x[i+n_width] and n_peaks < max_num:  # find the right edge of peaks
-                # ir_valley_locs[n_peaks] = i
-                ir_valley_locs.append(i)
-                n_peaks += 1  # original uses post increment
-                i += n_width + 1
-            else:
-                i += n_width
-        else:
-            i += 1
+    is_peak = (xs > min_height) & (xs > prev) & (xs > xs[nxt])
+    ir_valley_locs = np.flatnonzero(is_peak[:size - 1])[:max_num]
 
-    return ir_valley_locs, n_peaks
+    return ir_valley_locs, len(ir_valley_locs)
 
 
 def remove_close_peaks(n_peaks, ir_valley_locs, x, min_dist):
@@ -193,31 +190,22 @@ def remove_close_peaks(n_peaks, ir_valley_locs, x, min_dist):
     """
 
     # should be equal to maxim_sort_indices_descend
-    # order peaks from large to small
-    # should ignore index:0
-    sorted_indices = sorted(ir_valley_locs, key=lambda i: x[i])
-    sorted_indices.reverse()
-
-    # this "for" loop expression does not check finish condition
-    # for i in range(-1, n_peaks):
-    i = -1
-    while i < n_peaks:
-        old_n_peaks = n_peaks
-        n_peaks = i + 1
-        # this "for" loop expression does not check finish condition
-        # for j in (i + 1, old_n_peaks):
-        j = i + 1
-        while j < old_n_peaks:
-            n_dist = (sorted_indices[j] - sorted_indices[i]) if i != -1 else (sorted_indices[j] + 1)  # lag-zero peak of autocorr is at index -1
-            if n_dist > min_dist or n_dist < -1 * min_dist:
-                sorted_indices[n_peaks] = sorted_indices[j]
-                n_peaks += 1  # original uses post increment
-            j += 1
+    # order peaks from large to small, equal heights keep the later peak first
+    locs = np.asarray(ir_valley_locs[:n_peaks], dtype=np.int64)
+    locs = locs[np.argsort(x[locs], kind='stable')[::-1]]
+
+    # lag-zero peak of autocorr is at index -1
+    locs = locs[locs + 1 > min_dist]
+    # walk from the largest peak down, dropping smaller peaks that are too close
+    i = 0
+    while i < len(locs):
+        far = np.abs(locs[i + 1:] - locs[i]) > min_dist
+        locs = np.concatenate((locs[:i + 1], locs[i + 1:][far]))
         i += 1
 
-    sorted_indices[:n_peaks] = sorted(sorted_indices[:n_peaks])
+    locs = np.sort(locs)
 
-    return sorted_indices, n_peaks
+    return locs, len(locs)
 
 def calculate_rmssd(rr_intervals):
     """
@@ -2,12 +2,22 @@
 
 # this code is currently for python 2.7
 from __future__ import print_function
+import logging
 from time import sleep
-import smbus
+import numpy as np
+try:
+    import smbus
+except ImportError:
+    # only needed for the real sensor, simulated buses are passed in (see sensor_sim.py)
+    smbus = None
+
+log = logging.getLogger(__name__)
 
 # register addresses
 REG_INTR_STATUS_1 = 0x00
 REG_INTR_STATUS_2 = 0x01
+# INTR_STATUS_1 bit set once the FIFO reaches FIFO_A_FULL_SAMPLES, until the register is read
+INTR_A_FULL = 0x80
 
 REG_INTR_ENABLE_1 = 0x02
 REG_INTR_ENABLE_2 = 0x03
@@ -34,14 +44,36 @@ REG_PROX_INT_THRESH = 0x30
 REG_REV_ID = 0xFE
 REG_PART_ID = 0xFF
 
+# the FIFO holds 32 samples, 3 bytes per LED channel (red + ir in SpO2 mode)
+FIFO_DEPTH = 32
+BYTES_PER_SAMPLE = 6
+# SMBus block transfers are capped at 32 bytes, so read whole samples 30 bytes at a time
+MAX_BURST_BYTES = 30
+# A_FULL fires with 17 samples in the FIFO (FIFO_A_FULL = 0xF free slots, see setup())
+FIFO_A_FULL_SAMPLES = 17
+
 
 class MAX30102():
     # by default, this assumes that the device is at 0x57 on channel 1
-    def __init__(self, channel=1, address=0x57):
+    # `bus` can be any object with the smbus interface (used for benchmarking)
+    # `int_pin` is the BCM GPIO wired to the sensor INT line (GPIO4 on our boards)
+    def __init__(self, channel=1, address=0x57, bus=None, int_pin=None):
         #print("Channel: {0}, address: {1}".format(channel, address))
         self.address = address
         self.channel = channel
-        self.bus = smbus.SMBus(self.channel)
+        if bus is None and smbus is None:
+            raise RuntimeError("smbus is not installed, it is needed to talk to the sensor over I2C")
+        self.bus = bus if bus is not None else smbus.SMBus(self.channel)
+        self.int_pin = int_pin
+        self.gpio = None
+        # SPO2 sample rate 100Hz / sample avg 4, as configured in setup()
+        self.sample_rate = 25.0
+        # how much faster than real time samples arrive, only simulated sensors run faster
+        self.speed = 1.0
+        # samples lost to FIFO overflow, summed from OVF_COUNTER on every burst
+        self.dropped_samples = 0
+        if int_pin is not None:
+            self.setup_interrupt(int_pin)
 
         self.reset()
 
@@ -53,6 +85,21 @@ class MAX30102():
         self.setup()
         # print("[SETUP] setup complete")
 
+    def setup_interrupt(self, int_pin):
+        """
+        Watch the INT line so reads can sleep until the FIFO is almost full.
+        Falls back to timed sleeps when no GPIO library is available.
+        """
+        try:
+            import RPi.GPIO as GPIO
+            GPIO.setmode(GPIO.BCM)
+            # INT is open-drain, active low
+            GPIO.setup(int_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            self.gpio = GPIO
+        except (ImportError, RuntimeError) as e:
+            log.info("[SETUP] INT pin unavailable (%s), using timed sleeps", e)
+            self.gpio = None
+
     def shutdown(self):
         """
         Shutdown the device.
@@ -73,7 +120,9 @@ class MAX30102():
         # INTR setting
         # 0xc0 : A_FULL_EN and PPG_RDY_EN = Interrupt will be triggered when
         # fifo almost full & new fifo data ready
-        self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_1, [0xc0])
+        # 0x80 : A_FULL_EN only, when INT is watched so it is not asserted every sample
+        intr_enable = 0x80 if self.gpio is not None else 0xc0
+        self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_1, [intr_enable])
         self.bus.write_i2c_block_data(self.address, REG_INTR_ENABLE_2, [0x00])
 
         # FIFO_WR_PTR[4:0]
@@ -139,11 +188,88 @@ class MAX30102():
 
         return red_led, ir_led
 
-    def read_sequential(self, amount=100):
+    def get_fifo_status(self):
+        """
+        Read FIFO_WR_PTR, OVF_COUNTER and FIFO_RD_PTR in a single block read.
+        Returns (num_samples, overflow_count).
+        """
+        write_ptr, overflow, read_ptr = self.bus.read_i2c_block_data(self.address, REG_FIFO_WR_PTR, 3)
+        num_samples = (write_ptr - read_ptr) % FIFO_DEPTH
+        # equal pointers mean an empty or a full FIFO. A full one has
+        # overflowed, or has not yet but raised A_FULL on its way up: the
+        # bursts read (and clear) INTR_STATUS_1 before draining the FIFO, so
+        # A_FULL is only set again once FIFO_A_FULL_SAMPLES new samples came.
+        if num_samples == 0:
+            if overflow > 0 or self.bus.read_i2c_block_data(self.address, REG_INTR_STATUS_1, 1)[0] & INTR_A_FULL:
+                num_samples = FIFO_DEPTH
+        return num_samples, overflow
+
+    def read_fifo_burst(self, max_samples=FIFO_DEPTH):
+        """
+        Read every pending sample (at most `max_samples`) from the FIFO
+        with as few block transfers as possible.
+        Returns red and ir readings as int32 numpy arrays.
+        """
+        num_samples, overflow = self.get_fifo_status()
+        self.dropped_samples += overflow
+        num_samples = min(num_samples, max_samples)
+        if num_samples == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+        # read & clear both interrupt registers once per burst (values are discarded)
+        self.bus.read_i2c_block_data(self.address, REG_INTR_STATUS_1, 2)
+
+        # FIFO_DATA does not auto-increment, so consecutive reads walk the FIFO
+        raw = bytearray()
+        remaining = num_samples * BYTES_PER_SAMPLE
+        while remaining > 0:
+            chunk = min(remaining, MAX_BURST_BYTES)
+            raw += bytearray(self.bus.read_i2c_block_data(self.address, REG_FIFO_DATA, chunk))
+            remaining -= chunk
+
+        return unpack_samples(raw)
+
+    def wait_for_samples(self, needed):
+        """
+        Sleep until about `needed` new samples are in the FIFO, instead of
+        polling the FIFO pointers. Waits on the almost-full interrupt when
+        the INT line is watched, otherwise sleeps for the computed fill time.
+        """
+        needed = min(needed, FIFO_A_FULL_SAMPLES)
+        if needed <= 0:
+            return
+        fill_time = needed / (self.sample_rate * self.speed)
+        if self.gpio is not None and needed == FIFO_A_FULL_SAMPLES:
+            # INT stays low until the status registers are read
+            if self.gpio.input(self.int_pin) == 0:
+                return
+            # the timeout only guards against a missed edge
+            timeout_ms = int(fill_time * 1500) + 50
+            self.gpio.wait_for_edge(self.int_pin, self.gpio.FALLING, timeout=timeout_ms)
+        else:
+            sleep(fill_time)
+
+    def read_sequential(self, amount=100, burst=True):
         """
         This function will read the red-led and ir-led `amount` times.
         This works as blocking function.
+        With `burst` set, the FIFO is drained in block transfers, the wait
+        for new samples sleeps rather than polls, and int32 numpy arrays
+        are returned.
         """
+        if burst:
+            red_buf = np.empty(amount, dtype=np.int32)
+            ir_buf = np.empty(amount, dtype=np.int32)
+            count = 0
+            while count < amount:
+                red, ir = self.read_fifo_burst(amount - count)
+                red_buf[count:count + len(red)] = red
+                ir_buf[count:count + len(ir)] = ir
+                count += len(red)
+                if count < amount:
+                    self.wait_for_samples(amount - count)
+            return red_buf, ir_buf
+
         red_buf = []
         ir_buf = []
         count = amount
@@ -181,3 +307,14 @@ class MAX30102():
                 #sleep(1 / sample_frq)
 
         return red_buf, ir_buf
+
+
+def unpack_samples(raw):
+    """
+    Unpack raw FIFO bytes (3 bytes red, 3 bytes ir per sample) into
+    int32 red and ir arrays.
+    """
+    d = np.frombuffer(bytes(raw), dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+    # mask MSB [23:18]
+    values = (d[:, 0] << 16 | d[:, 1] << 8 | d[:, 2]) & 0x03FFFF
+    return values[0::2], values[1::2]
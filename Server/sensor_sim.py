@@ -0,0 +1,295 @@
+# -*-coding:utf-8
+
+# Sensor backends that need no hardware.
+#
+# Both backends sit behind the smbus interface: SimulatedBus models the
+# MAX30102 registers and FIFO (32 samples deep, filled in real time, new
+# samples dropped and OVF_COUNTER incremented while it is full, pointers
+# advanced by FIFO_DATA reads, A_FULL latched in INTR_STATUS_1 until it is
+# read) and is handed to the real MAX30102 driver as
+# its `bus`. So everything above the I2C transfers, read_sequential and the
+# acquisition thread included, runs the same code as on the Pi.
+#
+# create_sensor() picks the backend from a spec string, which server.py reads
+# from the PULSE_SENSOR environment variable:
+#
+#   max30102                                   the real sensor (default)
+#   sim[:hr=72,hrv=0.05,spo2=97,noise=20,fs=25,speed=1,seed=0]
+#   replay:<recording directory, .csv or .npz>[,speed=4,loop=0]
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+import max30102
+
+log = logging.getLogger(__name__)
+
+# typical raw readings from our boards with the LED currents set in setup()
+IR_DC = 120000
+RED_DC = 100000
+IR_PERFUSION = 0.02  # AC/DC of the ir channel
+
+
+def spo2_to_ratio(spo2):
+    """
+    The red/ir ratio of ratios that hrcalc maps back to `spo2`, taken on the
+    falling branch of its calibration curve
+    (spo2 = -45.060 r^2 + 30.054 r + 94.845).
+    """
+    a, b, c = -45.060, 30.054, 94.845 - min(spo2, 99.8)
+    return (-b - np.sqrt(b * b - 4 * a * c)) / (2 * a)
+
+
+class SyntheticPPG:
+    """
+    Red/ir PPG with a given heart rate, beat-to-beat variability (standard
+    deviation of the RR interval, in seconds), SpO2 and sensor noise (in
+    ADC counts), at `sample_rate` samples per second.
+    """
+
+    def __init__(self, heart_rate=72.0, hrv=0.05, spo2=97.0, noise=20.0, sample_rate=25.0, seed=None):
+        self.heart_rate = heart_rate
+        self.hrv = hrv
+        self.noise = noise
+        self.sample_rate = sample_rate
+        self.red_perfusion = IR_PERFUSION * spo2_to_ratio(spo2)
+        self.rng = np.random.default_rng(seed)
+        self.index = 0  # next sample to produce
+        self.beats = np.zeros(1)  # beat onset times, in seconds
+
+    def _schedule_beats(self, until):
+        """Make sure beat onsets are known up to past `until`."""
+        mean_rr = 60.0 / self.heart_rate
+        while self.beats[-1] <= until:
+            count = int((until - self.beats[-1]) / mean_rr) + 2
+            rr = np.clip(self.rng.normal(mean_rr, self.hrv, count), 0.3, 2.0)
+            self.beats = np.concatenate((self.beats, self.beats[-1] + np.cumsum(rr)))
+
+    def read(self, n):
+        """The next `n` samples, as int32 red and ir arrays."""
+        t = (self.index + np.arange(n)) / self.sample_rate
+        self.index += n
+        if n == 0:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        self._schedule_beats(t[-1])
+        k = np.searchsorted(self.beats, t, side='right') - 1
+        phase = (t - self.beats[k]) / (self.beats[k + 1] - self.beats[k])
+        # systolic peak and a smaller dicrotic wave, 0..~1
+        pulse = np.exp(-((phase - 0.2) / 0.08) ** 2) + 0.4 * np.exp(-((phase - 0.5) / 0.1) ** 2)
+        # breathing moves the baseline a little
+        baseline = 1.0 + 0.005 * np.sin(2 * np.pi * 0.25 * t)
+        # blood absorbs light, so less reaches the photodiode at systole
+        ir = IR_DC * baseline * (1.0 - IR_PERFUSION * pulse)
+        red = RED_DC * baseline * (1.0 - self.red_perfusion * pulse)
+        ir += self.rng.normal(0.0, self.noise, n)
+        red += self.rng.normal(0.0, self.noise, n)
+        # drop older beats so a long run does not grow the schedule
+        self.beats = self.beats[max(0, k[-1] - 1):]
+        return (np.clip(red, 0, 0x03FFFF).astype(np.int32),
+                np.clip(ir, 0, 0x03FFFF).astype(np.int32))
+
+
+class ReplaySource:
+    """
+    Red/ir samples from a file, in order, looping at the end unless `loop`
+    is off: a recording directory (its raw stream, see Common/recorder.py),
+    a .npz with `red` and `ir` arrays, or a .csv with red,ir columns.
+    """
+
+    def __init__(self, path, loop=True):
+        self.loop = loop
+        self.sample_rate = None  # known for recordings only
+        if os.path.isdir(path):
+            import recorder
+            records = recorder.RecordingReader(path, "raw").query()
+            red, ir = records["red"], records["ir"]
+            if len(records) > 1:
+                self.sample_rate = round(1.0 / float(np.median(np.diff(records["timestamp"]))), 3)
+        elif path.endswith(".npz"):
+            with np.load(path) as data:
+                red, ir = data["red"], data["ir"]
+        else:
+            data = np.loadtxt(path, delimiter=",", ndmin=2)
+            red, ir = data[:, 0], data[:, 1]
+        self.red = np.asarray(red, dtype=np.int32)
+        self.ir = np.asarray(ir, dtype=np.int32)
+        if len(self.red) == 0:
+            raise ValueError(f"no samples to replay in {path}")
+        self.position = 0
+
+    def read(self, n):
+        """The next `n` samples, fewer once a non-looping replay runs out."""
+        if self.loop:
+            idx = (self.position + np.arange(n)) % len(self.red)
+            self.position = (self.position + n) % len(self.red)
+        else:
+            idx = np.arange(self.position, min(self.position + n, len(self.red)))
+            self.position += len(idx)
+        return self.red[idx], self.ir[idx]
+
+
+class SimulatedBus:
+    """
+    smbus stand-in for a MAX30102 whose FIFO is filled from `source` at
+    `sample_rate`, `speed` times faster than real time.
+    """
+
+    def __init__(self, source, sample_rate=25.0, speed=1.0):
+        self.source = source
+        self.sample_rate = sample_rate
+        self.speed = speed
+        self.fifo = bytearray()  # 6 bytes per sample, as FIFO_DATA returns them
+        self.fifo_read_offset = 0  # bytes of the oldest sample already read
+        self.read_ptr = 0
+        self.overflow = 0
+        self.a_full = False  # INTR_STATUS_1 A_FULL, cleared by reading the register
+        self.running = False
+        self.produced = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _restart(self):
+        self.fifo.clear()
+        self.fifo_read_offset = 0
+        self.read_ptr = 0
+        self.overflow = 0
+        self.a_full = False
+        self.produced = 0
+        self.started = time.monotonic()
+
+    def _advance(self):
+        """Add the samples that became due since the last register access."""
+        if not self.running:
+            return
+        due = int((time.monotonic() - self.started) * self.sample_rate * self.speed) - self.produced
+        if due <= 0:
+            return
+        self.produced += due
+        red, ir = self.source.read(due)
+        free = max30102.FIFO_DEPTH - (len(self.fifo) + self.fifo_read_offset) // 6
+        if len(red) > free:
+            # FIFO_ROLLOVER_EN is off, so samples arriving at a full FIFO are lost
+            self.overflow = min(self.overflow + len(red) - free, 0x1F)
+            red, ir = red[:free], ir[:free]
+        before = max30102.FIFO_DEPTH - free
+        if before < max30102.FIFO_A_FULL_SAMPLES <= before + len(red):
+            self.a_full = True
+        self.fifo += pack_samples(red, ir)
+
+    def _register(self, reg):
+        samples = (len(self.fifo) + self.fifo_read_offset) // 6
+        if reg == max30102.REG_FIFO_WR_PTR:
+            return (self.read_ptr + samples) % max30102.FIFO_DEPTH
+        if reg == max30102.REG_OVF_COUNTER:
+            return self.overflow
+        if reg == max30102.REG_FIFO_RD_PTR:
+            return self.read_ptr
+        if reg == max30102.REG_INTR_STATUS_1:
+            return max30102.INTR_A_FULL if self.a_full else 0
+        if reg == max30102.REG_PART_ID:
+            return 0x15
+        return 0
+
+    def _read_fifo_data(self, length):
+        data = self.fifo[:length]
+        del self.fifo[:length]
+        consumed = self.fifo_read_offset + len(data)
+        self.read_ptr = (self.read_ptr + consumed // 6) % max30102.FIFO_DEPTH
+        self.fifo_read_offset = consumed % 6
+        if data:
+            self.overflow = 0
+        # reading an empty FIFO returns zeros
+        return list(data) + [0] * (length - len(data))
+
+    def read_byte_data(self, address, reg):
+        with self.lock:
+            self._advance()
+            return self._register(reg)
+
+    def read_i2c_block_data(self, address, reg, length):
+        with self.lock:
+            self._advance()
+            if reg == max30102.REG_FIFO_DATA:
+                return self._read_fifo_data(length)
+            values = [self._register(reg + i) for i in range(length)]
+            if reg == max30102.REG_INTR_STATUS_1:
+                self.a_full = False
+            return values
+
+    def write_i2c_block_data(self, address, reg, data):
+        with self.lock:
+            if reg == max30102.REG_MODE_CONFIG and data:
+                if data[0] & 0x40:  # reset
+                    self.running = False
+                    self._restart()
+                elif data[0] & 0x80:  # shutdown
+                    self.running = False
+                else:
+                    self.running = True
+                    self._restart()
+            elif reg in (max30102.REG_FIFO_WR_PTR, max30102.REG_FIFO_RD_PTR, max30102.REG_OVF_COUNTER):
+                self._restart()
+
+
+def pack_samples(red, ir):
+    """Inverse of max30102.unpack_samples: 3 big-endian bytes red, then ir, per sample."""
+    values = np.stack((red, ir), axis=1).astype(np.uint32) & 0x03FFFF
+    shifts = np.array([16, 8, 0], dtype=np.uint32)
+    return ((values[:, :, None] >> shifts) & 0xFF).astype(np.uint8).tobytes()
+
+
+def parse_sensor_spec(spec):
+    """
+    Split "kind:arg,key=value,..." into (kind, positional args, options).
+    """
+    kind, _, rest = (spec or "max30102").partition(":")
+    args, options = [], {}
+    for part in filter(None, rest.split(",")):
+        key, sep, value = part.partition("=")
+        if sep:
+            options[key.strip()] = value.strip()
+        else:
+            args.append(part)
+    return kind.strip(), args, options
+
+
+def create_sensor(spec=None, int_pin=None):
+    """
+    Open the sensor backend described by `spec` (see the top of this file)
+    and return a MAX30102 driver for it.
+    """
+    kind, args, options = parse_sensor_spec(spec)
+    if kind == "max30102":
+        return max30102.MAX30102(int_pin=int_pin)
+
+    speed = float(options.pop("speed", 1.0))
+    if kind == "sim":
+        sample_rate = float(options.pop("fs", 25.0))
+        source = SyntheticPPG(
+            heart_rate=float(options.pop("hr", 72.0)),
+            hrv=float(options.pop("hrv", 0.05)),
+            spo2=float(options.pop("spo2", 97.0)),
+            noise=float(options.pop("noise", 20.0)),
+            sample_rate=sample_rate,
+            seed=int(options["seed"]) if "seed" in options else None,
+        )
+        options.pop("seed", None)
+    elif kind == "replay":
+        if not args:
+            raise ValueError("replay needs a file or recording directory, e.g. replay:/data/night1")
+        source = ReplaySource(args[0], loop=options.pop("loop", "1") not in ("0", "false", "no"))
+        sample_rate = float(options.pop("fs", source.sample_rate or 25.0))
+    else:
+        raise ValueError(f"unknown sensor backend {kind!r}")
+    if options:
+        raise ValueError(f"unknown {kind} sensor option(s): {', '.join(sorted(options))}")
+
+    sensor = max30102.MAX30102(bus=SimulatedBus(source, sample_rate, speed))
+    sensor.sample_rate = sample_rate
+    sensor.speed = speed
+    log.info("[SETUP] using the %s sensor backend at %g Hz, %gx real time", kind, sample_rate, speed)
+    return sensor
@@ -1,81 +1,117 @@
-import bluetooth
+import time
+import startup
+startup_timer = startup.StartupTimer()  # before the other imports, see --startup-timing
+
 import threading
+import collections
 import json
-import time
+import logging
+import select
+import signal
 import subprocess
+import os
+import sys
+
+# wire format, stream framing and transports shared with the receiver
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+import wire
+import framing
+import transport
+import instrument
+import logs
+import profiler
 
 # ********************************* sensor ********************************
-import max30102
-import hrcalc
+# The sensor driver and the scipy-based DSP modules are imported where they
+# are first used, on the sensor init thread, so importing this module needs
+# neither the hardware nor scipy and the listener comes up first.
+import handshake
 
-from collections import deque
 import numpy as np
-hrstd_queue = deque()
 import random
-from scipy.signal import butter, filtfilt, find_peaks
-WINDOW_SIZE = 10
-# Initialize the MAX30102 sensor
-m = max30102.MAX30102()
+# metrics are reported over an 8 s window, updated every second
+METRIC_WINDOW_SECONDS = 8
+METRIC_HOP_SECONDS = 1
+# raw sample history kept between the acquisition thread and the DSP
+RING_BUFFER_SECONDS = 60
+# pulse packets kept for receivers that RESUME after a dropout, five minutes at one a second
+RETRANSMIT_PACKETS = 300
+# the MAX30102's INT line is wired to GPIO4
+SENSOR_INT_PIN = 4
+# /metrics for Prometheus; set PULSE_METRICS_ADDR empty to turn it off
+DEFAULT_METRICS_ADDRESS = "0.0.0.0:9102"
+startup_timer.mark("imports")
 # ********************************* sensor ********************************
 
+log = logging.getLogger("server")
+
+PACKETS_SENT = instrument.counter("pulse_packets_sent_total", "Pulse packets sent to the receiver, replays included")
+RAW_FRAMES_SENT = instrument.counter("pulse_raw_frames_sent_total", "Raw waveform frames sent to the receiver")
+BYTES_SENT = instrument.counter("pulse_bytes_sent_total", "Bytes sent to the receiver")
+SEND_ERRORS = instrument.counter("pulse_send_errors_total", "Sends that failed because the receiver went away")
+COMMANDS_RECEIVED = instrument.counter("pulse_commands_received_total", "Commands received from the receiver")
+PACKETS_REPLAYED = instrument.counter("pulse_packets_replayed_total", "Pulse packets resent after a RESUME")
+ENCODE_SECONDS = instrument.timer("pulse_encode_seconds", "Serializing one pulse or raw packet")
+SEND_SECONDS = instrument.timer("pulse_send_seconds", "Writing one frame to the receiver's socket")
+WINDOW_WAIT_SECONDS = instrument.timer("pulse_window_wait_seconds", "Waiting for the acquisition thread to fill the next hop")
+METRICS_UPDATE_SECONDS = instrument.timer("pulse_metrics_update_seconds", "Filtering, peak detection and metrics for one hop")
+
 class BluetoothConnectionManager:
-    def __init__(self, on_connect_callback, on_disconnect_callback, on_data_received_callback, device_name="PiBluetoothServer"):
-        self.server_socket = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-        self.server_socket.bind(("", bluetooth.PORT_ANY))
-        self.server_socket.listen(1)
+    def __init__(self, on_connect_callback, on_disconnect_callback, on_data_received_callback, device_name="PiBluetoothServer",
+                 address=transport.DEFAULT_LISTEN_ADDRESS):
+        # RFCOMM by default; tcp:/unix:/inproc: addresses run the same protocol without Bluetooth
+        self.address = address
+        self.server_socket = transport.listen(address)
         self.client_socket = None
         self.client_address = None
         self.on_connect_callback = on_connect_callback
         self.on_disconnect_callback = on_disconnect_callback
         self.on_data_received_callback = on_data_received_callback
 
-        # Set the Bluetooth device name
-        self.set_device_name(device_name)
-        
-        # Automatically set discoverable and pairable
-        self.set_discoverable()
-        print("Bluetooth server initialized and waiting for client connection...")
+        if transport.is_bluetooth(address):
+            # name, discoverable and pairable in one bluetoothctl run, off the startup path:
+            # receivers that know our address can connect before it finishes
+            self.adapter_thread = threading.Thread(target=self.configure_adapter, args=(device_name,), daemon=True)
+            self.adapter_thread.start()
+        log.info("Server listening on %s, waiting for client connection...", address)
 
         self.accept_thread = threading.Thread(target=self.accept_connection, daemon=True)
         self.accept_thread.start()
 
-    def set_device_name(self, name):
-        """Set the Bluetooth device name."""
+    def configure_adapter(self, name, timeout=10):
+        """Set the Bluetooth device name and make it discoverable and pairable, in one bluetoothctl session."""
+        commands = f"system-alias {name}\ndiscoverable on\npairable on\nquit\n"
         try:
-            subprocess.run(["bluetoothctl", "system-alias", name], check=True)
-            print(f"Bluetooth device name set to: {name}")
-        except subprocess.CalledProcessError as e:
-            print(f"Failed to set Bluetooth device name: {e}")
-
-    def set_discoverable(self):
-        """Set the device as discoverable and pairable."""
-        try:
-            subprocess.run(["bluetoothctl", "discoverable", "on"], check=True)
-            subprocess.run(["bluetoothctl", "pairable", "on"], check=True)
-            print("Bluetooth is now discoverable and pairable.")
-        except subprocess.CalledProcessError as e:
-            print(f"Failed to set discoverable/pairable mode: {e}")
+            result = subprocess.run(["bluetoothctl"], input=commands, capture_output=True, text=True,
+                                    timeout=timeout, check=True)
+        except (OSError, subprocess.SubprocessError) as e:
+            log.error("Failed to set the Bluetooth name and discoverable/pairable mode: %s", e)
+            return
+        if "Failed" in result.stdout or "not available" in result.stdout:
+            log.warning("bluetoothctl reported a problem:\n%s", result.stdout.strip())
+        else:
+            log.info("Bluetooth device name set to: %s, now discoverable and pairable.", name)
 
     def accept_connection(self):
         """Wait for a client to connect."""
         while True:
             try:
-                print("Waiting for a new client to connect...")
+                log.info("Waiting for a new client to connect...")
                 self.client_socket, self.client_address = self.server_socket.accept()
-                print(f"New client connected: {self.client_address}")
+                log.info("New client connected: %s", self.client_address)
                 self.on_connect_callback()
                 self.listen_for_data()
-            except bluetooth.BluetoothError as e:
-                print(f"Bluetooth error during connection: {e}")
-            except Exception as e:
-                print(f"Unexpected error: {e}")
+            except OSError as e:
+                log.warning("Connection error: %s", e)
+            except Exception:
+                log.exception("Unexpected error")
             finally:
                 # Ensure proper cleanup after disconnection
                 if self.client_socket:
                     try:
                         self.client_socket.close()
                     except Exception as close_error:
-                        print(f"Error closing client socket: {close_error}")
+                        log.warning("Error closing client socket: %s", close_error)
                 self.client_socket = None
                 self.client_address = None
                 self.on_disconnect_callback()
@@ -83,118 +119,306 @@ class BluetoothConnectionManager:
                 
     def listen_for_data(self):
         """Listen for data from the client."""
-        while True:
-            if self.client_socket:
-                try:
-                    data = self.client_socket.recv(1024).decode("utf-8").strip()
-                    if data:
-                        self.on_data_received_callback(data)
-                except bluetooth.BluetoothError as e:
-                    print(f"Bluetooth error: {e}")
-                    self.on_disconnect_callback()
+        reader = framing.FrameReader()
+        while self.client_socket:
+            try:
+                if reader.waiting_for_newline():
+                    # wait only so long for the rest of a line, an old client sends no newline
+                    readable, _, _ = select.select([self.client_socket], [], [], framing.LINE_TIMEOUT)
+                    if not readable:
+                        self.handle_frames(reader, unterminated=True)
+                        continue
+                if reader.recv_from(self.client_socket) == 0:
+                    log.info("Client closed the connection.")
                     break
+                # one recv may hold several commands, or only part of one
+                self.handle_frames(reader)
+            except OSError as e:
+                log.warning("Connection error: %s", e)
+                self.on_disconnect_callback()
+                break
+
+    def handle_frames(self, reader, unterminated=False):
+        """
+        Pass every complete command in `reader` on, dropping the frames that
+        do not decode; with `unterminated`, the text the client left without
+        a newline is taken as a whole command first.
+        """
+        while True:
+            try:
+                if unterminated:
+                    unterminated = False
+                    frame = reader.take_unterminated()
+                else:
+                    frame = reader.next_frame()
+            except wire.FrameError as e:
+                # the reader has moved past the bad frame, or dropped its buffer
+                log.warning("Dropping undecodable data from client: %s", e)
+                continue
+            if frame is None:
+                return
+            kind, message = frame
+            if kind == framing.TEXT:
+                self.on_data_received_callback(message)
 
     def send_message(self, message):
         if self.client_socket:
             try:
-                self.client_socket.send(message.encode())
-            except bluetooth.BluetoothError as e:
-                print(f"Failed to send message. Client may have disconnected: {e}")
+                # text (commands, JSON) is newline-framed, binary frames carry their length
+                if isinstance(message, str):
+                    message = framing.encode_text(message)
+                started = time.perf_counter()
+                self.client_socket.send(message)
+                SEND_SECONDS.observe(time.perf_counter() - started)
+                BYTES_SENT.inc(len(message))
+            except OSError as e:
+                SEND_ERRORS.inc()
+                log.warning("Failed to send message. Client may have disconnected: %s", e)
                 self.on_disconnect_callback()
 
 
 class BluetoothPulseServer:
-    def __init__(self):
+    def __init__(self, address=transport.DEFAULT_LISTEN_ADDRESS, sensor_spec=None):
         self.pulse_data = []
         self.stop_event = threading.Event()
-        self.transmit_data = False
-        self.ack_timeout = 20  # Timeout for receiving ACK_ACK
-        self.pending_ack_ack = False
-        self.ack_lock = threading.Lock()
+        # IDLE -> SYNC_PENDING -> STREAMING -> STOP_PENDING, ACK_ACK awaited for 20 s
+        self.handshake = handshake.HandshakeStateMachine(ack_timeout=20, on_transition=self.on_handshake_transition)
+        self.wire_format = wire.FORMAT_JSON  # negotiated in the START_SYNC handshake
+        self.sequence = 0  # last pulse packet number, continues across connections
+        self.raw_sequence = 0  # raw frames are numbered separately so pulse gaps mean loss
+        self.retransmit = collections.deque(maxlen=RETRANSMIT_PACKETS)  # recent pulse packets
+        self.resume_after = None  # set by RESUME: replay packets after this one before streaming on
+        self.raw_decimation = 0  # raw waveform streaming: 0 = off, N = every Nth sample
+        self.last_window = None  # red, ir, timestamps and first sample index of the last hop
+
+        self.stream_filters = {}  # causal preprocess_signal state, per sample rate
+        self.first_packet = threading.Event()
+
+        # the sensor takes over a second to reset and the DSP modules pull in scipy:
+        # open it in the background while the listener comes up and clients handshake
+        self.sensor = None
+        self.sensor_error = None
+        self.sensor_ready = threading.Event()
+        self.sample_buffer = None
+        self.read_cursor = 0
+        self.acquisition = None
+        self.metric_engine = None
+        # PULSE_SENSOR=sim or PULSE_SENSOR=replay:<file> runs without one (see sensor_sim.py)
+        if sensor_spec is None:
+            sensor_spec = os.environ.get("PULSE_SENSOR")
+        self.sensor_thread = threading.Thread(target=self.open_sensor, args=(sensor_spec,), name="sensor-init", daemon=True)
+        self.sensor_thread.start()
+        self.register_metrics()
 
         self.bluetooth_manager = BluetoothConnectionManager(
             on_connect_callback=self.start_data_collection,
             on_disconnect_callback=self.stop_data_collection,
             on_data_received_callback=self.data_received_callback,
-            device_name="IOT_Innovator_Server"
+            device_name="IOT_Innovator_Server",
+            address=address,
         )
+        startup_timer.mark("listening")
+
+    def register_metrics(self):
+        """Gauges read from this server's state when /metrics is scraped."""
+        instrument.gauge("pulse_sequence", "Number of the last pulse packet", lambda: self.sequence)
+        instrument.gauge("pulse_streaming", "1 while the handshake is in STREAMING", lambda: self.transmit_data)
+        instrument.gauge("pulse_retransmit_buffered", "Pulse packets kept for RESUME", lambda: len(self.retransmit))
+        instrument.gauge("pulse_sensor_ready", "1 once the sensor is open and sampling", lambda: self.sensor is not None)
+        instrument.gauge("pulse_samples_acquired", "Samples written to the ring buffer",
+                         lambda: self.sample_buffer.write_count if self.sample_buffer else 0)
+        instrument.gauge("pulse_samples_dropped", "Samples the sensor dropped because its FIFO overflowed",
+                         lambda: self.sample_buffer.overflow_count if self.sample_buffer else 0)
+        instrument.gauge("pulse_samples_pending", "Samples acquired but not yet processed by the DSP",
+                         lambda: self.sample_buffer.write_count - self.read_cursor if self.sample_buffer else 0)
+        instrument.gauge("pulse_handshake_transitions", "Handshake transitions by source and target state",
+                         lambda: self._transition_samples("count"))
+        instrument.gauge("pulse_handshake_transition_mean_ms", "Mean time spent in the source state before a transition",
+                         lambda: self._transition_samples("mean_ms"))
+
+    def _transition_samples(self, field):
+        return {(("transition", transition),): stats[field]
+                for transition, stats in self.handshake.transition_stats().items()}
+
+    def open_sensor(self, sensor_spec):
+        """Open the sensor and start sampling; runs on the sensor init thread."""
+        try:
+            import sensor_sim
+            from acquisition import AcquisitionThread, SampleRingBuffer
+            from streaming import StreamingMetricEngine
+            startup_timer.mark("sensor and DSP modules imported")
+            sensor = sensor_sim.create_sensor(sensor_spec, int_pin=SENSOR_INT_PIN)
+            startup_timer.mark("sensor opened")
+            # sample continuously so the FIFO never overflows while we filter or send
+            self.sample_buffer = SampleRingBuffer(int(RING_BUFFER_SECONDS * sensor.sample_rate))
+            self.metric_engine = StreamingMetricEngine(
+                fs=int(sensor.sample_rate),
+                window_seconds=METRIC_WINDOW_SECONDS,
+                hop_seconds=METRIC_HOP_SECONDS,
+            )
+            self.acquisition = AcquisitionThread(sensor, self.sample_buffer)
+            self.acquisition.start()
+            self.sensor = sensor
+            startup_timer.mark("acquisition started")
+        except Exception as e:
+            log.error("Failed to open the sensor: %s", e)
+            self.sensor_error = e
+        finally:
+            self.sensor_ready.set()
     def start_data_collection(self):
-        print("Starting data collection")
+        log.info("Starting data collection")
 
 
     def stop_data_collection(self):
-        print("Stopping data collection and transmission...")
-        self.transmit_data = False
+        log.info("Stopping data collection and transmission...")
+        self.handshake.reset()
+        self.raw_decimation = 0
         self.stop_event.set()  # Stop any active threads
         # Safely close the client socket if open
         if self.bluetooth_manager.client_socket:
             try:
                 self.bluetooth_manager.client_socket.close()
             except Exception as e:
-                print(f"Error closing client socket: {e}")
+                log.warning("Error closing client socket: %s", e)
         self.bluetooth_manager.client_socket = None
         self.bluetooth_manager.client_address = None
         # Reset stop event for future use
         self.stop_event.clear()
-        print("Server is ready to accept a new client connection.")
+        log.info("Server is ready to accept a new client connection.")
     
-    def wait_for_ack_ack(self, on_timeout=None):
-        """Wait for ACK_ACK in a non-blocking way."""
-        def wait():
-            start_time = time.time()
-            while time.time() - start_time < self.ack_timeout:
-                time.sleep(0.1)  # Simulate non-busy wait
-                with self.ack_lock:
-                    if not self.pending_ack_ack:
-                        print("ACK_ACK received. Exiting wait loop.")
-                        return
-            # Timeout logic
-            print("Timeout waiting for ACK_ACK.")
-            if on_timeout:
-                on_timeout()
-
-        # Start the wait in a separate thread
-        threading.Thread(target=wait, daemon=True).start()
-
-    def handle_start_sync_timeout(self):
-        print("Failed to receive ACK_ACK for START_SYNC. Handshake failed.")
-        self.pending_ack_ack = False
-        self.transmit_data = False
-
-    def handle_stop_sync_timeout(self):
-        print("Failed to receive ACK_ACK for STOP_SYNC. Handshake failed.")
-        self.pending_ack_ack = False
-        self.transmit_data = True  # If STOP_SYNC fails, assume data transmission continues
+    @property
+    def transmit_data(self):
+        """Whether pulse data goes out, i.e. the handshake reached STREAMING."""
+        return self.handshake.streaming
+
+    def on_handshake_transition(self, old, new, reason):
+        log.info("Handshake %s -> %s (%s)", old, new, reason)
+        if reason == "timeout":
+            if old == handshake.SYNC_PENDING:
+                log.warning("Failed to receive ACK_ACK for START_SYNC. Handshake failed.")
+            else:
+                # If STOP_SYNC fails, data transmission continues
+                log.warning("Failed to receive ACK_ACK for STOP_SYNC. Handshake failed.")
+        elif new == handshake.IDLE:
+            self.raw_decimation = 0
 
     def data_received_callback(self, data):
         data = data.strip()
-        print(f"Received data: {data}")
+        log.debug("Received data: %s", data)
+        COMMANDS_RECEIVED.inc()
+
+        command = data.split()[0] if data else ""
 
         if data == "START_SYNC":
-            print("Received START_SYNC command from client.")
-            self.bluetooth_manager.send_message("ACK")
-            self.pending_ack_ack = True
-            self.wait_for_ack_ack(on_timeout=self.handle_start_sync_timeout)
+            log.info("Received START_SYNC command from client.")
+            if self.handshake.request_start():
+                self.resume_after = None
+                # offer our wire formats, old clients only look for "ACK"
+                self.bluetooth_manager.send_message("ACK " + " ".join(wire.SUPPORTED_FORMATS))
+            else:
+                self.bluetooth_manager.send_message(f"NACK already {self.handshake.state}")
 
         elif data == "STOP_SYNC":
-            print("Received STOP_SYNC command from client.")
-            self.bluetooth_manager.send_message("ACK")
-            self.pending_ack_ack = True
-            self.wait_for_ack_ack(on_timeout=self.handle_stop_sync_timeout)
-
-        elif data == "ACK_ACK":
-            with self.ack_lock:
-                if self.pending_ack_ack:
-                    print("Received ACK_ACK from client.")
-                    self.pending_ack_ack = False
-                    # Check if we are handling START_SYNC or STOP_SYNC
-                    if self.transmit_data:  # If data is currently being transmitted
-                        print("Acknowledgment for STOP_SYNC received. Stopping data transmission.")
-                        self.transmit_data = False  # Stop the transmission
-                    else:  # Else, assume START_SYNC acknowledgment
-                        print("Acknowledgment for START_SYNC received. Starting data transmission.")
-                        self.transmit_data = True
-                        self.start_pulse_data_stream()
+            log.info("Received STOP_SYNC command from client.")
+            if self.handshake.request_stop():
+                self.bluetooth_manager.send_message("ACK")
+            else:
+                self.bluetooth_manager.send_message(f"NACK not streaming, {self.handshake.state}")
+
+        elif command == "RESUME":
+            # "RESUME <last seq>": a receiver back after a dropout, answered like START_SYNC;
+            # after its ACK_ACK the packets it missed are replayed from the retransmit buffer
+            args = data.split()[1:]
+            last_seq = int(args[0]) if args and args[0].isdigit() else None
+            if last_seq is None or last_seq > self.sequence:
+                # not a number we handed out, e.g. we restarted since; the receiver falls back to START_SYNC
+                self.bluetooth_manager.send_message(f"NACK unknown sequence number, last sent {self.sequence}")
+            elif self.handshake.request_start():
+                self.resume_after = last_seq
+                self.bluetooth_manager.send_message("ACK " + " ".join(wire.SUPPORTED_FORMATS))
+            else:
+                self.bluetooth_manager.send_message(f"NACK already {self.handshake.state}")
+
+        elif command == "RAW_SYNC":
+            # "RAW_SYNC on [decimation]" / "RAW_SYNC off", answered with ACK or NACK
+            args = data.split()[1:]
+            if args and args[0] == "off":
+                self.raw_decimation = 0
+                self.bluetooth_manager.send_message("ACK")
+            elif self.wire_format != wire.FORMAT_BINARY:
+                self.bluetooth_manager.send_message("NACK raw streaming needs the binary wire format")
+            elif self.sensor is None:
+                self.bluetooth_manager.send_message("NACK the sensor is not ready")
+            else:
+                try:
+                    decimation = max(1, min(255, int(args[1]))) if len(args) > 1 else 1
+                except ValueError:
+                    decimation = 1
+                self.raw_decimation = decimation
+                log.info("Raw waveform streaming on, every %d sample(s).", decimation)
+                self.bluetooth_manager.send_message(f"ACK {self.sensor.sample_rate / decimation}")
+
+        elif command == "PROFILE":
+            # "PROFILE on [rate] [seconds]" / "PROFILE off" / "PROFILE": sample the transmitter's
+            # thread stacks (see Common/profiler.py); "off" answers with the .folded file written
+            args = data.split()[1:]
+            if args and args[0] == "on":
+                try:
+                    rate = float(args[1]) if len(args) > 1 else profiler.DEFAULT_RATE
+                    duration = float(args[2]) if len(args) > 2 else profiler.DEFAULT_DURATION
+                    started = self.start_profiler(rate, duration)
+                except ValueError as e:
+                    self.bluetooth_manager.send_message(f"NACK {e}")
+                else:
+                    self.bluetooth_manager.send_message("ACK" if started else "NACK already profiling")
+            elif args and args[0] == "off":
+                if self.stop_profiler():
+                    self.bluetooth_manager.send_message(f"ACK {profiler.PROFILER.output}")
+                else:
+                    self.bluetooth_manager.send_message(f"NACK not profiling, last profile {profiler.PROFILER.output}")
+            else:
+                self.bluetooth_manager.send_message("ACK " + json.dumps(profiler.PROFILER.status()))
+
+        elif command == "ACK_ACK":
+            if self.handshake.state == handshake.SYNC_PENDING:
+                # "ACK_ACK bin1" picks a format, a bare ACK_ACK is an old client;
+                # set before STREAMING so the first packet already uses it
+                requested = data.split()[1:]
+                self.wire_format = requested[0] if requested and requested[0] in wire.SUPPORTED_FORMATS else wire.FORMAT_JSON
+            new_state = self.handshake.acknowledge()
+            if new_state == handshake.STREAMING:
+                log.info("Acknowledgment for START_SYNC received. Starting data transmission in %s.", self.wire_format)
+                self.start_pulse_data_stream()
+            elif new_state == handshake.IDLE:
+                log.info("Acknowledgment for STOP_SYNC received. Stopping data transmission.")
+            else:
+                log.warning("ACK_ACK without a pending handshake, ignored.")
+
+    def start_profiler(self, rate=profiler.DEFAULT_RATE, duration=profiler.DEFAULT_DURATION):
+        """Start sampling stacks; returns False when already running. Raises ValueError for a bad rate or duration."""
+        started = profiler.PROFILER.start(rate, duration, profiler.default_directory())
+        if started:
+            log.info("Profiling at %g samples/s for at most %g s", rate, duration)
+        return started
+
+    def stop_profiler(self):
+        """Stop sampling; returns False when it was not running."""
+        if not profiler.PROFILER.stop():
+            return False
+        log.info("Profile written to %s", profiler.PROFILER.output)
+        return True
+
+    def toggle_profiler(self, signum=None, frame=None):
+        """SIGUSR1 handler: start profiling at PULSE_PROFILE_RATE samples/s, or stop and write the profile."""
+        def toggle():
+            if self.stop_profiler():
+                return
+            try:
+                self.start_profiler(float(os.environ.get("PULSE_PROFILE_RATE", profiler.DEFAULT_RATE)))
+            except ValueError as e:
+                log.error("Cannot start the profiler: %s", e)
+        # not in the handler itself, it interrupts the main thread wherever it is, logging included
+        threading.Thread(target=toggle, name="profiler-toggle", daemon=True).start()
 
     def start_pulse_data_stream(self):
         """Start a thread to continuously stream pulse data."""
@@ -202,50 +426,101 @@ class BluetoothPulseServer:
 
     def stream_pulse_data(self):
         """Stream pulse data continuously."""
+        self.sensor_ready.wait()
+        if self.sensor is None:
+            log.error("No sensor, no pulse data to stream: %s", self.sensor_error)
+            return
         while 1:
 
                 try:
                     pulse_data = self.read_sensor()
-                    pulse_data_json = json.dumps(pulse_data)
-                    if pulse_data_json and self.transmit_data:
-                        print(f"Sending pulse data: {pulse_data_json}")
-                        self.bluetooth_manager.send_message(pulse_data_json)
+                    if pulse_data is not None:
+                        if not self.first_packet.is_set():
+                            startup_timer.mark("first pulse packet")
+                            self.first_packet.set()
+                        # numbered and kept whether or not anyone listens, a receiver may RESUME
+                        self.sequence += 1
+                        pulse_data["seq"] = self.sequence
+                        self.retransmit.append(pulse_data)
+                    if self.transmit_data and self.resume_after is not None:
+                        self.replay_missed()
+                    if pulse_data is not None and self.transmit_data:
+                        log.debug("Sending pulse data: %s", pulse_data)
+                        self.bluetooth_manager.send_message(self.encode_pulse(pulse_data))
+                        PACKETS_SENT.inc()
+                    if self.raw_decimation and self.transmit_data and self.last_window is not None:
+                        self.bluetooth_manager.send_message(self.encode_raw())
+                        RAW_FRAMES_SENT.inc()
                     time.sleep(0.0010)
-                except bluetooth.BluetoothError as e:
-                    print(f"Bluetooth error during data transmission: {e}")
+                except OSError as e:
+                    log.warning("Connection error during data transmission: %s", e)
                     self.stop_data_collection()
                     break
-                except Exception as e:
-                    print(f"Unexpected error in data streaming: {e}")
+                except Exception:
+                    log.exception("Unexpected error in data streaming")
                     self.stop_data_collection()
                     break
+    def replay_missed(self):
+        """After a RESUME, send the buffered packets the receiver has not seen, oldest first."""
+        after, self.resume_after = self.resume_after, None
+        missed = [pulse_data for pulse_data in self.retransmit if pulse_data["seq"] > after]
+        lost = missed[0]["seq"] - after - 1 if missed else self.sequence - after
+        log.info("Resuming after packet %d: replaying %d, %d no longer buffered", after, len(missed), lost)
+        for pulse_data in missed:
+            self.bluetooth_manager.send_message(self.encode_pulse(pulse_data))
+        PACKETS_SENT.inc(len(missed))
+        PACKETS_REPLAYED.inc(len(missed))
+
+    def encode_pulse(self, pulse_data):
+        """Serialize pulse data in the wire format negotiated at START_SYNC."""
+        started = time.perf_counter()
+        if self.wire_format == wire.FORMAT_BINARY:
+            encoded = wire.encode_pulse(pulse_data, pulse_data["seq"], pulse_data["timestamp"])
+        else:
+            encoded = json.dumps(pulse_data)
+        ENCODE_SECONDS.observe(time.perf_counter() - started)
+        return encoded
+
+    def encode_raw(self):
+        """Frame the raw samples of the last hop, keeping every `raw_decimation`th one."""
+        red, ir, timestamps, first_index = self.last_window
+        decimation = self.raw_decimation
+        # decimate on absolute sample indices so consecutive chunks line up
+        offset = (-first_index) % decimation
+        self.raw_sequence += 1
+        started = time.perf_counter()
+        encoded = wire.encode_raw(
+            red[offset::decimation], ir[offset::decimation],
+            first_index + offset, decimation, self.sensor.sample_rate / decimation,
+            self.raw_sequence, float(timestamps[-1]),
+        )
+        ENCODE_SECONDS.observe(time.perf_counter() - started)
+        return encoded
+
     def highpass_filter(self, data, cutoff, fs, order=5):
         """Apply a high-pass filter to remove the baseline drift."""
-        nyquist = 0.5 * fs
-        normal_cutoff = cutoff / nyquist
-        b, a = butter(order, normal_cutoff, btype='high', analog=False)
-        filtered_data = filtfilt(b, a, data)
-        return filtered_data
+        from filters import filter_bank
+        return filter_bank.apply(data, 'high', cutoff, fs, order)
 
     def lowpass_filter(self, data, cutoff, fs, order=5):
         """Apply a low-pass filter to remove high-frequency noise."""
-        nyquist = 0.5 * fs
-        normal_cutoff = cutoff / nyquist
-        b, a = butter(order, normal_cutoff, btype='low', analog=False)
-        filtered_data = filtfilt(b, a, data)
-        return filtered_data
+        from filters import filter_bank
+        return filter_bank.apply(data, 'low', cutoff, fs, order)
 
     def moving_average(self, data, window_size=5):
         """Apply a moving average filter for smoothing."""
         return np.convolve(data, np.ones(window_size) / window_size, mode='same')
 
-    def preprocess_signal(self, ir_data, fs=100):
+    def preprocess_signal(self, ir_data, fs=100, causal=False):
         """
         Preprocess the raw MAX30102 data by filtering and smoothing.
         
         Args:
             ir_data (array): Infrared data from MAX30102.
             fs (int): Sampling frequency in Hz.
+            causal (bool): Filter with sosfilt, carrying the filter state
+                over from the previous call, instead of zero-phase filtfilt
+                on this window alone.
             
         Returns:
             array: Processed infrared data.
@@ -254,11 +529,18 @@ class BluetoothPulseServer:
         high_cutoff = 0.5  # High-pass filter cutoff in Hz
         low_cutoff = 3.0   # Low-pass filter cutoff in Hz
 
-        # High-pass filter (remove baseline drift)
-        ir_filtered = self.highpass_filter(ir_data, high_cutoff, fs)
+        if causal:
+            # one band-pass cascade per sample rate, state kept across windows
+            if fs not in self.stream_filters:
+                from filters import filter_bank
+                self.stream_filters[fs] = filter_bank.stream(filter_bank.bandpass_sos(high_cutoff, low_cutoff, fs))
+            ir_filtered = self.stream_filters[fs].process(ir_data)
+        else:
+            # High-pass filter (remove baseline drift)
+            ir_filtered = self.highpass_filter(ir_data, high_cutoff, fs)
 
-        # Low-pass filter (remove noise)
-        ir_filtered = self.lowpass_filter(ir_filtered, low_cutoff, fs)
+            # Low-pass filter (remove noise)
+            ir_filtered = self.lowpass_filter(ir_filtered, low_cutoff, fs)
 
         # Smoothing
         ir_smoothed = self.moving_average(ir_filtered)
@@ -289,6 +571,7 @@ class BluetoothPulseServer:
         Returns:
             tuple: Peaks, BPM, and IPM.
         """
+        from scipy.signal import find_peaks
         peaks, _ = find_peaks(signal, distance=fs//2)  # Assuming at least 0.5 seconds between peaks
         if len(peaks) > 1:
             rr_intervals = np.diff(peaks) * (1000 / fs)  # RR intervals in ms
@@ -301,49 +584,74 @@ class BluetoothPulseServer:
             rmssd = 0
         return peaks, bpm, ipm, rmssd       
             
-    def read_sensor(self):
-        fs = 25
-        for w in range(WINDOW_SIZE):
-            # Read data from the sensor
-            print("Read data from the sensor")
-            red, raw_ir = m.read_sequential(100)
-
-            # Calculate heart rate and SpO2
-            processed_ir = self.preprocess_signal(raw_ir, fs)
-
-            # Detect peaks and calculate metrics
-            peaks, bpm, ipm, rmssd = self.detect_peaks(processed_ir, fs)
+    def next_window(self, amount):
+        """
+        Wait for the next `amount` samples from the acquisition thread and
+        return views of red, ir and timestamps. Skips ahead if we fell behind
+        by more than the ring buffer holds.
+        """
+        buffer = self.sample_buffer
+        if not buffer.is_valid(self.read_cursor):
+            log.warning("DSP fell behind, skipping %d samples", buffer.write_count - buffer.capacity - self.read_cursor)
+            self.read_cursor = buffer.write_count - buffer.capacity
+            self.metric_engine.reset()
+        end = self.read_cursor + amount
+        buffer.wait(end)
+        self.read_cursor = end
+        return buffer.window(end, amount)
 
-            hrstd_queue.append(bpm)
+    def read_sensor(self):
+        """
+        Feed the next hop of samples to the streaming metric engine and
+        return the metrics over the current window.
+        """
+        # Read data from the sensor
+        started = time.perf_counter()
+        red, raw_ir, timestamps = self.next_window(self.metric_engine.hop_samples)
+        window_ready = time.perf_counter()
+        WINDOW_WAIT_SECONDS.observe(window_ready - started)
+        self.last_window = (red, raw_ir, timestamps, self.read_cursor - len(raw_ir))
+        metrics = self.metric_engine.update(raw_ir)
+        METRICS_UPDATE_SECONDS.observe(time.perf_counter() - window_ready)
+        if metrics is None:
+            return None
+
+        pulse_data_json = {
+            "pulse": round(random.randint(60, 100), 2), # not in uses and not display
+            "impulses_per_minute": metrics["ipm"],
+            "beats_per_minute": metrics["bpm"],  # this will display in chart
+            "root_mean_square": metrics["rmssd"],
+            "hrstd": metrics["hrstd"],
+            "timestamp": float(timestamps[-1]),  # time of the newest sample
+        }
+        return pulse_data_json
 
-            if len(hrstd_queue) > 2 :
-                hrstd = np.std(hrstd_queue)
-            else:
-                hrstd = None
-            if len(hrstd_queue) > WINDOW_SIZE:
-                hrstd_queue.popleft()
-            
 
-                pulse_data_json = {
-                    "pulse": round(random.randint(60, 100), 2), # not in uses and not display
-                    "impulses_per_minute": ipm,  
-                    "beats_per_minute": bpm,  # this will display in chart
-                    "root_mean_square": rmssd,  # Random RMS value //To Do: Aneri
-                    "hrstd": hrstd  # Random heart rate standard deviation
-                                }
-                # print(f"Collected Data: {pulse_data_json}")
-                return pulse_data_json
-            else:
-                print(f"hr_valid and and spo2_valid are invalid")
-                return None
-            
-    
 if __name__ == "__main__":
-    pulse_server = BluetoothPulseServer()
+    logs.setup()
+    metrics_address = os.environ.get("PULSE_METRICS_ADDR", DEFAULT_METRICS_ADDRESS)
+    if metrics_address and "--startup-timing" not in sys.argv[1:]:
+        host, _, port = metrics_address.rpartition(":")
+        instrument.serve(host, int(port))
+        log.info("Metrics at http://%s/metrics", metrics_address)
+    # e.g. PULSE_LISTEN=tcp:0.0.0.0:5555 to serve over the network instead of RFCOMM
+    pulse_server = BluetoothPulseServer(os.environ.get("PULSE_LISTEN", transport.DEFAULT_LISTEN_ADDRESS))
+    # kill -USR1 <pid> starts the sampling profiler, a second one writes the profile
+    signal.signal(signal.SIGUSR1, pulse_server.toggle_profiler)
+    if "--startup-timing" in sys.argv[1:]:
+        # start up as usual, report how long each phase took up to the first pulse packet, exit
+        threading.Thread(target=pulse_server.stream_pulse_data, daemon=True).start()
+        pulse_server.sensor_ready.wait()
+        if pulse_server.sensor is not None:
+            pulse_server.sample_buffer.wait(1)
+            startup_timer.mark("first sample")
+            pulse_server.first_packet.wait(METRIC_WINDOW_SECONDS * 4)
+        print(startup_timer.report())
+        sys.exit(0 if pulse_server.first_packet.is_set() else 1)
     pulse_server.stream_pulse_data()
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("Stopping server...")
+        log.info("Stopping server...")
     
\ No newline at end of file
@@ -0,0 +1,36 @@
+# -*-coding:utf-8
+
+# Per-phase startup timing of the transmitter, printed by
+# `python server.py --startup-timing`.
+
+import threading
+import time
+
+
+class StartupTimer:
+    """
+    Time since the timer was made (the top of server.py) at each named
+    phase. Phases may be marked from any thread; each is kept the first
+    time it is marked.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}  # phase -> seconds since start
+        self.lock = threading.Lock()
+
+    def mark(self, phase):
+        elapsed = time.perf_counter() - self.start
+        with self.lock:
+            self.phases.setdefault(phase, elapsed)
+
+    def report(self):
+        """One line per phase in the order reached: time since start and since the previous phase."""
+        with self.lock:
+            phases = sorted(self.phases.items(), key=lambda item: item[1])
+        lines = [f"{'phase':<32}{'at ms':>10}{'+ms':>10}"]
+        previous = 0.0
+        for phase, elapsed in phases:
+            lines.append(f"{phase:<32}{elapsed * 1e3:>10.1f}{(elapsed - previous) * 1e3:>10.1f}")
+            previous = elapsed
+        return "\n".join(lines)
@@ -0,0 +1,128 @@
+# -*-coding:utf-8
+
+import time
+from collections import deque
+
+import numpy as np
+from scipy.signal import find_peaks
+
+import instrument
+from filters import filter_bank
+
+FILTER_SECONDS = instrument.timer("pulse_filter_seconds", "Band-pass filtering and smoothing one hop")
+PEAKS_SECONDS = instrument.timer("pulse_peak_detection_seconds", "Peak detection on one hop")
+
+# hrstd is the std of the bpm of this many windows, the last one included, as
+# in the batch version (its 10 queued windows plus the current one)
+HRSTD_WINDOWS = 11
+
+
+class StreamingMetricEngine:
+    """
+    Incremental version of preprocess_signal + detect_peaks.
+
+    Samples are pushed one hop at a time. Filter state and the beats found
+    so far are kept between hops, so each update only filters and searches
+    the new samples, while the metrics are still reported over the last
+    `window_seconds` of signal. hrstd is the spread of the bpm reported for
+    the last HRSTD_WINDOWS windows.
+    """
+
+    def __init__(self, fs=25, window_seconds=8, hop_seconds=1,
+                 high_cutoff=0.5, low_cutoff=3.0, order=5, smoothing=5, hrstd_windows=HRSTD_WINDOWS):
+        self.fs = fs
+        self.window_samples = int(window_seconds * fs)
+        self.hop_samples = max(1, int(hop_seconds * fs))
+        self.peak_distance = fs // 2  # at least 0.5 seconds between peaks
+        self.filter = filter_bank.stream(filter_bank.bandpass_sos(high_cutoff, low_cutoff, fs, order))
+        self.smoothing = smoothing
+        # bpm of the last windows for hrstd; past readings, so reset() keeps them
+        self.bpm_history = deque(maxlen=hrstd_windows)
+        self.reset()
+
+    def reset(self):
+        """Forget all filter state and beats, e.g. after dropped samples."""
+        self.filter.reset()
+        self.sample_count = 0
+        # trailing samples kept for the causal moving average and the peak search
+        self.ma_tail = np.zeros(self.smoothing - 1)
+        self.peak_tail = np.empty(0)
+        self.beats = deque()  # absolute sample index of every beat in the window
+
+    def preprocess(self, ir_chunk):
+        """
+        Causal counterpart of preprocess_signal: band-pass with carried
+        filter state, then a trailing moving average.
+        """
+        y = self.filter.process(ir_chunk)
+        padded = np.concatenate((self.ma_tail, y))
+        cumsum = np.cumsum(np.concatenate(([0.0], padded)))
+        smoothed = (cumsum[self.smoothing:] - cumsum[:-self.smoothing]) / self.smoothing
+        self.ma_tail = padded[len(padded) - (self.smoothing - 1):]
+        return smoothed
+
+    def detect_peaks(self, smoothed):
+        """
+        Find beats in the new samples. The previous hop's last samples are
+        searched again so peaks on a hop boundary are not missed.
+        """
+        first = self.sample_count - len(self.peak_tail)
+        segment = np.concatenate((self.peak_tail, smoothed))
+        peaks, _ = find_peaks(segment, distance=self.peak_distance)
+        for p in peaks:
+            index = first + p
+            # the tail's last sample had no right neighbour before, anything earlier was final
+            if index < self.sample_count - 1:
+                continue
+            if self.beats and index - self.beats[-1] < self.peak_distance:
+                # too close to the previous beat, keep the larger of the two
+                previous = self.beats[-1] - first
+                if previous >= 0 and segment[p] > segment[previous]:
+                    self.beats[-1] = index
+                continue
+            self.beats.append(index)
+        self.sample_count += len(smoothed)
+        self.peak_tail = segment[-(self.peak_distance + 1):]
+        while self.beats and self.beats[0] < self.sample_count - self.window_samples:
+            self.beats.popleft()
+
+    def update(self, ir_chunk):
+        """
+        Push one hop of raw ir samples and return the metrics over the
+        current window.
+
+        Returns:
+            dict: bpm, ipm, rmssd and hrstd (rmssd is None until enough
+            beats are seen, hrstd until 3 windows were reported).
+        """
+        if len(ir_chunk) == 0:
+            return None
+        started = time.perf_counter()
+        smoothed = self.preprocess(ir_chunk)
+        filtered = time.perf_counter()
+        self.detect_peaks(smoothed)
+        FILTER_SECONDS.observe(filtered - started)
+        PEAKS_SECONDS.observe(time.perf_counter() - filtered)
+
+        beats = np.fromiter(self.beats, dtype=np.float64)
+        window_seconds = min(self.sample_count, self.window_samples) / self.fs
+        if len(beats) > 1:
+            rr_intervals = np.diff(beats) * (1000 / self.fs)  # RR intervals in ms
+            bpm = float(60000 / np.mean(rr_intervals))
+            ipm = (len(beats) / window_seconds) * 60
+            rmssd = calculate_rmssd(rr_intervals)
+        else:
+            bpm = 0
+            ipm = 0
+            rmssd = 0
+        self.bpm_history.append(bpm)
+        hrstd = float(np.std(self.bpm_history)) if len(self.bpm_history) > 2 else None
+        return {"bpm": bpm, "ipm": ipm, "rmssd": rmssd, "hrstd": hrstd}
+
+
+def calculate_rmssd(rr_intervals):
+    """Root Mean Square of the Successive Differences of `rr_intervals`."""
+    if len(rr_intervals) < 2:
+        return None
+    successive_diffs = np.diff(rr_intervals)
+    return float(np.sqrt(np.mean(successive_diffs ** 2)))
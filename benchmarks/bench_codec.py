@@ -0,0 +1,104 @@
+"""
+Round-trip check and throughput of the delta + zigzag varint sample codec,
+with the size of the same samples as JSON, int32 and fixed int16 deltas.
+
+    python benchmarks/bench_codec.py
+    python benchmarks/bench_codec.py --block 250 --noise 50
+    python benchmarks/bench_codec.py --json results.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from fakes import add_common_to_path
+from harness import add_json_argument, write_json
+
+add_common_to_path()
+import codec  # noqa: E402
+import wire  # noqa: E402
+
+
+def synthetic_ppg(n, fs=25.0, noise=20, seed=0):
+    """18-bit red/ir-like samples: baseline, 72 bpm pulse, slow drift and noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / fs
+    pulse = 3000 * np.sin(2 * np.pi * 1.2 * t) + 600 * np.sin(2 * np.pi * 2.4 * t)
+    drift = 1500 * np.sin(2 * np.pi * 0.05 * t)
+    samples = 120000 + pulse + drift + rng.normal(0, noise, n)
+    return samples.astype(np.int64) & 0x03FFFF
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def bench(block=25, blocks=2000, noise=20, repeat=5):
+    samples = synthetic_ppg(block * blocks, noise=noise)
+    chunks = samples.reshape(blocks, block)
+
+    # round trip, including a sample-aligned frame through the wire format
+    for chunk in chunks:
+        decoded, _ = codec.decode_block(codec.encode_block(chunk), len(chunk))
+        assert np.array_equal(decoded, chunk), "codec round trip failed"
+    frame = wire.encode_raw(chunks[0], chunks[1], 0, 1, 25.0, 0, 0.0)
+    _, seq, timestamp, payload_start, frame_end = wire.decode_header(frame)
+    raw = wire.decode_raw(frame, payload_start, frame_end, seq, timestamp)
+    assert np.array_equal(raw["red"], chunks[0]) and np.array_equal(raw["ir"], chunks[1])
+
+    n = samples.size
+    sizes = {
+        "json": len(json.dumps(samples.tolist())),
+        "int32": 4 * n,
+        "delta16": blocks * (4 + 2 * (block - 1)),
+        "varint": sum(len(codec.encode_block(chunk)) for chunk in chunks),
+    }
+    encode_s, encoded = timed(lambda: [codec.encode_block(chunk) for chunk in chunks], repeat)
+    decode_s, _ = timed(lambda: [codec.decode_block(e, block) for e in encoded], repeat)
+    whole_encode_s, whole = timed(lambda: codec.encode_block(samples), repeat)
+    whole_decode_s, _ = timed(lambda: codec.decode_block(whole, n), repeat)
+    return {
+        "block": block,
+        "bytes_per_sample": {name: size / n for name, size in sizes.items()},
+        "block_encode_us": encode_s / blocks * 1e6,
+        "block_decode_us": decode_s / blocks * 1e6,
+        "encode_msamples_per_s": n / whole_encode_s / 1e6,
+        "decode_msamples_per_s": n / whole_decode_s / 1e6,
+        # 2 channels at 25 Hz, before framing overhead
+        "bytes_per_s_per_sensor": 2 * 25 * sizes["varint"] / n,
+    }
+
+
+def run(quick=False):
+    return bench(blocks=200 if quick else 2000, repeat=2 if quick else 5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--block", type=int, default=25, help="samples per channel per chunk")
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--noise", type=float, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    add_json_argument(parser)
+    args = parser.parse_args()
+
+    r = bench(args.block, 200 if args.quick else args.blocks, args.noise, args.repeat)
+    print("round trip ok")
+    sizes = r["bytes_per_sample"]
+    for name, size in sizes.items():
+        print(f"{name:>8}: {size:5.2f} bytes/sample, {size / sizes['varint']:5.2f}x varint")
+    print(f"per {args.block}-sample block: encode {r['block_encode_us']:6.1f} us, "
+          f"decode {r['block_decode_us']:6.1f} us")
+    print(f"one large block: encode {r['encode_msamples_per_s']:6.1f} Msamples/s, "
+          f"decode {r['decode_msamples_per_s']:6.1f} Msamples/s")
+    print(f"{r['bytes_per_s_per_sensor']:.0f} bytes/s per sensor (2 channels at 25 Hz) before framing overhead")
+    if args.json:
+        write_json(args.json, r, "codec")
+
+
+if __name__ == "__main__":
+    main()
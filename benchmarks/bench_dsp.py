@@ -0,0 +1,74 @@
+"""
+Per-window cost of the transmitter's signal processing: preprocess_signal
+(zero-phase and causal), detect_peaks, hrcalc.calc_hr_and_spo2, the
+streaming metric engine and the batched hrcalc, on synthetic PPG.
+
+    python benchmarks/bench_dsp.py
+    python benchmarks/bench_dsp.py --json results.json
+"""
+import argparse
+import contextlib
+import io
+
+from fakes import import_server
+from harness import add_json_argument, measure, print_results, write_json
+
+with contextlib.redirect_stdout(io.StringIO()):
+    server = import_server()
+import batch  # noqa: E402
+import hrcalc  # noqa: E402
+import sensor_sim  # noqa: E402
+from streaming import StreamingMetricEngine  # noqa: E402
+
+FS = 25
+WINDOW = server.METRIC_WINDOW_SECONDS * FS
+HOP = server.METRIC_HOP_SECONDS * FS
+
+
+def run(quick=False):
+    repeat = 50 if quick else 500
+    red, ir = sensor_sim.SyntheticPPG(seed=0, sample_rate=FS).read(WINDOW * 64)
+    window = ir[:WINDOW].astype(float)
+
+    # the DSP methods only need the filter state, not a listening server
+    dsp = server.BluetoothPulseServer.__new__(server.BluetoothPulseServer)
+    dsp.stream_filters = {}
+    smoothed = dsp.preprocess_signal(window, fs=FS)
+
+    engine = StreamingMetricEngine(fs=FS, window_seconds=server.METRIC_WINDOW_SECONDS,
+                                   hop_seconds=server.METRIC_HOP_SECONDS)
+    hops = iter(range(0, len(ir) - HOP, HOP))
+
+    def engine_update():
+        start = next(hops, None)
+        if start is None:
+            return
+        engine.update(ir[start:start + HOP])
+
+    ir_windows = ir[:64 * 100].reshape(64, 100)
+    red_windows = red[:64 * 100].reshape(64, 100)
+    batch_result = measure(lambda: batch.calc_hr_and_spo2_batch(ir_windows, red_windows), max(repeat // 20, 3))
+    batch_per_window = {key: (value / 64 if key.endswith("_us") else value) for key, value in batch_result.items()}
+    return {
+        "window_samples": WINDOW,
+        "preprocess_filtfilt": measure(lambda: dsp.preprocess_signal(window, fs=FS), repeat),
+        "preprocess_causal_hop": measure(lambda: dsp.preprocess_signal(window[:HOP], fs=FS, causal=True), repeat),
+        "detect_peaks": measure(lambda: dsp.detect_peaks(smoothed, FS), repeat),
+        "hrcalc_100_samples": measure(lambda: hrcalc.calc_hr_and_spo2(ir[:100], red[:100]), repeat),
+        "hrcalc_batch_per_window": batch_per_window,
+        "streaming_engine_hop": measure(engine_update, min(repeat, len(ir) // HOP - 10), warmup=0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_json_argument(parser)
+    args = parser.parse_args()
+    results = run(args.quick)
+    print_results(results)
+    if args.json:
+        write_json(args.json, results, "dsp")
+
+
+if __name__ == "__main__":
+    main()
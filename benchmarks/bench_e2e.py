@@ -0,0 +1,146 @@
+"""
+End-to-end latency from sample acquisition to the browser-facing /stream
+endpoint, with the real server, client and Flask app in one process.
+
+The server reads the simulated sensor and listens on a loopback transport,
+the client connects and runs the START_SYNC handshake, and the Flask app
+is served over HTTP on localhost. A listener on /stream then records, for
+every pulse event, how long ago its newest sample was acquired (the
+packet's timestamp is stamped by the acquisition thread). The metrics
+window hop (1 s of samples) is part of that latency by design; use
+--speed to run the sensor faster than real time and collect more packets.
+
+    python benchmarks/bench_e2e.py
+    python benchmarks/bench_e2e.py --transport tcp --duration 60 --json e2e.json
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import os
+import threading
+import time
+
+from fakes import add_client_to_path, import_server
+from harness import add_json_argument, print_results, summarize, write_json
+
+ADDRESSES = {
+    "inproc": "inproc:bench-e2e",
+    "unix": "unix:/tmp/pulse-bench-e2e.sock",
+    "tcp": "tcp:127.0.0.1:0",  # the port is filled in once the server listens
+}
+
+
+def sse_events(response):
+    """(event, data) pairs from a text/event-stream response."""
+    event, data = None, []
+    while True:
+        line = response.readline()
+        if not line:
+            return
+        line = line.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = None, []
+        elif line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+
+
+def start_server(transport_name, speed):
+    os.environ["PULSE_SENSOR"] = f"sim:seed=0,speed={speed}"
+    server = import_server()
+    address = ADDRESSES[transport_name]
+    pulse_server = server.BluetoothPulseServer(address)
+    if transport_name == "tcp":
+        port = pulse_server.bluetooth_manager.server_socket.getsockname()[1]
+        address = f"tcp:127.0.0.1:{port}"
+    threading.Thread(target=pulse_server.stream_pulse_data, daemon=True).start()
+    return pulse_server, address
+
+
+def start_client(address):
+    add_client_to_path()
+    os.environ["PULSE_SERVER"] = address
+    import client
+    from werkzeug.serving import make_server
+    http_server = make_server("127.0.0.1", 0, client.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return client, http_server
+
+
+def bench(transport_name="inproc", speed=4.0, duration=20.0):
+    # server and client print every packet; keep that cost but not the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        pulse_server, address = start_server(transport_name, speed)
+        client, http_server = start_client(address)
+        bluetooth_client = client.bluetooth_client
+
+        connection = http.client.HTTPConnection("127.0.0.1", http_server.server_port, timeout=30)
+        connection.request("GET", "/stream")
+        response = connection.getresponse()
+
+        client.device_manager.call(bluetooth_client.device_id, "connect")
+        client.device_manager.call(bluetooth_client.device_id, "start")
+
+        latencies = []
+        sequences = []
+        started = time.monotonic()
+        deadline = started + duration
+        for event, data in sse_events(response):
+            if event != "pulse":
+                continue
+            received = time.time()
+            pulse_data = json.loads(data)
+            if pulse_data.get("timestamp") is None:
+                continue
+            latencies.append(received - pulse_data["timestamp"])
+            sequences.append(pulse_data.get("seq"))
+            if time.monotonic() >= deadline:
+                break
+        elapsed = time.monotonic() - started
+
+        client.device_manager.call(bluetooth_client.device_id, "stop")
+        client.device_manager.call(bluetooth_client.device_id, "disconnect")
+        connection.close()
+        http_server.shutdown()
+        pulse_server.acquisition.stop()
+
+    # the first packet waits for a full metrics window, count throughput after it
+    gaps = [s for s in sequences if s is not None]
+    missing = (gaps[-1] - gaps[0] + 1 - len(gaps)) if len(gaps) > 1 else 0
+    return {
+        "transport": transport_name,
+        "speed": speed,
+        "packets": len(latencies),
+        "packets_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "missing_sequence_numbers": missing,
+        "latency": summarize(latencies, unit="ms"),
+    }
+
+
+def run(quick=False):
+    return bench("inproc", speed=8.0 if quick else 4.0, duration=8.0 if quick else 20.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--transport", choices=sorted(ADDRESSES), default="inproc")
+    parser.add_argument("--speed", type=float, default=4.0,
+                        help="simulated sensor speed, times real time")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of packets to collect")
+    add_json_argument(parser)
+    args = parser.parse_args()
+    if args.quick:
+        args.speed, args.duration = 8.0, 8.0
+    results = bench(args.transport, args.speed, args.duration)
+    print_results(results)
+    if args.json:
+        write_json(args.json, results, "e2e")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Response time of the receiver's Flask endpoints, through Flask's test
+client (no network): /get_pulse_data, /history and /get_raw_data, with an
+hour of history and a full waveform buffer.
+
+    python benchmarks/bench_flask.py
+    python benchmarks/bench_flask.py --json results.json
+"""
+import argparse
+import contextlib
+import io
+
+import numpy as np
+
+from fakes import add_client_to_path, add_common_to_path
+from harness import add_json_argument, measure, print_results, write_json
+
+add_common_to_path()
+add_client_to_path()
+with contextlib.redirect_stdout(io.StringIO()):
+    import client  # noqa: E402
+
+HISTORY_SECONDS = 3600
+
+
+def fill(bluetooth_client, now=1760000000.0):
+    """An hour of packets at 1 Hz and a full waveform buffer, without the per-packet prints."""
+    rng = np.random.default_rng(0)
+    for i in range(HISTORY_SECONDS):
+        pulse_data = {
+            "beats_per_minute": float(70 + rng.normal(0, 3)),
+            "impulses_per_minute": float(68 + rng.normal(0, 3)),
+            "root_mean_square": float(40 + rng.normal(0, 5)),
+            "hrstd": float(abs(rng.normal(2, 1))),
+            "seq": i,
+            "timestamp": now - HISTORY_SECONDS + i,
+        }
+        bluetooth_client.history.append(pulse_data)
+    bluetooth_client.pulse_data = pulse_data
+    capacity = bluetooth_client.waveform.capacity
+    for first in range(0, capacity, 25):
+        samples = (100000 + rng.integers(-50, 50, 25)).astype(np.int32)
+        bluetooth_client.waveform.append({
+            "first_index": first, "decimation": 1, "fs": 25.0,
+            "red": samples, "ir": samples + 20000, "timestamp": now,
+        })
+    return now
+
+
+def run(quick=False):
+    repeat = 50 if quick else 500
+    now = fill(client.bluetooth_client)
+    app = client.app.test_client()
+
+    def get(url):
+        def call():
+            response = app.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+        return call
+
+    return {
+        "get_pulse_data": measure(get("/get_pulse_data"), repeat),
+        "history_last_minute": measure(get(f"/history?since={now - 60}"), repeat),
+        "history_hour_by_minute": measure(get(f"/history?since={now - 3600}&step=60"), repeat),
+        "get_raw_data_250": measure(get("/get_raw_data?limit=250"), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_json_argument(parser)
+    args = parser.parse_args()
+    results = run(args.quick)
+    print_results(results)
+    if args.json:
+        write_json(args.json, results, "flask")
+
+
+if __name__ == "__main__":
+    main()
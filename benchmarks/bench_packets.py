@@ -0,0 +1,88 @@
+"""
+Encode and decode cost and size of pulse data packets in both wire
+formats, and the frame reader's parse rate for a stream of them.
+
+    python benchmarks/bench_packets.py
+    python benchmarks/bench_packets.py --json results.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from fakes import add_common_to_path
+from harness import add_json_argument, measure, print_results, write_json
+
+add_common_to_path()
+import framing  # noqa: E402
+import wire  # noqa: E402
+
+PULSE = {
+    "pulse": 72,
+    "impulses_per_minute": 67.5,
+    "beats_per_minute": 71.9,
+    "root_mean_square": 41.3,
+    "hrstd": 2.4,
+    "timestamp": 1760000000.123,
+}
+
+
+def decode_all(data):
+    reader = framing.FrameReader()
+    reader.feed(data)
+    return reader.frames()
+
+
+def run(quick=False):
+    repeat = 200 if quick else 2000
+    packets = 200 if quick else 2000
+    json_text = json.dumps(PULSE)
+    json_frame = framing.encode_text(json_text)
+    binary_frame = wire.encode_pulse(PULSE, 1, PULSE["timestamp"])
+    red = (100000 + np.cumsum(np.random.default_rng(0).integers(-40, 40, 25))).astype(np.int32)
+    raw_frame = wire.encode_raw(red, red + 20000, 0, 1, 25.0, 2, PULSE["timestamp"])
+
+    results = {
+        "json": {
+            "bytes": len(json_frame),
+            "encode": measure(lambda: framing.encode_text(json.dumps(PULSE)), repeat),
+            "decode": measure(lambda: json.loads(decode_all(json_frame)[0][1]), repeat),
+        },
+        "bin1": {
+            "bytes": len(binary_frame),
+            "encode": measure(lambda: wire.encode_pulse(PULSE, 1, PULSE["timestamp"]), repeat),
+            "decode": measure(lambda: decode_all(binary_frame), repeat),
+        },
+        "raw_25_samples": {
+            "bytes": len(raw_frame),
+            "encode": measure(lambda: wire.encode_raw(red, red + 20000, 0, 1, 25.0, 2, 0.0), repeat),
+            "decode": measure(lambda: decode_all(raw_frame), repeat),
+        },
+    }
+
+    # a long stream parsed in one go, as after a burst of recv()s
+    for name, frame in (("json", json_frame), ("bin1", binary_frame)):
+        stream = frame * packets
+        start = time.perf_counter()
+        frames = decode_all(stream)
+        if name == "json":
+            frames = [json.loads(text) for _, text in frames]
+        elapsed = time.perf_counter() - start
+        assert len(frames) == packets
+        results[name]["stream_per_packet_us"] = elapsed / packets * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_json_argument(parser)
+    args = parser.parse_args()
+    results = run(args.quick)
+    print_results(results)
+    if args.json:
+        write_json(args.json, results, "packets")
+
+
+if __name__ == "__main__":
+    main()
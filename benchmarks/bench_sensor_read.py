@@ -0,0 +1,71 @@
+"""
+Compare per-sample and burst FIFO reads of MAX30102.read_sequential
+against a fake SMBus that counts I2C transactions.
+
+    python benchmarks/bench_sensor_read.py
+    python benchmarks/bench_sensor_read.py --realtime   # CPU use while waiting on samples
+    python benchmarks/bench_sensor_read.py --json results.json
+"""
+import argparse
+import time
+
+from fakes import FakeSMBus, add_server_to_path
+from harness import add_json_argument, write_json
+
+add_server_to_path()
+import max30102  # noqa: E402
+
+
+def bench(burst, amount, repeat, sample_rate=None):
+    bus = FakeSMBus(sample_rate=sample_rate)
+    sensor = max30102.MAX30102(bus=bus)
+    if sample_rate is None:
+        # the fake refills instantly, so there is no fill time to sleep through
+        sensor.sample_rate = float("inf")
+    bus.reset_counters()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(repeat):
+        sensor.read_sequential(amount, burst=burst)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    samples = amount * repeat
+    return {
+        "mode": "burst" if burst else "per-sample",
+        "transactions_per_window": bus.transactions / repeat,
+        "bytes_per_window": bus.bytes_read / repeat,
+        "per_sample_us": elapsed / samples * 1e6,
+        "cpu_percent": 100.0 * cpu / elapsed,
+    }
+
+
+def run(quick=False, amount=100):
+    """Both read paths against the instant fake bus."""
+    repeat = 20 if quick else 200
+    return {r.pop("mode"): r for r in (bench(burst, amount, repeat) for burst in (False, True))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--amount", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--realtime", action="store_true",
+                        help="produce samples at 25 Hz like the configured sensor")
+    add_json_argument(parser)
+    args = parser.parse_args()
+
+    sample_rate = 25 if args.realtime else None
+    repeat = 2 if args.realtime else (20 if args.quick else args.repeat)
+    results = {}
+    for burst in (False, True):
+        r = bench(burst, args.amount, repeat, sample_rate)
+        print("{mode:>10}: {transactions_per_window:7.1f} transactions, "
+              "{bytes_per_window:7.1f} bytes per {amount} samples, "
+              "{per_sample_us:8.1f} us/sample, {cpu_percent:5.1f}% CPU".format(amount=args.amount, **r))
+        results[r.pop("mode")] = r
+    if args.json:
+        write_json(args.json, results, "sensor_read")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Hardware stand-ins used by the benchmarks.
+"""
+import math
+import os
+import sys
+import time
+import types
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(REPO_ROOT, "Server")
+CLIENT_DIR = os.path.join(REPO_ROOT, "Client")
+COMMON_DIR = os.path.join(REPO_ROOT, "Common")
+
+
+def add_common_to_path():
+    """Make the Common/ modules (wire format, framing, codec) importable."""
+    if COMMON_DIR not in sys.path:
+        sys.path.insert(0, COMMON_DIR)
+
+
+def add_server_to_path():
+    """Make the Server/ modules importable and tolerate a missing smbus."""
+    add_common_to_path()  # the acquisition and DSP modules report to Common/instrument.py
+    if SERVER_DIR not in sys.path:
+        sys.path.insert(0, SERVER_DIR)
+    if "smbus" not in sys.modules:
+        try:
+            import smbus  # noqa: F401
+        except ImportError:
+            smbus = types.ModuleType("smbus")
+            smbus.SMBus = FakeSMBus
+            sys.modules["smbus"] = smbus
+
+
+def import_server():
+    """
+    Import Server/server.py on a machine without the sensor: servers
+    made from it open the PULSE_SENSOR backend, default to the simulated one.
+    """
+    add_server_to_path()
+    os.environ.setdefault("PULSE_SENSOR", "sim:seed=0")
+    import server
+    return server
+
+
+def add_client_to_path():
+    """Make the Client/ modules importable (client.py needs Flask)."""
+    if CLIENT_DIR not in sys.path:
+        sys.path.insert(0, CLIENT_DIR)
+
+
+class FakeSMBus:
+    """
+    Minimal MAX30102 register model that counts I2C transactions.
+
+    With `sample_rate` unset the FIFO is refilled whenever it runs empty,
+    so the sensor never makes the reader wait. With a `sample_rate`
+    samples appear in real time, like the real device.
+    """
+
+    FIFO_DEPTH = 32
+
+    def __init__(self, channel=1, sample_rate=None):
+        self.channel = channel
+        self.sample_rate = sample_rate
+        self.transactions = 0
+        self.bytes_read = 0
+        self.fifo = []
+        self.overflow = 0
+        self.sample_index = 0
+        self.last_fill = time.monotonic()
+        self.fifo_read_offset = 0
+        self.read_ptr = 0
+
+    def reset_counters(self):
+        self.transactions = 0
+        self.bytes_read = 0
+
+    def _next_sample(self):
+        t = self.sample_index / 25.0
+        self.sample_index += 1
+        red = int(100000 + 2000 * math.sin(2 * math.pi * 1.2 * t))
+        ir = int(120000 + 3000 * math.sin(2 * math.pi * 1.2 * t))
+        return [(red >> 16) & 0xFF, (red >> 8) & 0xFF, red & 0xFF,
+                (ir >> 16) & 0xFF, (ir >> 8) & 0xFF, ir & 0xFF]
+
+    def _fill(self):
+        if self.sample_rate is None:
+            if not self.fifo:
+                # one short of full: equal pointers would read as an empty FIFO
+                self.fifo = [self._next_sample() for _ in range(self.FIFO_DEPTH - 1)]
+                self.fifo_read_offset = 0
+            return
+        now = time.monotonic()
+        due = int((now - self.last_fill) * self.sample_rate)
+        if due <= 0:
+            return
+        self.last_fill += due / self.sample_rate
+        for _ in range(due):
+            if len(self.fifo) >= self.FIFO_DEPTH:
+                self.overflow = min(self.overflow + 1, 0x1F)
+            else:
+                self.fifo.append(self._next_sample())
+
+    def _register(self, reg):
+        if reg == 0x04:  # FIFO_WR_PTR
+            return (self.read_ptr + len(self.fifo)) % self.FIFO_DEPTH
+        if reg == 0x05:  # OVF_COUNTER
+            return self.overflow
+        if reg == 0x06:  # FIFO_RD_PTR
+            return self.read_ptr
+        return 0
+
+    def _read_fifo_byte(self):
+        if not self.fifo:
+            return 0
+        byte = self.fifo[0][self.fifo_read_offset]
+        self.fifo_read_offset += 1
+        if self.fifo_read_offset == 6:
+            self.fifo.pop(0)
+            self.fifo_read_offset = 0
+            self.read_ptr = (self.read_ptr + 1) % self.FIFO_DEPTH
+            self.overflow = 0
+        return byte
+
+    def read_byte_data(self, address, reg):
+        self.transactions += 1
+        self.bytes_read += 1
+        self._fill()
+        return self._register(reg)
+
+    def read_i2c_block_data(self, address, reg, length):
+        self.transactions += 1
+        self.bytes_read += length
+        self._fill()
+        if reg == 0x07:  # FIFO_DATA
+            return [self._read_fifo_byte() for _ in range(length)]
+        return [self._register(reg + i) for i in range(length)]
+
+    def write_i2c_block_data(self, address, reg, data):
+        self.transactions += 1
+        if reg == 0x09 and data and data[0] & 0x40:  # reset
+            self.fifo = []
+            self.overflow = 0
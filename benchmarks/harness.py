@@ -0,0 +1,134 @@
+"""
+Timing, percentile and JSON helpers shared by the benchmarks.
+
+Every bench_*.py module has a `run(quick=False)` function that returns a
+dict of results; times are in microseconds (keys ending in _us) or
+milliseconds (_ms), sizes in bytes. run_all.py collects them into one
+JSON document and can compare it against an earlier one.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from fakes import REPO_ROOT
+
+NOISY_PREFIXES = ("p95_", "p99_", "max_")
+
+
+def summarize(samples, unit="us"):
+    """Mean and tail percentiles of a list of durations in seconds."""
+    scale = {"us": 1e6, "ms": 1e3}[unit]
+    values = np.asarray(samples, dtype=np.float64) * scale
+    if len(values) == 0:
+        return {"n": 0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "n": int(len(values)),
+        f"mean_{unit}": float(values.mean()),
+        f"p50_{unit}": float(p50),
+        f"p95_{unit}": float(p95),
+        f"p99_{unit}": float(p99),
+        f"max_{unit}": float(values.max()),
+    }
+
+
+def measure(fn, repeat=200, warmup=5, unit="us"):
+    """Call `fn` `repeat` times and summarize the per-call wall time."""
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - start
+    return summarize(samples, unit)
+
+
+def environment():
+    """What the numbers were measured on."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def add_json_argument(parser):
+    parser.add_argument("--json", metavar="PATH",
+                        help="also write the results as JSON ('-' for stdout)")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations")
+
+
+def write_json(path, results, name=None):
+    """Write `results` with the environment to `path` ('-' is stdout)."""
+    document = {"environment": environment(), "benchmarks": {name: results} if name else results}
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if path == "-":
+        sys.stdout.write(text + "\n")
+    else:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+
+
+def print_results(results, indent=""):
+    """Nested results as indented `key: value` lines."""
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print(f"{indent}{key}:")
+            print_results(value, indent + "  ")
+        elif isinstance(value, float):
+            print(f"{indent}{key}: {value:.3f}")
+        else:
+            print(f"{indent}{key}: {value}")
+
+
+def flatten(results, prefix=""):
+    """{"a": {"b_us": 1}} -> {"a.b_us": 1}"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def compare(baseline, current, threshold=0.2):
+    """
+    Timings (keys ending in _us/_ms) that got more than `threshold` slower.
+
+    Only means, medians and single-figure timings are checked; the tail
+    percentiles and maxima are reported but too noisy to gate on.
+
+    Returns:
+        list: (name, baseline value, current value) for each regression.
+    """
+    before = flatten(baseline.get("benchmarks", baseline))
+    after = flatten(current.get("benchmarks", current))
+    regressions = []
+    for name, value in after.items():
+        if not name.endswith(("_us", "_ms")) or name not in before:
+            continue
+        if name.rsplit(".", 1)[-1].startswith(NOISY_PREFIXES):
+            continue
+        old = before[name]
+        if isinstance(old, (int, float)) and old > 0 and value > old * (1 + threshold):
+            regressions.append((name, old, value))
+    return regressions
@@ -0,0 +1,88 @@
+"""
+Run every benchmark and collect the results in one JSON document.
+
+Each benchmark runs in its own process, so module-level state (the
+server's sensor, the client's Flask app) does not leak between them.
+
+    python benchmarks/run_all.py --output results.json
+    python benchmarks/run_all.py --quick --compare baseline.json   # exit 1 on a regression
+    python benchmarks/run_all.py --only dsp packets
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from harness import compare, environment
+
+BENCHMARKS = {
+    "sensor_read": "bench_sensor_read.py",
+    "codec": "bench_codec.py",
+    "dsp": "bench_dsp.py",
+    "packets": "bench_packets.py",
+    "flask": "bench_flask.py",
+    "e2e": "bench_e2e.py",
+}
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_benchmark(script, quick):
+    """Run one benchmark script and return its results, or None if it failed."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "result.json")
+        command = [sys.executable, os.path.join(HERE, script), "--json", path]
+        if quick:
+            command.append("--quick")
+        completed = subprocess.run(command, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if completed.returncode != 0:
+            print(f"{script} failed:\n{completed.stderr}", file=sys.stderr)
+            return None
+        with open(path) as f:
+            return next(iter(json.load(f)["benchmarks"].values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default="-", help="where to write the JSON ('-' for stdout)")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, shorter end-to-end run")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="run just these")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slow-down that counts as a regression (default 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = {}
+    failed = []
+    for name in args.only or BENCHMARKS:
+        print(f"running {name}...", file=sys.stderr)
+        result = run_benchmark(BENCHMARKS[name], args.quick)
+        if result is None:
+            failed.append(name)
+        else:
+            results[name] = result
+
+    document = {"environment": environment(), "quick": args.quick, "benchmarks": results}
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    status = 1 if failed else 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, document, args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.3f} -> {after:.3f} ({after / before - 1:+.0%})", file=sys.stderr)
+        if regressions:
+            status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# -*-coding:utf-8
+
+# The transmitter and receiver are flat script directories, not packages:
+# make their modules importable the way server.py and client.py do.
+# Also the synthetic signals shared by the DSP tests.
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("Common", "Server"):
+    path = os.path.join(REPO_ROOT, directory)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture
+def ppg_windows():
+    """
+    Make seeded synthetic PPG windows in raw MAX30102 counts: a large DC
+    level, a pulse with a harmonic, drift and noise. Returns an
+    (n_windows, seconds * fs) array, rounded to `decimals` when given so
+    that peak heights tie the way quantised ADC data does.
+    """
+    def make(n_windows, seconds=8, fs=100, seed=0, decimals=None):
+        rng = np.random.default_rng(seed)
+        t = np.arange(seconds * fs) / fs
+        bpm = rng.uniform(45, 150, size=(n_windows, 1))
+        phase = rng.uniform(0, 2 * np.pi, size=(n_windows, 1))
+        pulse = np.sin(2 * np.pi * bpm / 60 * t + phase) + 0.5 * np.sin(2 * np.pi * 2.3 * bpm / 60 * t)
+        x = (100000 + rng.uniform(500, 3000, size=(n_windows, 1)) * pulse
+             + rng.uniform(-500, 500, size=(n_windows, 1)) * t + rng.normal(0, 100, size=(n_windows, len(t))))
+        return np.round(x, decimals) if decimals is not None else x
+    return make
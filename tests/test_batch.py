@@ -0,0 +1,52 @@
+# -*-coding:utf-8
+
+# The batched DSP must pick exactly the peaks its single-window counterparts
+# pick (scipy.signal.find_peaks for detect_peaks, hrcalc for calc_hr_and_spo2),
+# including between peaks of equal height, which quantised ADC data is full of.
+
+import numpy as np
+import pytest
+from scipy.signal import find_peaks
+
+import batch
+import hrcalc
+import reference_hrcalc
+
+FS = 100
+N_WINDOWS = 500
+
+
+@pytest.mark.parametrize("decimals", [None, -2, -3])
+def test_detect_peaks_batch_matches_find_peaks(ppg_windows, decimals):
+    signals = ppg_windows(N_WINDOWS, fs=FS, seed=7, decimals=decimals)
+    peak_mask, bpm, ipm, rmssd = batch.detect_peaks_batch(signals, FS)
+    for row, signal in enumerate(signals):
+        expected, _ = find_peaks(signal, distance=FS // 2)
+        assert np.array_equal(np.flatnonzero(peak_mask[row]), expected), f"window {row}"
+
+
+def test_select_by_distance_ties_follow_find_peaks():
+    # plateaus of equal height closer than `distance`: which one survives is scipy's call
+    signal = np.array([0, 3, 0, 3, 0, 3, 0, 1, 0, 3, 0, 3, 0, 2, 0, 3, 0], dtype=np.float64)
+    for distance in (2, 3, 4, 5):
+        peak_mask, *_ = batch.detect_peaks_batch(signal[None, :], distance * 2)
+        expected, _ = find_peaks(signal, distance=distance)
+        assert np.array_equal(np.flatnonzero(peak_mask[0]), expected), f"distance {distance}"
+
+
+def quantised_windows(rng, n_windows, dc):
+    """hrcalc-sized integer windows in 100-count steps: plateaus and equal valleys everywhere."""
+    t = np.arange(hrcalc.BUFFER_SIZE) / hrcalc.SAMPLE_FREQ
+    pulse = np.sin(2 * np.pi * rng.uniform(0.8, 2.5, size=(n_windows, 1)) * t)
+    steps = np.round(pulse * rng.integers(0, 4, size=(n_windows, 1))) + rng.integers(0, 4, size=pulse.shape)
+    return (dc + steps * 100).astype(np.int64)
+
+
+def test_calc_hr_and_spo2_batch_matches_hrcalc():
+    # remove_close_peaks keeps the later of two equal valleys, not find_peaks' choice
+    rng = np.random.default_rng(11)
+    ir, red = quantised_windows(rng, 2000, 120000), quantised_windows(rng, 2000, 100000)
+    hr, hr_valid, spo2, spo2_valid = batch.calc_hr_and_spo2_batch(ir, red)
+    for row in range(len(red)):
+        expected = reference_hrcalc.calc_hr_and_spo2(ir[row].copy(), red[row].copy())
+        assert (hr[row], hr_valid[row], spo2[row], spo2_valid[row]) == expected, f"window {row}"
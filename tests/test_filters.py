@@ -0,0 +1,41 @@
+# -*-coding:utf-8
+
+# FilterBank.apply replaced butter(b, a) + filtfilt with cached second-order
+# sections and sosfiltfilt. The two agree up to the b/a form's rounding
+# error, which this pins, and the streaming filter must not depend on how
+# the signal is chunked.
+
+import numpy as np
+import pytest
+from scipy.signal import butter, filtfilt, sosfilt, sosfilt_zi
+
+from filters import filter_bank
+
+FS = 100
+# accepted |sosfiltfilt - filtfilt|, relative to the largest input sample;
+# measured up to 2.5e-9 on the 0.5 Hz high-pass of 1e5-count PPG windows
+TOLERANCE = 1e-8
+
+
+@pytest.mark.parametrize("btype,cutoff", [("high", 0.5), ("low", 3.0)])
+def test_apply_matches_ba_filtfilt(ppg_windows, btype, cutoff):
+    b, a = butter(5, cutoff / (0.5 * FS), btype=btype)
+    for x in ppg_windows(50, fs=FS, seed=3):
+        deviation = np.max(np.abs(filter_bank.apply(x, btype, cutoff, FS) - filtfilt(b, a, x)))
+        assert deviation <= TOLERANCE * np.max(np.abs(x))
+
+
+def test_apply_highpass_ignores_dc(ppg_windows):
+    # where the two differ, the SOS result is the accurate one: a DC offset barely moves it
+    for x in ppg_windows(10, fs=FS, seed=3):
+        shift = np.max(np.abs(filter_bank.apply(x, "high", 0.5, FS) - filter_bank.apply(x - 100000, "high", 0.5, FS)))
+        assert shift < 1e-6
+
+
+def test_streaming_filter_is_independent_of_chunking(ppg_windows):
+    sos = filter_bank.bandpass_sos(0.5, 3.0, FS)
+    x = ppg_windows(1, seconds=30, fs=FS, seed=3)[0]
+    whole, _ = sosfilt(sos, x, zi=sosfilt_zi(sos) * x[0])
+    stream = filter_bank.stream(sos)
+    chunks = np.split(x, [7, 100, 101, 1250, 2999])
+    assert np.allclose(np.concatenate([stream.process(chunk) for chunk in chunks]), whole, rtol=0, atol=1e-9)
@@ -0,0 +1,88 @@
+# -*-coding:utf-8
+
+# A malformed frame must cost only itself: FrameReader raises FrameError for
+# it and the frames after it still parse.
+
+import struct
+import time
+
+import pytest
+
+import framing
+import wire
+
+
+def good_pulse(seq):
+    return wire.encode_pulse({"beats_per_minute": 70.0}, seq, time.time())
+
+
+def parse_all(data):
+    """Every frame in `data`, and how many FrameErrors were raised on the way."""
+    reader = framing.FrameReader()
+    reader.feed(data)
+    frames, errors = [], 0
+    while True:
+        try:
+            frame = reader.next_frame()
+        except wire.FrameError:
+            errors += 1
+            continue
+        if frame is None:
+            return frames, errors
+        frames.append(frame)
+
+
+@pytest.mark.parametrize("bad", [
+    wire.encode_frame(wire.FRAME_PULSE, b"\x00" * 4, 2, 0.0),
+    wire.encode_frame(wire.FRAME_RAW, b"\x00" * 3, 2, 0.0),
+    wire.encode_frame(wire.FRAME_RAW, struct.pack("<IHBBf", 0, 500, 1, wire.RAW_DELTA16, 25.0) + b"\x00" * 10, 2, 0.0),
+    wire.encode_frame(wire.FRAME_RAW, struct.pack("<IHBBf", 0, 500, 1, wire.RAW_VARINT, 25.0) + b"\x80" * 10, 2, 0.0),
+    b"\xff\xfe\n",
+], ids=["short pulse", "short raw header", "short delta16 raw", "truncated varint raw", "not utf-8"])
+def test_bad_frame_is_dropped_alone(bad):
+    frames, errors = parse_all(good_pulse(1) + bad + good_pulse(3) + framing.encode_text("ACK"))
+    assert errors == 1
+    assert [decoded["seq"] for kind, (frame_type, decoded) in frames[:2]] == [1, 3]
+    assert frames[2] == (framing.TEXT, "ACK")
+
+
+def test_short_pulse_does_not_read_into_the_next_frame():
+    # the next frame's bytes would fill the 16 byte pulse struct if the length were ignored
+    frames, errors = parse_all(wire.encode_frame(wire.FRAME_PULSE, b"\x00" * 8, 1, 0.0) + good_pulse(2))
+    assert errors == 1
+    assert frames[0][1][1]["seq"] == 2
+
+
+def test_many_blank_lines_do_not_recurse():
+    frames, errors = parse_all(b"\n" * 100000 + framing.encode_text("START_SYNC"))
+    assert (frames, errors) == ([(framing.TEXT, "START_SYNC")], 0)
+
+
+def test_command_split_across_recvs_is_one_command():
+    reader = framing.FrameReader()
+    reader.feed(b"START_SYNC 12")
+    assert reader.next_frame() is None
+    assert reader.waiting_for_newline()
+    reader.feed(b"3\n")
+    assert reader.next_frame() == (framing.TEXT, "START_SYNC 123")
+    assert reader.next_frame() is None
+
+
+def test_peer_without_newlines_is_recognised_when_it_goes_quiet():
+    reader = framing.FrameReader()
+    reader.feed(b"ACK")
+    assert reader.next_frame() is None
+    # what the owner does after LINE_TIMEOUT without the newline
+    assert reader.take_unterminated() == (framing.TEXT, "ACK")
+    reader.feed(b"STOP")
+    assert reader.next_frame() == (framing.TEXT, "STOP")
+
+
+def test_newline_peer_never_falls_back():
+    reader = framing.FrameReader()
+    reader.feed(b"ACK\nSTART_")
+    assert reader.next_frame() == (framing.TEXT, "ACK")
+    assert not reader.waiting_for_newline()
+    assert reader.take_unterminated() is None
+    reader.feed(b"SYNC\n")
+    assert reader.next_frame() == (framing.TEXT, "START_SYNC")
@@ -0,0 +1,65 @@
+# -*-coding:utf-8
+
+# The vectorized hrcalc must return exactly what the original loops did
+# (reference_hrcalc.py), values and types, on seeded synthetic windows.
+
+import numpy as np
+import pytest
+
+import hrcalc
+import reference_hrcalc
+
+N_WINDOWS = 1500
+
+
+def synthetic_window(rng):
+    """100 samples of integer PPG-like red/ir data, with the awkward cases mixed in."""
+    n = hrcalc.BUFFER_SIZE
+    t = np.arange(n) / hrcalc.SAMPLE_FREQ
+    bpm = rng.uniform(40, 180)
+    amplitude = rng.uniform(50, 3000)
+    phase = rng.uniform(0, 2 * np.pi)
+    pulse = np.sin(2 * np.pi * bpm / 60 * t + phase) + 0.3 * np.sin(4 * np.pi * bpm / 60 * t + phase)
+    drift = rng.uniform(-500, 500) * t / t[-1]
+    ir = 100000 + amplitude * pulse + drift + rng.normal(0, rng.uniform(0, 200), n)
+    red = 80000 + 0.7 * amplitude * pulse + drift + rng.normal(0, rng.uniform(0, 200), n)
+    kind = rng.integers(4)
+    if kind == 1:
+        # quantised: long plateaus and equal-height peaks
+        step = rng.integers(50, 800)
+        ir, red = np.round(ir / step) * step, np.round(red / step) * step
+    elif kind == 2:
+        # clipped at the ADC's ceiling
+        ceiling = np.percentile(red, rng.uniform(60, 95))
+        ir, red = np.minimum(ir, ceiling + 20000), np.minimum(red, ceiling)
+    elif kind == 3:
+        # noise only, few or no peaks
+        ir = 100000 + rng.normal(0, 30, n)
+        red = 80000 + rng.normal(0, 30, n)
+    return ir.astype(np.int64), red.astype(np.int64)
+
+
+def test_calc_hr_and_spo2_matches_reference():
+    rng = np.random.default_rng(20260101)
+    checked = 0
+    for _ in range(N_WINDOWS):
+        ir, red = synthetic_window(rng)
+        expected = reference_hrcalc.calc_hr_and_spo2(ir.copy(), red.copy())
+        actual = hrcalc.calc_hr_and_spo2(ir.copy(), red.copy())
+        assert actual == expected
+        assert [type(value) for value in actual] == [type(value) for value in expected]
+        checked += expected[1] or expected[3]
+    # the windows must exercise the hr and spo2 paths, not only the -999 ones
+    assert checked > N_WINDOWS // 3
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_find_peaks_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(200):
+        x = rng.integers(-5, 80, size=hrcalc.BUFFER_SIZE)  # small range: many ties and plateaus
+        min_height = int(rng.integers(20, 60))
+        expected_locs, expected_n = reference_hrcalc.find_peaks(list(x), hrcalc.BUFFER_SIZE, min_height, 4, 15)
+        actual_locs, actual_n = hrcalc.find_peaks(x, hrcalc.BUFFER_SIZE, min_height, 4, 15)
+        assert actual_n == expected_n
+        assert list(actual_locs[:actual_n]) == list(expected_locs[:expected_n])
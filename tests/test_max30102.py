@@ -0,0 +1,35 @@
+# -*-coding:utf-8
+
+# FIFO accounting of the burst reads, against the simulated MAX30102.
+
+import time
+
+import pytest
+
+import max30102
+from sensor_sim import SimulatedBus, SyntheticPPG
+
+
+def filled_sensor(samples):
+    """A driver on a simulated bus whose FIFO received `samples` samples and then stopped sampling."""
+    bus = SimulatedBus(SyntheticPPG(seed=1))
+    bus.running = True
+    bus.started = time.monotonic() - (samples + 0.5) / bus.sample_rate
+    bus.read_byte_data(0x57, max30102.REG_PART_ID)  # fills the FIFO
+    bus.running = False
+    sensor = max30102.MAX30102.__new__(max30102.MAX30102)  # skips reset() and its 1 s wait
+    sensor.address, sensor.bus, sensor.dropped_samples = 0x57, bus, 0
+    return sensor
+
+
+@pytest.mark.parametrize("samples,expected,dropped", [
+    (0, 0, 0), (5, 5, 0), (31, 31, 0),
+    (32, 32, 0),  # pointers equal, no overflow yet: only A_FULL tells it from empty
+    (40, 32, 8),
+])
+def test_read_fifo_burst_drains_the_fifo(samples, expected, dropped):
+    sensor = filled_sensor(samples)
+    red, ir = sensor.read_fifo_burst()
+    assert (len(red), len(ir), sensor.dropped_samples) == (expected, expected, dropped)
+    # and the drained FIFO reads as empty again
+    assert sensor.get_fifo_status() == (0, 0)
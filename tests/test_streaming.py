@@ -0,0 +1,27 @@
+# -*-coding:utf-8
+
+# hrstd is what the dashboard labels it: the spread of the per-window bpm,
+# over the last HRSTD_WINDOWS windows, as before the streaming engine.
+
+import numpy as np
+
+import streaming
+
+FS = 25
+
+
+def test_hrstd_is_the_std_of_the_reported_bpm():
+    engine = streaming.StreamingMetricEngine(fs=FS)
+    rng = np.random.default_rng(5)
+    t = np.arange(40 * FS) / FS
+    bpm = 60 + 25 * t / t[-1]  # a slowly rising heart rate, so the windows disagree
+    ir = 100000 + 2000 * np.sin(2 * np.pi * np.cumsum(bpm / 60) / FS) + rng.normal(0, 50, len(t))
+    reported = []
+    for hop in np.split(ir, len(ir) // FS):
+        metrics = engine.update(hop)
+        reported.append(metrics["bpm"])
+        if len(reported) < 3:
+            assert metrics["hrstd"] is None
+        else:
+            assert metrics["hrstd"] == np.std(reported[-streaming.HRSTD_WINDOWS:])
+    assert metrics["hrstd"] > 0